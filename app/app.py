@@ -1,10 +1,10 @@
 """Flask application factory and HTTP API for BNetdisk."""
 from __future__ import annotations
 
-import io
-import os
-import queue
+import json
+from itertools import islice
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from flask import Flask, Response, jsonify, render_template, request
 
@@ -16,28 +16,36 @@ from .config import (
     BACKUP_RATE,
     MAX_LIST_ENTRIES,
     MAX_LOG_LINES,
+    MAX_LOG_PAGE,
+    MOUNT_CACHE_TTL,
     SERVICE_LOG,
     SSE_KEEPALIVE_SECONDS,
+    TREE_INDEX,
     VIDEO_EXTS,
 )
+from .filters import is_video as is_video_name
+from .listing_cache import SORTS as LISTING_SORTS, cursor_position, encode_cursor
 from .paths import (
+    MountTable,
     build_dest_final,
-    discover_mount_points,
-    is_allowed_path,
     normalize_roots,
     parse_allowed_roots_env,
     path_under_root,
 )
+from .bulk import parse_task_options
+from .events import parse_level
+from .scheduler import TaskQueue
 from .worker import BackupWorker
 
 BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+mount_table = MountTable(ttl=MOUNT_CACHE_TTL)
 
 
 def _discover_mount_points_safe(limit: int = 200):
     try:
-        points = discover_mount_points()
+        points = mount_table.points()
         return [str(path) for path in points][:limit]
     except Exception as exc:  # noqa: BLE001
         print(f'[WARN] discover_mount_points failed: {exc}', flush=True)
@@ -49,7 +57,7 @@ if ALLOWED_ROOTS_ENV:
 else:
     ALLOWED_ROOTS = normalize_roots(_discover_mount_points_safe())
 
-task_queue: queue.Queue = queue.Queue()
+task_queue = TaskQueue()
 worker = BackupWorker(
     task_queue,
     BACKUP_DIR,
@@ -57,6 +65,8 @@ worker = BackupWorker(
     ops_per_sec=BACKUP_RATE,
     service_log_path=SERVICE_LOG,
     strict_allowed=bool(ALLOWED_ROOTS_ENV),
+    index_path=TREE_INDEX,
+    mount_table=mount_table,
 )
 worker.start()
 
@@ -64,9 +74,8 @@ worker.start()
 def _allowed(path: Path) -> bool:
     # When ALLOWED_ROOTS is explicitly configured, do not expand via live mounts.
     # That keeps sandboxing predictable and prevents accidental access outside the allow-list.
-    if ALLOWED_ROOTS_ENV:
-        return is_allowed_path(path, ALLOWED_ROOTS)
-    return is_allowed_path(path, ALLOWED_ROOTS, normalize_roots(_discover_mount_points_safe()))
+    # worker.allow_list is built that way (strict_allowed) and caches resolved roots.
+    return worker.allow_list.allows(path)
 
 
 def _safe_int(value, default: int, minimum: int = 1, maximum: int = 100) -> int:
@@ -77,26 +86,6 @@ def _safe_int(value, default: int, minimum: int = 1, maximum: int = 100) -> int:
     return max(minimum, min(maximum, number))
 
 
-def tail_file_lines(path: Path, lines: int = 100):
-    lines = min(lines, MAX_LOG_LINES)
-    if not path.exists():
-        return []
-    try:
-        with open(path, 'rb') as handle:
-            to_read = lines * 200
-            handle.seek(0, io.SEEK_END)
-            size = handle.tell()
-            handle.seek(max(0, size - to_read))
-            data = handle.read().decode('utf-8', errors='ignore')
-        return data.splitlines()[-lines:]
-    except OSError:
-        try:
-            with open(path, 'r', encoding='utf-8', errors='ignore') as handle:
-                return handle.readlines()[-lines:]
-        except OSError:
-            return []
-
-
 @app.route('/')
 def index():
     if ALLOWED_ROOTS_ENV and ALLOWED_ROOTS:
@@ -136,30 +125,44 @@ def api_meta():
     })
 
 
+RATE_FIELDS = ('ops_per_sec', 'readdir_per_sec', 'stat_per_sec', 'write_per_sec', 'burst', 'adaptive')
+
+
 @app.route('/api/rate', methods=['GET', 'POST'])
 def api_rate():
     if request.method == 'GET':
-        return jsonify({
-            'ops_per_sec': worker.get_rate(),
+        info = worker.get_rate_info()
+        info.update({
             'default_ops_per_sec': BACKUP_RATE,
             'min': 0,
             'max': 5000,
-            'hint': 'Rate limits SOURCE directory scan (files/sec). Protects cloud mounts from aggressive readdir/stat. 0 = unlimited.',
+            'hint': 'Token-bucket budget for SOURCE readdir/stat calls (ops/sec, with burst). '
+                    'Protects cloud mounts; backs off automatically when mount latency rises. 0 = unlimited.',
         })
+        return jsonify(info)
 
     payload = request.get_json(silent=True) or {}
-    raw = payload.get('ops_per_sec', payload.get('rate', request.args.get('ops_per_sec')))
-    if raw is None:
+    params = {}
+    for field in RATE_FIELDS:
+        value = payload.get(field, request.args.get(field))
+        if value is not None:
+            params[field] = value
+    if 'ops_per_sec' not in params and payload.get('rate') is not None:
+        params['ops_per_sec'] = payload['rate']
+    if not params:
         return jsonify({'error': 'missing ops_per_sec', 'ops_per_sec': worker.get_rate()}), 400
+    if 'adaptive' in params and isinstance(params['adaptive'], str):
+        params['adaptive'] = params['adaptive'].lower() in ('1', 'true', 'yes', 'on')
     try:
-        applied = worker.set_rate(raw)
+        info = worker.configure_rate(**params)
     except ValueError as exc:
         return jsonify({'error': str(exc), 'ops_per_sec': worker.get_rate()}), 400
-    return jsonify({
+    applied = info['ops_per_sec']
+    info.update({
         'ok': True,
-        'ops_per_sec': applied,
-        'message': 'unlimited' if applied <= 0 else f'{applied:g} files/sec',
+        'message': 'unlimited' if applied <= 0 else f'{applied:g} ops/sec',
     })
+    return jsonify(info)
 
 
 @app.route('/api/roots')
@@ -174,8 +177,19 @@ def api_roots():
         return jsonify({'roots': [], 'count': 0, 'error': str(exc)}), 500
 
 
+def _truthy(value) -> bool:
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 @app.route('/api/listdir')
 def listdir():
+    """One page of a directory, directories first.
+
+    Query: ``cursor`` (from the previous page's ``next_cursor``), ``limit``, ``sort``
+    (``name`` / ``name_desc``), ``videos_only``, ``prefix`` (case-insensitive), ``refresh``
+    (bypass the listing cache) and ``format=ndjson`` to stream one entry per line
+    (no page limit unless ``limit`` is given).
+    """
     path = request.args.get('path')
     if not path:
         return jsonify({'error': 'missing path'}), 400
@@ -186,48 +200,150 @@ def listdir():
     if not target.exists() or not target.is_dir():
         return jsonify({'error': 'not exists or not dir'}), 400
 
-    entries = []
+    sort = request.args.get('sort', 'name')
+    if sort not in LISTING_SORTS:
+        return jsonify({'error': f'sort must be one of {", ".join(LISTING_SORTS)}'}), 400
+    ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    if ndjson and 'limit' not in request.args:
+        limit = 0
+    else:
+        limit = _safe_int(request.args.get('limit'), MAX_LIST_ENTRIES, 1, MAX_LIST_ENTRIES)
+    videos_only = _truthy(request.args.get('videos_only'))
+    prefix = (request.args.get('prefix') or '').lower()
+
+    cache = worker.listing_cache
+    if _truthy(request.args.get('refresh')):
+        cache.invalidate(str(target))
     try:
-        with os.scandir(target) as iterator:
-            for entry in iterator:
-                if len(entries) >= MAX_LIST_ENTRIES:
+        listing = cache.get(str(target))
+        start = cursor_position(listing, sort, request.args.get('cursor'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    except OSError as exc:
+        return jsonify({'error': str(exc)}), 500
+    entries, _positions = listing.view(sort)
+
+    def page():
+        """Yield ``(entry_dict, cursor_after_it)`` for matching entries from ``start``."""
+        emitted = 0
+        for is_dir, name in islice(entries, start, None):
+            is_video = (not is_dir) and is_video_name(name)
+            if prefix and not name.lower().startswith(prefix):
+                continue
+            if videos_only and not is_dir and not is_video:
+                continue
+            if limit and emitted >= limit:
+                # There is at least one more match: the caller needs a cursor.
+                yield None, None
+                return
+            emitted += 1
+            yield {
+                'name': name,
+                'path': str(target / name),
+                'is_dir': is_dir,
+                'is_video': is_video,
+            }, (is_dir, name)
+
+    if ndjson:
+        def generate():
+            yield json.dumps({'path': str(target), 'total': len(entries), 'sort': sort}, ensure_ascii=False) + '\n'
+            count = 0
+            last = None
+            more = False
+            chunk = []
+            for entry, last_key in page():
+                if entry is None:
+                    more = True
                     break
-                try:
-                    is_dir = entry.is_dir(follow_symlinks=False)
-                except OSError:
-                    is_dir = False
-                entries.append({
-                    'name': entry.name,
-                    'path': str(Path(target) / entry.name),
-                    'is_dir': is_dir,
-                    'is_video': (not is_dir) and BackupWorker.is_video_file(entry.name),
-                })
-    except OSError:
-        try:
-            for name in os.listdir(target)[:MAX_LIST_ENTRIES]:
-                entry_path = target / name
-                try:
-                    is_dir = entry_path.is_dir()
-                except OSError:
-                    is_dir = False
-                entries.append({
-                    'name': name,
-                    'path': str(entry_path),
-                    'is_dir': is_dir,
-                    'is_video': (not is_dir) and BackupWorker.is_video_file(name),
-                })
-        except OSError as exc:
-            return jsonify({'error': str(exc)}), 500
-
-    entries.sort(key=lambda item: (not item['is_dir'], item['name'].lower()))
+                count += 1
+                last = last_key
+                chunk.append(json.dumps(entry, ensure_ascii=False))
+                if len(chunk) >= 500:
+                    yield '\n'.join(chunk) + '\n'
+                    chunk = []
+            if chunk:
+                yield '\n'.join(chunk) + '\n'
+            yield json.dumps({
+                'done': True,
+                'count': count,
+                'next_cursor': encode_cursor(*last) if more and last else None,
+            }) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+    items = []
+    last = None
+    more = False
+    for entry, last_key in page():
+        if entry is None:
+            more = True
+            break
+        items.append(entry)
+        last = last_key
     return jsonify({
         'path': str(target),
-        'entries': entries,
-        'count': len(entries),
-        'truncated': len(entries) >= MAX_LIST_ENTRIES,
+        'entries': items,
+        'count': len(items),
+        'total': len(entries),
+        'next_cursor': encode_cursor(*last) if more and last else None,
+        # Kept for older clients: the page ended before the directory did.
+        'truncated': more,
     })
 
 
+def _prepare_task(task, payload: Dict, videos_only: bool) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """Validate one submitted task; returns ``(worker arguments, None)`` or ``(None, skip entry)``.
+
+    Creates the destination directory on success (except for a plan, which only reads it).
+    """
+    if not isinstance(task, dict):
+        return None, {'task': task, 'reason': 'invalid task object'}
+
+    try:
+        src = Path(task.get('src', '')).resolve()
+        dst = Path(task.get('dst', '')).resolve()
+    except (OSError, RuntimeError, TypeError, ValueError):
+        return None, {'task': task, 'reason': 'invalid path'}
+
+    options, reason = parse_task_options(task, payload, videos_only)
+    if options is None:
+        return None, {'task': task, 'reason': reason}
+
+    dest_final = build_dest_final(src, dst)
+    pair = {'src': str(src), 'dst': str(dst)}
+
+    try:
+        if src == dst:
+            worker.broadcast(f'[WARN] Skipping task because src and dst are identical: {src}')
+            return None, {'task': pair, 'reason': 'src and dst identical'}
+        if dest_final.resolve() == src.resolve() or path_under_root(dest_final, src):
+            worker.broadcast(
+                f'[WARN] Skipping task because destination would be inside or equal to source: {dest_final}'
+            )
+            return None, {'task': pair, 'reason': 'destination would be inside source or identical'}
+    except (OSError, RuntimeError):
+        worker.broadcast(f'[WARN] Path resolution error for {src} or {dst}, skipping')
+        return None, {'task': pair, 'reason': 'path resolution error'}
+
+    if not _allowed(src) or not _allowed(dst):
+        worker.broadcast(f'[WARN] Skipping task due to path not allowed: {src} or {dst}')
+        return None, {'task': pair, 'reason': 'path not allowed'}
+
+    if not src.exists() or not src.is_dir():
+        worker.broadcast(f'[WARN] Skipping task because src missing or not dir: {src}')
+        return None, {'task': pair, 'reason': 'src does not exist or not dir'}
+
+    try:
+        # A plan only reads the destination; it is created when the plan is applied.
+        if options['mode'] != 'plan':
+            dest_final.mkdir(parents=True, exist_ok=True)
+    except OSError as exc:
+        worker.broadcast(f'[WARN] Cannot create dst {dest_final}: {exc}')
+        return None, {'task': pair, 'reason': f'cannot create dst: {exc}'}
+
+    return dict(options, src=src, dst=dest_final), None
+
+
 @app.route('/api/add', methods=['POST'])
 def api_add():
     payload = request.get_json(silent=True) or {}
@@ -238,107 +354,294 @@ def api_add():
     videos_only = bool(payload.get('videos_only', True))
     added = 0
     skipped = []
+    merged = []
 
     for task in tasks:
-        if not isinstance(task, dict):
-            skipped.append({'task': task, 'reason': 'invalid task object'})
+        prepared, skip = _prepare_task(task, payload, videos_only)
+        if prepared is None:
+            skipped.append(skip)
             continue
-
-        try:
-            src = Path(task.get('src', '')).resolve()
-            dst = Path(task.get('dst', '')).resolve()
-        except (OSError, RuntimeError, TypeError, ValueError):
-            skipped.append({'task': task, 'reason': 'invalid path'})
+        merges: List[Dict] = []
+        state = worker.add_task(mirror=False, merges=merges, **prepared)
+        folded = [merge for merge in merges if merge['reason'] != 'absorbed']
+        if folded:
+            merged.append({'src': str(prepared['src']), 'into': state.id, 'reason': folded[0]['reason']})
             continue
+        added += 1
 
-        mode = task.get('mode', 'incremental')
-        if mode not in ('incremental', 'full'):
-            mode = 'incremental'
+    return jsonify({
+        'added': added,
+        'merged': merged,
+        'skipped': skipped,
+        'videos_only': videos_only,
+    })
 
-        dest_final = build_dest_final(src, dst)
 
-        try:
-            if src == dst:
-                skipped.append({
-                    'task': {'src': str(src), 'dst': str(dst)},
-                    'reason': 'src and dst identical',
-                })
-                worker.broadcast(f'[WARN] Skipping task because src and dst are identical: {src}')
-                continue
-            if dest_final.resolve() == src.resolve() or path_under_root(dest_final, src):
-                skipped.append({
-                    'task': {'src': str(src), 'dst': str(dst)},
-                    'reason': 'destination would be inside source or identical',
-                })
-                worker.broadcast(
-                    f'[WARN] Skipping task because destination would be inside or equal to source: {dest_final}'
-                )
-                continue
-        except (OSError, RuntimeError):
-            skipped.append({
-                'task': {'src': str(src), 'dst': str(dst)},
-                'reason': 'path resolution error',
-            })
-            worker.broadcast(f'[WARN] Path resolution error for {src} or {dst}, skipping')
-            continue
+@app.route('/api/bulk', methods=['GET', 'POST'])
+def api_bulk():
+    """Accept many tasks at once; validation and queueing happen in the background."""
+    if request.method == 'GET':
+        return jsonify({'batches': worker.get_bulk_batches()})
+    payload = request.get_json(silent=True) or {}
+    try:
+        batch = worker.submit_bulk(payload)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify({'ok': True, 'batch': batch}), 202
 
-        if not _allowed(src) or not _allowed(dst):
-            skipped.append({
-                'task': {'src': str(src), 'dst': str(dst)},
-                'reason': 'path not allowed',
-            })
-            worker.broadcast(f'[WARN] Skipping task due to path not allowed: {src} or {dst}')
-            continue
 
-        if not src.exists() or not src.is_dir():
-            skipped.append({
-                'task': {'src': str(src), 'dst': str(dst)},
-                'reason': 'src does not exist or not dir',
-            })
-            worker.broadcast(f'[WARN] Skipping task because src missing or not dir: {src}')
-            continue
+@app.route('/api/bulk/<batch_id>')
+def api_bulk_status(batch_id: str):
+    batch = worker.get_bulk(batch_id)
+    if batch is None:
+        return jsonify({'error': 'batch not found'}), 404
+    return jsonify({'batch': batch})
 
-        try:
-            dest_final.mkdir(parents=True, exist_ok=True)
-        except OSError as exc:
-            skipped.append({
-                'task': {'src': str(src), 'dst': str(dst)},
-                'reason': f'cannot create dst: {exc}',
-            })
-            worker.broadcast(f'[WARN] Cannot create dst {dest_final}: {exc}')
-            continue
 
-        worker.add_task(
-            src,
-            dest_final,
+@app.route('/api/watches', methods=['GET', 'POST'])
+def api_watches():
+    if request.method == 'GET':
+        return jsonify({'watches': worker.get_watches()})
+    payload = request.get_json(silent=True) or {}
+    videos_only = bool(payload.get('videos_only', True))
+    prepared, skip = _prepare_task(payload, {}, videos_only)
+    if prepared is None:
+        return jsonify({'error': skip['reason'], 'skipped': skip}), 400
+    try:
+        watch = worker.add_watch(
+            prepared['src'],
+            prepared['dst'],
             videos_only=videos_only,
-            mirror=False,
-            mode=mode,
+            orphans=prepared['orphans'],
+            filters=prepared['filters'],
         )
-        added += 1
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 409
+    return jsonify({'ok': True, 'watch': watch})
+
+
+@app.route('/api/watches/<watch_id>', methods=['DELETE'])
+def api_watch_delete(watch_id: str):
+    watch = worker.remove_watch(watch_id)
+    if watch is None:
+        return jsonify({'error': 'watch not found'}), 404
+    return jsonify({'ok': True, 'watch': watch})
+
+
+@app.route('/api/schedules', methods=['GET', 'POST'])
+def api_schedules():
+    if request.method == 'GET':
+        return jsonify({'schedules': worker.get_schedules()})
+    payload = request.get_json(silent=True) or {}
+    videos_only = bool(payload.get('videos_only', True))
+    prepared, skip = _prepare_task(payload, {}, videos_only)
+    if prepared is None:
+        return jsonify({'error': skip['reason'], 'skipped': skip}), 400
+    prepared['src'] = str(prepared['src'])
+    prepared['dst'] = str(prepared['dst'])
+    try:
+        job = worker.add_schedule(
+            prepared,
+            every=payload.get('every'),
+            cron=payload.get('cron'),
+            window=payload.get('window'),
+            rate=payload.get('rate'),
+        )
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify({'ok': True, 'schedule': job})
+
+
+@app.route('/api/schedules/<job_id>', methods=['DELETE'])
+def api_schedule_delete(job_id: str):
+    job = worker.remove_schedule(job_id)
+    if job is None:
+        return jsonify({'error': 'schedule not found'}), 404
+    return jsonify({'ok': True, 'schedule': job})
+
+
+@app.route('/api/schedules/<job_id>/<action>', methods=['POST'])
+def api_schedule_action(job_id: str, action: str):
+    handlers = {
+        'run': worker.run_schedule,
+        'enable': lambda item: worker.set_schedule_enabled(item, True),
+        'disable': lambda item: worker.set_schedule_enabled(item, False),
+    }
+    handler = handlers.get(action)
+    if handler is None:
+        return jsonify({'error': f'unknown action: {action}'}), 400
+    job = handler(job_id)
+    if job is None:
+        return jsonify({'error': 'schedule not found'}), 404
+    return jsonify({'ok': True, 'schedule': job})
+
+
+@app.route('/api/plans')
+def api_plans():
+    return jsonify({'plans': worker.get_plans()})
+
+
+@app.route('/api/plans/<plan_id>', methods=['GET', 'DELETE'])
+def api_plan(plan_id: str):
+    if request.method == 'DELETE':
+        try:
+            plan = worker.delete_plan(plan_id)
+        except ValueError as exc:
+            return jsonify({'error': str(exc)}), 409
+    else:
+        plan = worker.get_plan(plan_id)
+    if plan is None:
+        return jsonify({'error': 'plan not found'}), 404
+    return jsonify({'ok': True, 'plan': plan})
+
+
+@app.route('/api/plans/<plan_id>/manifest')
+def api_plan_manifest(plan_id: str):
+    """Stream the plan's NDJSON manifest (a running plan as far as it has got)."""
+    if worker.get_plan(plan_id) is None:
+        return jsonify({'error': 'plan not found'}), 404
+    try:
+        lines = worker.plans.lines(plan_id)
+        first = next(lines, None)
+    except OSError:
+        return jsonify({'error': 'plan manifest not found'}), 404
+
+    def generate():
+        if first is not None:
+            yield first
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= 500:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/plans/<plan_id>/apply', methods=['POST'])
+def api_plan_apply(plan_id: str):
+    payload = request.get_json(silent=True) or {}
+    try:
+        priority = max(-100, min(100, int(payload.get('priority', 0))))
+    except (TypeError, ValueError):
+        priority = 0
+    try:
+        state = worker.apply_plan(plan_id, priority)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 409
+    if state is None:
+        return jsonify({'error': 'plan not found'}), 404
+    return jsonify({'ok': True, 'task': state.to_dict()})
+
+
+@app.route('/api/manifests', methods=['GET', 'POST'])
+def api_manifests():
+    """List uploaded manifests, or upload one (raw request body or a multipart ``file``)."""
+    if request.method == 'GET':
+        return jsonify({'manifests': worker.get_manifests()})
+    fmt = request.args.get('format') or None
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, name = upload.stream, upload.filename or ''
+    else:
+        stream, name = request.stream, request.args.get('name', '')
+    try:
+        manifest = worker.upload_manifest(stream, fmt, name)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    except OSError as exc:
+        return jsonify({'error': f'cannot store manifest: {exc}'}), 500
+    return jsonify({'ok': True, 'manifest': manifest})
 
-    return jsonify({
-        'added': added,
-        'skipped': skipped,
-        'videos_only': videos_only,
-    })
+
+@app.route('/api/manifests/<manifest_id>', methods=['DELETE'])
+def api_manifest_delete(manifest_id: str):
+    manifest = worker.delete_manifest(manifest_id)
+    if manifest is None:
+        return jsonify({'error': 'manifest not found'}), 404
+    return jsonify({'ok': True, 'manifest': manifest})
+
+
+@app.route('/api/manifests/<manifest_id>/import', methods=['POST'])
+def api_manifest_import(manifest_id: str):
+    payload = request.get_json(silent=True) or {}
+    videos_only = bool(payload.get('videos_only', True))
+    options, reason = parse_task_options(payload, {}, videos_only)
+    if options is None:
+        return jsonify({'error': reason}), 400
+    try:
+        dst = Path(payload.get('dst', '')).resolve()
+    except (OSError, RuntimeError, TypeError, ValueError):
+        return jsonify({'error': 'invalid dst'}), 400
+    if not payload.get('dst') or not _allowed(dst):
+        return jsonify({'error': 'dst not allowed'}), 400
+    try:
+        dst.mkdir(parents=True, exist_ok=True)
+    except OSError as exc:
+        return jsonify({'error': f'cannot create dst: {exc}'}), 400
+    state = worker.import_manifest(
+        manifest_id, dst, src=payload.get('src') or None, videos_only=videos_only,
+        filters=options['filters'], priority=options['priority'],
+    )
+    if state is None:
+        return jsonify({'error': 'manifest not found'}), 404
+    return jsonify({'ok': True, 'task': state.to_dict()})
+
+
+@app.route('/api/walks')
+def api_walks():
+    return jsonify({'walks': worker.get_walks()})
+
+
+@app.route('/api/walks/export')
+def api_walks_export():
+    """Stream the file manifest of a completed walk (``src`` and ``dst`` as in ``/api/walks``)."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    chunks = worker.export_walk(request.args.get('src', ''), request.args.get('dst', ''), fmt)
+    if chunks is None:
+        return jsonify({'error': 'no completed walk for this src and dst'}), 404
+    if fmt == 'csv':
+        return Response(chunks, mimetype='application/gzip', headers={
+            'Content-Disposition': 'attachment; filename="manifest.csv.gz"', 'X-Accel-Buffering': 'no',
+        })
+    return Response(chunks, mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
 
 
 @app.route('/api/queue')
 def api_queue():
-    items = []
-    with task_queue.mutex:
-        for item in list(task_queue.queue):
-            items.append(item)
+    items = worker.get_queue()
     status = worker.get_status()
     return jsonify({
         'queue': items,
         'size': len(items),
         'current': status.get('current'),
+        'running': status.get('tasks'),
         'last_result': status.get('last_result'),
+        'merges': worker.get_merges(),
     })
 
 
+@app.route('/api/tasks/<task_id>/<action>', methods=['POST'])
+def api_task_action(task_id: str, action: str):
+    handlers = {
+        'cancel': worker.cancel_task,
+        'pause': worker.pause_task,
+        'resume': worker.resume_task,
+    }
+    handler = handlers.get(action)
+    if handler is None:
+        return jsonify({'error': f'unknown action: {action}'}), 400
+    task = handler(task_id)
+    if task is None:
+        return jsonify({'error': 'task not found'}), 404
+    return jsonify({'ok': True, 'task': task})
+
+
 @app.route('/api/status')
 def api_status():
     return jsonify(worker.get_status())
@@ -346,32 +649,52 @@ def api_status():
 
 @app.route('/api/logs')
 def api_logs():
-    count = _safe_int(request.args.get('n', str(MAX_LOG_LINES)), MAX_LOG_LINES, 1, MAX_LOG_LINES)
-    return jsonify({'lines': tail_file_lines(SERVICE_LOG, count)})
+    count = _safe_int(request.args.get('n'), MAX_LOG_LINES, 1, MAX_LOG_PAGE)
+    level = parse_level(request.args.get('level'), -1) if request.args.get('level') else 0
+    if level < 0:
+        return jsonify({'error': 'level must be DEBUG, INFO, WARN or ERROR'}), 400
+    try:
+        page = worker.query_logs(
+            count,
+            before=request.args.get('before') or None,
+            min_level=level,
+            search=request.args.get('q') or None,
+            task_id=request.args.get('task') or None,
+        )
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(page)
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(worker.metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/stream')
 def stream():
-    def generate(client_q: queue.Queue):
+    events = worker.events
+
+    def generate(cursor: int):
         try:
+            yield 'data: [INFO] connected\n\n'
             while True:
-                try:
-                    msg = client_q.get(timeout=SSE_KEEPALIVE_SECONDS)
-                    yield f'data: {msg}\n\n'
-                except queue.Empty:
+                lines, cursor, dropped = events.read(cursor, SSE_KEEPALIVE_SECONDS)
+                if dropped:
+                    yield f'data: [WARN] {dropped} log lines skipped (connection too slow)\n\n'
+                if not lines:
                     yield ': keepalive\n\n'
+                    continue
+                yield ''.join(f'data: {line}\n\n' for line in lines)
         finally:
-            try:
-                worker.unregister_client(client_q)
-            except Exception:
-                pass
+            events.unsubscribe()
 
-    client_q = worker.register_client()
+    cursor = events.subscribe(history=100)
     headers = {
         'Cache-Control': 'no-cache',
         'X-Accel-Buffering': 'no',
     }
-    return Response(generate(client_q), mimetype='text/event-stream', headers=headers)
+    return Response(generate(cursor), mimetype='text/event-stream', headers=headers)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,259 @@
+"""ASGI entry point: ``/stream`` is served from the event loop, the rest through Flask.
+
+Run with any ASGI server, e.g.::
+
+    uvicorn app.asgi:app --host 0.0.0.0 --port 18008
+
+Under gunicorn every connected dashboard holds one of its few threads for as long as
+the tab is open. Here an SSE client is a coroutine waiting on the event bus, and the
+Flask views (``/api/*``, pages, NDJSON listings) run on a bounded thread pool of
+``ASGI_THREADS`` that SSE clients never occupy. The backup worker is the same one
+``app.app`` starts; its directory walks already run on their own bounded pool.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from .app import app as flask_app
+from .app import worker
+from .config import ASGI_THREADS, SSE_KEEPALIVE_SECONDS
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi-wsgi')
+_feeds: Dict[int, '_EventFeed'] = {}
+
+
+class _EventFeed:
+    """Turns EventBus publishes (from worker threads) into wake-ups on one event loop.
+
+    One bus listener per loop, coalesced: however many lines arrive before the loop runs
+    the callback, waiting clients are woken once and each reads everything new.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._changed = asyncio.Event()
+        self._pending = False
+        worker.events.add_listener(self._on_publish)
+
+    def _on_publish(self) -> None:
+        if self._pending:
+            return
+        self._pending = True
+        try:
+            self._loop.call_soon_threadsafe(self._notify)
+        except RuntimeError:  # loop closed
+            worker.events.remove_listener(self._on_publish)
+
+    def _notify(self) -> None:
+        self._pending = False
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def wait(self, timeout: float):
+        """Awaitable that is True once anything is published after this call, False on timeout."""
+        # Bind the current Event now, not when the coroutine first runs, so a publish
+        # in between is not missed.
+        return self._wait(self._changed, timeout)
+
+    @staticmethod
+    async def _wait(changed: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+def _feed() -> _EventFeed:
+    loop = asyncio.get_running_loop()
+    feed = _feeds.get(id(loop))
+    if feed is None:
+        feed = _feeds[id(loop)] = _EventFeed(loop)
+    return feed
+
+
+async def _watch_disconnect(receive, closed: asyncio.Event) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            closed.set()
+            return
+
+
+async def _stream(scope, receive, send) -> None:
+    events = worker.events
+    feed = _feed()
+    closed = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, closed))
+    cursor = events.subscribe(history=100)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'data: [INFO] connected\n\n', 'more_body': True})
+        while not closed.is_set():
+            lines, cursor, dropped = events.read(cursor, 0)
+            chunk = ''
+            if dropped:
+                chunk += f'data: [WARN] {dropped} log lines skipped (connection too slow)\n\n'
+            if lines:
+                chunk += ''.join(f'data: {line}\n\n' for line in lines)
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+                continue
+            waiter = asyncio.ensure_future(feed.wait(SSE_KEEPALIVE_SECONDS))
+            await asyncio.wait([waiter, watcher], return_when=asyncio.FIRST_COMPLETED)
+            if closed.is_set():
+                waiter.cancel()
+                break
+            if not waiter.result():
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+    except (OSError, asyncio.CancelledError):
+        pass
+    finally:
+        watcher.cancel()
+        events.unsubscribe()
+
+
+class _RequestBody(io.RawIOBase):
+    """``wsgi.input`` fed from the ASGI receive channel as the app reads it.
+
+    Read on an executor thread; each refill waits for the next body message on the event
+    loop, so an upload is never held in memory whole (the server applies backpressure).
+    """
+
+    def __init__(self, receive, loop: asyncio.AbstractEventLoop):
+        self._receive = receive
+        self._loop = loop
+        self._chunk = b''
+        self._offset = 0
+        self._more = True
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self) -> None:
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._more = False
+            raise OSError('client disconnected while sending the request body')
+        self._chunk = message.get('body', b'')
+        self._offset = 0
+        self._more = bool(message.get('more_body'))
+
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._chunk):
+            if not self._more:
+                return 0
+            self._fill()
+        count = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:count] = self._chunk[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+
+def _environ(scope, body) -> Dict:
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    raw_path = scope.get('raw_path')
+    path = raw_path.split(b'?', 1)[0].decode('latin-1') if raw_path else scope['path']
+    root = scope.get('root_path', '')
+    if root and path.startswith(root):
+        path = path[len(root):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root,
+        'PATH_INFO': path,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': str(client[0]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # Without a Content-Length (chunked uploads) the body ends where the stream does.
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def _wsgi(scope, receive, send) -> None:
+    loop = asyncio.get_running_loop()
+    environ = _environ(scope, io.BufferedReader(_RequestBody(receive, loop)))
+    started: Dict = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return lambda data: started.setdefault('written', []).append(data)
+
+    def call():
+        result = flask_app(environ, start_response)
+        return result, iter(result)
+
+    result, body = await loop.run_in_executor(_executor, call)
+    sentinel = object()
+    try:
+        first: Optional[object] = await loop.run_in_executor(_executor, next, body, sentinel)
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        for data in started.pop('written', []):
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        chunk = first
+        # Pull the body chunk by chunk so streamed (NDJSON) responses stay streamed.
+        while chunk is not sentinel:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(_executor, next, body, sentinel)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        close = getattr(result, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(_executor, close)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            worker.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/stream' and scope['method'] == 'GET':
+        await _stream(scope, receive, send)
+    else:
+        await _wsgi(scope, receive, send)
@@ -0,0 +1,353 @@
+"""Reproducible throughput benchmark for BackupWorker on a synthetic slow mount.
+
+Usage::
+
+    python -m app.bench --files 100000 --latency-ms 50 --concurrency 8
+
+Builds a synthetic source tree, wraps it in a latency-injecting stand-in for a remote
+mount, runs ``BackupWorker`` end to end in each requested mode and reports files/sec,
+filesystem call counts and peak RSS.
+
+``--memory-check`` instead puts ``--files`` (default 1,000,000) entries in one flat
+directory, backs it up twice with per-file logging on, and exits non-zero if the
+worker's memory grew by more than ``--max-rss-mb``::
+
+    python -m app.bench --memory-check --max-rss-mb 64
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .scheduler import TaskQueue
+from .worker import BackupWorker
+
+NON_VIDEO_EXTS = ('.nfo', '.jpg', '.srt', '.txt')
+MEMORY_CHECK_FILES = 1000000
+# Documented ceiling for RSS growth while walking a huge flat directory (see README).
+MEMORY_CEILING_MB = 64.0
+
+
+def generate_tree(
+    root: Path,
+    files: int,
+    depth: int = 3,
+    fanout: int = 10,
+    video_ratio: float = 0.6,
+    seed: int = 1,
+) -> Dict[str, int]:
+    """Create ``files`` empty files spread evenly over a ``fanout``-ary tree of ``depth``."""
+    rng = random.Random(seed)
+    root = Path(root)
+    leaves = [root]
+    dir_count = 1
+    for _level in range(max(0, depth)):
+        next_leaves = []
+        for parent in leaves:
+            for index in range(max(1, fanout)):
+                next_leaves.append(parent / f'd{index:03d}')
+        leaves = next_leaves
+        dir_count += len(leaves)
+    for leaf in leaves:
+        leaf.mkdir(parents=True, exist_ok=True)
+    videos = 0
+    for index in range(files):
+        if rng.random() < video_ratio:
+            ext = '.mkv'
+            videos += 1
+        else:
+            ext = rng.choice(NON_VIDEO_EXTS)
+        with open(leaves[index % len(leaves)] / f'f{index:07d}{ext}', 'wb'):
+            pass
+    return {'dirs': dir_count, 'files': files, 'videos': videos}
+
+
+class SlowMount:
+    """Patch ``os`` so calls on paths under ``root`` are slow, and count filesystem calls.
+
+    ``scandir`` and ``stat`` under ``root`` sleep for the configured latency (the costs a
+    rclone/FUSE mount adds); everything else runs at local speed. Calls are counted per
+    function and per side (``src`` for paths under ``root``, ``dst`` otherwise).
+    """
+
+    PATCHED = ('scandir', 'stat', 'listdir', 'open', 'mkdir', 'ftruncate')
+
+    def __init__(self, root: Path, readdir_latency: float = 0.0, stat_latency: float = 0.0):
+        self.root = str(root).rstrip('/')
+        self.readdir_latency = readdir_latency
+        self.stat_latency = stat_latency
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._originals: Dict[str, object] = {}
+
+    def _side(self, path) -> str:
+        if isinstance(path, int):
+            return 'dst'
+        path = os.fsdecode(path)
+        return 'src' if path == self.root or path.startswith(self.root + '/') else 'dst'
+
+    def _wrap(self, name: str):
+        original = self._originals[name]
+        delays = {'scandir': self.readdir_latency, 'stat': self.stat_latency}
+
+        def wrapper(*args, **kwargs):
+            side = self._side(args[0]) if args else 'dst'
+            with self._lock:
+                self.counts[f'{side}.{name}'] += 1
+            delay = delays.get(name, 0.0)
+            if side == 'src' and delay > 0:
+                time.sleep(delay)
+            return original(*args, **kwargs)
+
+        return wrapper
+
+    def __enter__(self) -> 'SlowMount':
+        for name in self.PATCHED:
+            self._originals[name] = getattr(os, name)
+        for name in self.PATCHED:
+            setattr(os, name, self._wrap(name))
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        self._originals.clear()
+
+    def take_counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(sorted(self.counts.items()))
+            self.counts.clear()
+        return counts
+
+
+def peak_rss_mb() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(usage / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def current_rss_mb() -> float:
+    """Resident set size right now (Linux); falls back to the peak elsewhere."""
+    try:
+        with open('/proc/self/statm') as handle:
+            pages = int(handle.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+    return round(pages * resource.getpagesize() / (1024 * 1024), 1)
+
+
+def run_benchmark(
+    files: int = 10000,
+    depth: int = 3,
+    fanout: int = 10,
+    video_ratio: float = 0.6,
+    modes: Optional[List[str]] = None,
+    latency_ms: float = 0.0,
+    stat_latency_ms: Optional[float] = None,
+    concurrency: int = 4,
+    rate: float = 0.0,
+    workdir: Optional[Path] = None,
+    keep: bool = False,
+) -> Dict:
+    modes = modes or ['incremental', 'incremental', 'fast', 'full']
+    base = Path(workdir) if workdir else Path(tempfile.mkdtemp(prefix='bnetdisk-bench-'))
+    src = base / 'src'
+    dst = base / 'dst'
+    state_dir = base / 'state'
+    report: Dict = {'params': {
+        'files': files, 'depth': depth, 'fanout': fanout, 'video_ratio': video_ratio,
+        'latency_ms': latency_ms,
+        'stat_latency_ms': latency_ms if stat_latency_ms is None else stat_latency_ms,
+        'concurrency': concurrency, 'rate': rate,
+    }, 'runs': []}
+    try:
+        started = time.perf_counter()
+        report['tree'] = generate_tree(src, files, depth, fanout, video_ratio)
+        report['tree']['build_seconds'] = round(time.perf_counter() - started, 3)
+
+        # Keep the benchmark about the pipeline (and the report readable), not log lines.
+        with contextlib.redirect_stdout(io.StringIO()):
+            worker = BackupWorker(
+                TaskQueue(), state_dir, [base],
+                ops_per_sec=rate, strict_allowed=True, walk_concurrency=concurrency,
+            )
+        worker.events.file_level = worker.events.sse_level = worker.events.stdout_level = 40
+
+        stat_latency = latency_ms if stat_latency_ms is None else stat_latency_ms
+        with SlowMount(src, latency_ms / 1000.0, stat_latency / 1000.0) as mount:
+            for mode in modes:
+                # The worker shares its listing cache with the browse API; without this,
+                # every run after the first would be served from it instead of the mount.
+                worker.listing_cache.clear()
+                mount.take_counts()
+                started = time.perf_counter()
+                worker._process_task({'src': str(src), 'dst': str(dst), 'mode': mode})
+                elapsed = time.perf_counter() - started
+                result = worker.get_status()['last_result'] or {}
+                report['runs'].append({
+                    'mode': mode,
+                    'seconds': round(elapsed, 3),
+                    'files_per_sec': round(files / elapsed, 1) if elapsed > 0 else None,
+                    'created': result.get('backed'),
+                    'skipped': result.get('skipped'),
+                    'calls': mount.take_counts(),
+                    'peak_rss_mb': peak_rss_mb(),
+                })
+        worker.stop()
+    finally:
+        if not keep and workdir is None:
+            shutil.rmtree(base, ignore_errors=True)
+    return report
+
+
+def run_memory_check(
+    files: int = MEMORY_CHECK_FILES,
+    max_rss_mb: float = MEMORY_CEILING_MB,
+    concurrency: int = 4,
+    workdir: Optional[Path] = None,
+    keep: bool = False,
+) -> Dict:
+    """Back up one flat directory of ``files`` entries twice; report peak RSS growth.
+
+    The first run creates every placeholder, the second finds them all present. The file
+    sink is held at DEBUG, as with ``LOG_LEVEL_FILE=DEBUG``, so every per-file ``[OK]``
+    line goes through the log writer and the SSE ring and their bounds are part of what
+    is measured.
+    """
+    base = Path(workdir) if workdir else Path(tempfile.mkdtemp(prefix='bnetdisk-memcheck-'))
+    src = base / 'src'
+    report: Dict = {'params': {'files': files, 'max_rss_mb': max_rss_mb, 'concurrency': concurrency}, 'runs': []}
+    try:
+        started = time.perf_counter()
+        report['tree'] = generate_tree(src, files, depth=0)
+        report['tree']['build_seconds'] = round(time.perf_counter() - started, 3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            worker = BackupWorker(
+                TaskQueue(), base / 'state', [base],
+                ops_per_sec=0, strict_allowed=True, walk_concurrency=concurrency,
+            )
+        worker.events.file_level = 10
+        worker.events.stdout_level = 40
+        baseline = current_rss_mb()
+        for _run in range(2):
+            started = time.perf_counter()
+            worker._process_task({'src': str(src), 'dst': str(base / 'dst'), 'mode': 'incremental'})
+            result = worker.get_status()['last_result'] or {}
+            report['runs'].append({
+                'seconds': round(time.perf_counter() - started, 3),
+                'created': result.get('backed'),
+                'skipped': result.get('skipped'),
+                'peak_rss_mb': peak_rss_mb(),
+            })
+        worker.stop()
+        report['baseline_rss_mb'] = baseline
+        report['growth_mb'] = round(peak_rss_mb() - baseline, 1)
+        report['ok'] = report['growth_mb'] <= max_rss_mb
+    finally:
+        if not keep and workdir is None:
+            shutil.rmtree(base, ignore_errors=True)
+    return report
+
+
+def format_memory_report(report: Dict) -> str:
+    tree = report['tree']
+    lines = [
+        f"flat directory: {tree['files']} entries ({tree['videos']} videos), built in {tree['build_seconds']}s",
+        f"baseline rss: {report['baseline_rss_mb']} MB",
+    ]
+    for index, run in enumerate(report['runs'], 1):
+        lines.append(
+            f"run {index}: {run['seconds']}s, created={run['created']}, skipped={run['skipped']}, "
+            f"peak rss {run['peak_rss_mb']} MB"
+        )
+    verdict = 'OK' if report['ok'] else 'EXCEEDED'
+    lines.append(f"growth: {report['growth_mb']} MB (ceiling {report['params']['max_rss_mb']} MB) {verdict}")
+    return '\n'.join(lines)
+
+
+def format_report(report: Dict) -> str:
+    params = report['params']
+    tree = report['tree']
+    lines = [
+        f"tree: {tree['files']} files ({tree['videos']} videos) in {tree['dirs']} dirs, "
+        f"built in {tree['build_seconds']}s",
+        f"mount: readdir {params['latency_ms']}ms, stat {params['stat_latency_ms']}ms; "
+        f"concurrency={params['concurrency']}, rate={params['rate'] or 'unlimited'}",
+        '',
+        f"{'mode':<12} {'seconds':>9} {'files/s':>10} {'created':>8} {'rss MB':>7}  calls",
+    ]
+    for run in report['runs']:
+        calls = ' '.join(f'{key}={value}' for key, value in run['calls'].items())
+        lines.append(
+            f"{run['mode']:<12} {run['seconds']:>9} {run['files_per_sec']:>10} "
+            f"{run['created']:>8} {run['peak_rss_mb']:>7}  {calls}"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=None,
+                        help=f'default 10000, or {MEMORY_CHECK_FILES} with --memory-check')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--video-ratio', type=float, default=0.6)
+    parser.add_argument('--modes', default='incremental,incremental,fast,full',
+                        help='comma-separated modes, run in order against the same destination')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to every source readdir')
+    parser.add_argument('--stat-latency-ms', type=float, default=None, help='added to every source stat '
+                        '(defaults to --latency-ms)')
+    parser.add_argument('--concurrency', type=int, default=4, help='walker readdir concurrency')
+    parser.add_argument('--rate', type=float, default=0.0, help='source ops/sec budget (0 = unlimited)')
+    parser.add_argument('--workdir', type=Path, default=None, help='keep the trees here instead of a temp dir')
+    parser.add_argument('--keep', action='store_true', help='do not delete the temp dir afterwards')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--memory-check', action='store_true',
+                        help='walk one huge flat directory and enforce --max-rss-mb')
+    parser.add_argument('--max-rss-mb', type=float, default=MEMORY_CEILING_MB,
+                        help='allowed RSS growth for --memory-check')
+    args = parser.parse_args(argv)
+
+    if args.memory_check:
+        report = run_memory_check(
+            files=MEMORY_CHECK_FILES if args.files is None else args.files,
+            max_rss_mb=args.max_rss_mb,
+            concurrency=args.concurrency,
+            workdir=args.workdir,
+            keep=args.keep,
+        )
+        print(json.dumps(report, indent=2) if args.json else format_memory_report(report))
+        return 0 if report['ok'] else 1
+
+    report = run_benchmark(
+        files=10000 if args.files is None else args.files,
+        depth=args.depth,
+        fanout=args.fanout,
+        video_ratio=args.video_ratio,
+        modes=[mode.strip() for mode in args.modes.split(',') if mode.strip()],
+        latency_ms=args.latency_ms,
+        stat_latency_ms=args.stat_latency_ms,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        workdir=args.workdir,
+        keep=args.keep,
+    )
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
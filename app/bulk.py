@@ -0,0 +1,325 @@
+"""Bulk task submission: validate hundreds of sources in one background pass.
+
+``/api/add`` checks each task inside the request, resolving every path several times and
+touching the source mount for each one. A bulk batch is accepted immediately and checked
+on a background thread instead: each parent directory is resolved once and cached, so a
+source costs a single ``lstat`` (charged to the source ``stat`` budget) that answers
+"where does it point", "does it exist" and "is it a directory" together. Sources are
+queued parents first, so the task queue folds duplicate and nested sources, and sources
+an already queued or running task covers, into one task (``TaskQueue.coalesce``).
+"""
+from __future__ import annotations
+
+import json
+import os
+import queue
+import stat
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import SYNC_ORPHANS, TASK_MODES
+from .filters import FileFilter
+from .paths import build_dest_final
+from .scheduler import path_under
+from .sync import ORPHAN_ACTIONS
+from .walker import scandir_listing
+
+MAX_BATCH_TASKS = 5000
+# Finished batches kept for the status endpoint.
+KEEP_BATCHES = 50
+
+
+def _truthy(value) -> bool:
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_task_options(task: Dict, defaults: Dict, videos_only: bool) -> Tuple[Optional[Dict], Optional[str]]:
+    """Normalize a submitted task's options, falling back to request-wide ``defaults``.
+
+    Returns ``(options, None)`` or ``(None, reason)``; ``options`` holds ``videos_only``,
+    ``mode``, ``priority``, ``dry_run``, ``orphans`` and ``filters`` (a filter spec).
+    """
+    mode = task.get('mode', defaults.get('mode', 'incremental'))
+    if mode not in TASK_MODES:
+        mode = 'incremental'
+    try:
+        priority = max(-100, min(100, int(task.get('priority', defaults.get('priority', 0)))))
+    except (TypeError, ValueError):
+        priority = 0
+    dry_run = _truthy(task.get('dry_run', defaults.get('dry_run')))
+    orphans = str(task.get('orphans') or defaults.get('orphans') or SYNC_ORPHANS).lower()
+    if orphans not in ORPHAN_ACTIONS:
+        return None, f'orphans must be one of {", ".join(ORPHAN_ACTIONS)}'
+    try:
+        # Compiled here only to reject bad patterns up front; the task compiles its own.
+        filters = FileFilter(task.get('filters', defaults.get('filters')), videos_only=videos_only).spec
+    except (TypeError, ValueError) as exc:
+        return None, f'invalid filters: {exc}'
+    return {
+        'videos_only': videos_only,
+        'mode': mode,
+        'priority': priority,
+        'dry_run': dry_run,
+        'orphans': orphans,
+        'filters': filters,
+    }, None
+
+
+class PathResolver:
+    """``Path.resolve`` for many paths that share parents.
+
+    The parent directory's real path is computed once and cached; the last component
+    costs one call of ``lstat`` (normally the rate-limited source call), and only a
+    symlink needs a full ``realpath``.
+    """
+
+    def __init__(self, lstat: Callable[[str], os.stat_result] = os.lstat):
+        self.lstat = lstat
+        self._parents: Dict[str, str] = {}
+
+    def parent(self, path: str) -> str:
+        resolved = self._parents.get(path)
+        if resolved is None:
+            resolved = self._parents[path] = os.path.realpath(path)
+        return resolved
+
+    def resolve(self, path: str) -> Tuple[str, os.stat_result]:
+        """Real path of an existing ``path`` plus its ``stat``; raises ``OSError``."""
+        path = os.path.abspath(path)
+        head, name = os.path.split(path)
+        if not name:
+            return path, self.lstat(path)
+        candidate = os.path.join(self.parent(head), name)
+        info = self.lstat(candidate)
+        if stat.S_ISLNK(info.st_mode):
+            candidate = os.path.realpath(candidate)
+            info = self.lstat(candidate)
+        return candidate, info
+
+
+class BulkSubmitter:
+    """Accept bulk batches and turn them into queued tasks in the background.
+
+    ``host`` is the worker: it provides ``allow_list``, ``add_task``,
+    ``_persist_tasks``, ``_source_call`` and ``broadcast``. A batch is a dict with
+    ``status`` ``queued`` -> ``validating`` -> ``done`` (or ``failed``) and, once done,
+    the ``added``, ``merged`` and ``skipped`` lists.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self._lock = threading.Lock()
+        self._batches: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._inbox: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name='bulk-submit')
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._inbox.put(None)
+
+    def submit(self, payload: Dict) -> Dict:
+        """Queue a batch for validation. Raises ``ValueError`` if the request is malformed."""
+        tasks = payload.get('tasks') or []
+        expand = payload.get('expand') or []
+        if isinstance(expand, str):
+            expand = [expand]
+        if not isinstance(tasks, list) or not isinstance(expand, list):
+            raise ValueError('tasks and expand must be lists')
+        if not tasks and not expand:
+            raise ValueError('nothing to add: give tasks and/or expand')
+        if len(tasks) > MAX_BATCH_TASKS:
+            raise ValueError(f'at most {MAX_BATCH_TASKS} tasks per batch')
+        batch = {
+            'id': uuid.uuid4().hex[:12],
+            'status': 'queued',
+            'submitted_at': time.time(),
+            'finished_at': None,
+            'requested': len(tasks),
+            'expand': [str(item) for item in expand],
+            'added': [],
+            'merged': [],
+            'skipped': [],
+        }
+        with self._lock:
+            self._batches[batch['id']] = batch
+            while len(self._batches) > KEEP_BATCHES:
+                oldest = next(iter(self._batches.values()))
+                if oldest['status'] not in ('done', 'failed'):
+                    break
+                self._batches.popitem(last=False)
+            snapshot = self._summary(batch)
+        self._inbox.put((batch, tasks, expand, dict(payload)))
+        return snapshot
+
+    def get(self, batch_id: str) -> Optional[Dict]:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            return json.loads(json.dumps(batch)) if batch is not None else None
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [self._summary(batch) for batch in reversed(self._batches.values())]
+
+    @staticmethod
+    def _summary(batch: Dict) -> Dict:
+        data = {key: value for key, value in batch.items() if key not in ('added', 'merged', 'skipped')}
+        data.update({key: len(batch[key]) for key in ('added', 'merged', 'skipped')})
+        return data
+
+    def _run(self) -> None:
+        while True:
+            item = self._inbox.get()
+            if item is None:
+                return
+            batch = item[0]
+            with self._lock:
+                batch['status'] = 'validating'
+            try:
+                self._process(*item)
+                status = 'done'
+            except Exception as exc:  # noqa: BLE001 - report and keep serving batches
+                self.host.broadcast(f'[ERROR] Bulk batch {batch["id"]} failed: {exc}')
+                batch['error'] = str(exc)
+                status = 'failed'
+            with self._lock:
+                batch['status'] = status
+                batch['finished_at'] = time.time()
+
+    def _process(self, batch: Dict, tasks: List, expand: List, payload: Dict) -> None:
+        host = self.host
+        videos_only = bool(payload.get('videos_only', True))
+        resolver = PathResolver(lambda path: host._source_call('stat', os.lstat, path))
+        skipped: List[Dict] = []
+        merged: List[Dict] = []
+
+        for parent in expand:
+            tasks.extend(self._expand(str(parent), payload, videos_only, resolver, skipped))
+
+        candidates = []
+        for task in tasks:
+            if isinstance(task, str):
+                task = {'src': task}
+            if not isinstance(task, dict):
+                skipped.append({'task': task, 'reason': 'invalid task object'})
+                continue
+            candidate, reason = self._check(task, payload, videos_only, resolver)
+            if candidate is None:
+                skipped.append({'task': {'src': task.get('src'), 'dst': task.get('dst', payload.get('dst'))},
+                                'reason': reason})
+                continue
+            candidates.append(candidate)
+
+        # Parents first, so a nested source folds into its ancestor's task as it is queued.
+        candidates.sort(key=lambda item: item['src'])
+        added = []
+        for candidate in candidates:
+            try:
+                if candidate['options']['mode'] != 'plan':
+                    os.makedirs(candidate['dest_final'], exist_ok=True)
+            except OSError as exc:
+                skipped.append({'task': candidate['pair'], 'reason': f'cannot create dst: {exc}'})
+                continue
+            options = candidate['options']
+            merges: List[Dict] = []
+            state = host.add_task(
+                Path(candidate['src']), Path(candidate['dest_final']),
+                mirror=False, persist=False, merges=merges, **options,
+            )
+            folded = [merge for merge in merges if merge['reason'] != 'absorbed']
+            if folded:
+                merged.append({'src': candidate['src'], 'into': state.id, 'reason': folded[0]['reason']})
+                continue
+            added.append({'id': state.id, 'src': candidate['src'], 'dst': candidate['dest_final']})
+        if added or merged:
+            host._persist_tasks()
+        with self._lock:
+            batch.update(added=added, merged=merged, skipped=skipped)
+        host.broadcast(f'[BULK] Batch {batch["id"]}: added {len(added)}, merged {len(merged)}, skipped {len(skipped)}')
+
+    def _expand(self, parent: str, payload: Dict, videos_only: bool, resolver: PathResolver, skipped: List) -> List[Dict]:
+        """Each child directory of ``parent`` as its own task (with the batch defaults)."""
+        allow_list = self.host.allow_list
+        if not self._allowed(parent, resolver):
+            skipped.append({'task': {'expand': parent}, 'reason': 'path not allowed'})
+            return []
+        try:
+            resolved, info = resolver.resolve(parent)
+            if not allow_list.allows_resolved(resolved):
+                skipped.append({'task': {'expand': parent}, 'reason': 'path not allowed'})
+                return []
+            if not stat.S_ISDIR(info.st_mode):
+                raise NotADirectoryError(parent)
+            dirs, _files = self.host._source_call('readdir', scandir_listing, resolved)
+        except OSError as exc:
+            skipped.append({'task': {'expand': parent}, 'reason': f'cannot list: {exc}'})
+            return []
+        try:
+            wants_dir = FileFilter(payload.get('filters'), videos_only=videos_only).wants_dir
+        except (TypeError, ValueError):
+            wants_dir = None  # reported per task by _check
+        # scandir_listing never reports symlinked directories, so the children are
+        # already resolved: the resolver's parent cache makes each one a single lstat.
+        return [{'src': os.path.join(resolved, name)} for name in sorted(dirs) if wants_dir is None or wants_dir(name)]
+
+    def _allowed(self, path: str, resolver: PathResolver) -> bool:
+        """Allow-list check done before ``path`` itself is touched.
+
+        Only the parent directory is resolved, so a skip reason never tells whether a
+        path outside the allowed roots exists.
+        """
+        try:
+            head, name = os.path.split(os.path.abspath(str(path)))
+            candidate = os.path.join(resolver.parent(head), name) if name else head
+        except (OSError, ValueError):
+            return False
+        return self.host.allow_list.allows_resolved(candidate)
+
+    def _check(self, task: Dict, payload: Dict, videos_only: bool, resolver: PathResolver):
+        """One batched-pass validation; returns ``(candidate, None)`` or ``(None, reason)``."""
+        options, reason = parse_task_options(task, payload, videos_only)
+        if options is None:
+            return None, reason
+        src_text = task.get('src')
+        dst_text = task.get('dst', payload.get('dst'))
+        if not src_text or not dst_text:
+            return None, 'src and dst are required'
+        if not self._allowed(src_text, resolver) or not self._allowed(dst_text, resolver):
+            return None, 'path not allowed'
+        try:
+            src, info = resolver.resolve(str(src_text))
+        except FileNotFoundError:
+            return None, 'src does not exist or not dir'
+        except (OSError, ValueError):
+            return None, 'path resolution error'
+        allow_list = self.host.allow_list
+        if not allow_list.allows_resolved(src):
+            return None, 'path not allowed'  # a symlink leading out of the allowed roots
+        if not stat.S_ISDIR(info.st_mode):
+            return None, 'src does not exist or not dir'
+        try:
+            dst = resolver.parent(os.path.abspath(str(dst_text)))
+        except (OSError, ValueError):
+            return None, 'invalid path'
+        if src == dst:
+            return None, 'src and dst identical'
+        # Both are real paths and the suffix comes from the resolved source, so the
+        # containment check needs no further filesystem access.
+        dest_final = str(build_dest_final(Path(src), Path(dst)))
+        if path_under(dest_final, src):
+            return None, 'destination would be inside source or identical'
+        if not allow_list.allows_resolved(dst):
+            return None, 'path not allowed'
+        return {
+            'src': src,
+            'dst': dst,
+            'dest_final': dest_final,
+            'options': options,
+            'pair': {'src': src, 'dst': dst},
+        }, None
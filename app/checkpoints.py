@@ -0,0 +1,63 @@
+"""On-disk persistence of the task queue and per-task walk checkpoints."""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def write_json_atomic(path: Path, data) -> None:
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as handle:
+        json.dump(data, handle, ensure_ascii=False)
+    os.replace(str(tmp), str(path))
+
+
+def read_json(path: Path):
+    try:
+        with open(path, 'r', encoding='utf-8') as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+class TaskStore:
+    """``tasks.json`` holds every queued or running task; ``checkpoints/<id>.json`` holds
+    the walk frontier of a task that has started, so it can resume after a restart.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.tasks_path = self.root / 'tasks.json'
+        self.checkpoint_dir = self.root / 'checkpoints'
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def save_tasks(self, records: List[Dict]) -> None:
+        with self._lock:
+            write_json_atomic(self.tasks_path, {'tasks': records})
+
+    def load_tasks(self) -> List[Dict]:
+        data = read_json(self.tasks_path)
+        if not isinstance(data, dict) or not isinstance(data.get('tasks'), list):
+            return []
+        return [item for item in data['tasks'] if isinstance(item, dict)]
+
+    def _checkpoint_path(self, task_id: str) -> Path:
+        safe = ''.join(ch for ch in str(task_id) if ch.isalnum() or ch in '-_')
+        return self.checkpoint_dir / f'{safe}.json'
+
+    def save_checkpoint(self, task_id: str, data: Dict) -> None:
+        write_json_atomic(self._checkpoint_path(task_id), data)
+
+    def load_checkpoint(self, task_id: str) -> Optional[Dict]:
+        data = read_json(self._checkpoint_path(task_id))
+        return data if isinstance(data, dict) else None
+
+    def delete_checkpoint(self, task_id: str) -> None:
+        try:
+            self._checkpoint_path(task_id).unlink()
+        except OSError:
+            pass
@@ -21,13 +21,86 @@ def _int_env(name: str, default: int) -> int:
 
 APP_PORT = _int_env('APP_PORT', 18008)
 BACKUP_DIR = Path(os.environ.get('BACKUP_DIR', '/app/data')).resolve()
+# Source mount budget: readdir/stat calls per second (0 = unlimited).
 BACKUP_RATE = _float_env('BACKUP_RATE', 20.0)
+RATE_BURST = max(1.0, _float_env('RATE_BURST', 10.0))
+# Placeholder writes per second on the destination (0 = unlimited).
+WRITE_RATE = _float_env('WRITE_RATE', 0.0)
+RATE_ADAPTIVE = _int_env('RATE_ADAPTIVE', 1) != 0
+# Fallback refresh interval for the cached mount table (changes are normally signalled
+# by the kernel through /proc/self/mounts).
+MOUNT_CACHE_TTL = max(1.0, _float_env('MOUNT_CACHE_TTL', 30.0))
+# Tasks that may run at once, and at most how many of them may share one source mount.
+MAX_CONCURRENT_TASKS = max(1, _int_env('MAX_CONCURRENT_TASKS', 2))
+PER_MOUNT_TASKS = max(1, _int_env('PER_MOUNT_TASKS', 1))
+# How often a running task saves its walk frontier for resume-after-restart.
+CHECKPOINT_SECONDS = max(1.0, _float_env('CHECKPOINT_SECONDS', 10.0))
+# Max directories listed at the same time on the source mount (1 = sequential walk).
+WALK_CONCURRENCY = max(1, _int_env('WALK_CONCURRENCY', 4))
+# Directories with more entries than this are read and processed in chunks of this
+# many names, so a huge flat directory never sits in memory whole (0 = never chunk).
+WALK_CHUNK_ENTRIES = max(0, _int_env('WALK_CHUNK_ENTRIES', 10000))
+# Progress estimate of a running task: previous (totals of its last successful run, from
+# the tree index), count (without a previous run, also count the source tree in the
+# background using only source budget the walk leaves unused) or off.
+PROGRESS_ESTIMATE = os.environ.get('PROGRESS_ESTIMATE', 'previous').strip().lower()
+# How often each running task logs an [ETA] progress line (0 = never).
+PROGRESS_REPORT_SECONDS = max(0.0, _float_env('PROGRESS_REPORT_SECONDS', 30.0))
+# Processes that walk the top-level directories of an incremental/full task in parallel
+# (1 = walk in the worker process itself). Each uses WALK_CONCURRENCY listing threads.
+SCAN_PROCESSES = max(1, _int_env('SCAN_PROCESSES', 1))
+# Directory listings shared by the browse API and the worker are reused while the
+# directory mtime is unchanged, for at most this many seconds (0 = no cache).
+LISTING_CACHE_TTL = max(0.0, _float_env('LISTING_CACHE_TTL', 30.0))
+# Upper bound on names held by the listing cache across all directories.
+LISTING_CACHE_NAMES = max(0, _int_env('LISTING_CACHE_NAMES', 200000))
 ALLOWED_ROOTS_ENV = os.environ.get('ALLOWED_ROOTS', '').strip()
 SERVICE_LOG = BACKUP_DIR / 'service_log.txt'
+TREE_INDEX = BACKUP_DIR / 'tree_index.sqlite3'
 PLACEHOLDER_SIZE = 1024
+# How placeholders are materialized: auto (probe each destination filesystem), sparse,
+# reflink (btrfs/XFS clone of a template) or hardlink (all placeholders share one inode).
+PLACEHOLDER_STRATEGY = os.environ.get('PLACEHOLDER_STRATEGY', 'auto').strip().lower()
+# Default and maximum page size of /api/listdir (NDJSON streams can ask for everything).
 MAX_LIST_ENTRIES = 10000
 MAX_LOG_LINES = 100
+# Largest page /api/logs returns when paging through the service log.
+MAX_LOG_PAGE = 1000
+# Service log rotation: the active file becomes a compressed segment once it reaches
+# LOG_MAX_BYTES or is LOG_ROTATE_SECONDS old (0 = size only); LOG_KEEP_SEGMENTS are kept.
+LOG_MAX_BYTES = max(1 << 20, _int_env('LOG_MAX_BYTES', 64 << 20))
+LOG_ROTATE_SECONDS = max(0, _int_env('LOG_ROTATE_SECONDS', 86400))
+LOG_KEEP_SEGMENTS = max(1, _int_env('LOG_KEEP_SEGMENTS', 20))
 SSE_KEEPALIVE_SECONDS = 15
+# Threads running Flask views under the ASGI entry point (app.asgi); SSE clients do not use them.
+ASGI_THREADS = max(1, _int_env('ASGI_THREADS', 8))
+# Minimum level per log sink: DEBUG (adds every per-file [OK] line), INFO, WARN, ERROR.
+LOG_LEVEL_FILE = os.environ.get('LOG_LEVEL_FILE', 'INFO')
+LOG_LEVEL_SSE = os.environ.get('LOG_LEVEL_SSE', 'INFO')
+LOG_LEVEL_STDOUT = os.environ.get('LOG_LEVEL_STDOUT', 'INFO')
+# Sinks below DEBUG get one [PROGRESS] line per this many seconds instead of per-file lines.
+LOG_SUMMARY_SECONDS = max(0.5, _float_env('LOG_SUMMARY_SECONDS', 5.0))
+# Source directories (name globs) never descended into: NAS thumbnail folders and recycle bins.
+PRUNE_DIRS = tuple(
+    item.strip()
+    for item in os.environ.get('PRUNE_DIRS', '@eaDir,#recycle,.recycle,$RECYCLE.BIN,lost+found').split(',')
+    if item.strip()
+)
+# Companion files (subtitles, images) are copied for real, up to this size in bytes.
+COMPANION_MAX_BYTES = max(0, _int_env('COMPANION_MAX_BYTES', 20 * 1024 * 1024))
+TASK_MODES = ('incremental', 'fast', 'full', 'sync', 'plan')
+# Watches: 'inotify', 'poll', or 'auto' (inotify except on FUSE mounts, which do not
+# report changes made on the remote side).
+WATCH_BACKEND = os.environ.get('WATCH_BACKEND', 'auto').strip().lower()
+# A changed directory is processed once it has been quiet this long (large copies emit
+# bursts of events), and at the latest WATCH_MAX_DELAY seconds after its first change.
+WATCH_DEBOUNCE_SECONDS = max(0.1, _float_env('WATCH_DEBOUNCE_SECONDS', 2.0))
+WATCH_MAX_DELAY = max(1.0, _float_env('WATCH_MAX_DELAY', 30.0))
+# How often the poll backend re-checks every watched directory's mtime.
+WATCH_POLL_SECONDS = max(1.0, _float_env('WATCH_POLL_SECONDS', 60.0))
+# What sync mode does with placeholders whose source file is gone: 'quarantine' moves
+# them under <destination>/.bnetdisk-quarantine/, 'delete' removes them.
+SYNC_ORPHANS = os.environ.get('SYNC_ORPHANS', 'quarantine').strip().lower()
 
 # Only these extensions become placeholder files.
 VIDEO_EXTS = frozenset({
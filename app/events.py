@@ -0,0 +1,182 @@
+"""Log event fan-out: per-sink verbosity, per-file summaries and an SSE ring buffer."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import Callable, List, Optional, Tuple
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+# Per-file "[OK] src -> dst" lines are the only DEBUG events; everything else is INFO+.
+TAG_LEVELS = {'[OK]': 10, '[WARN]': 30, '[ERROR]': 40}
+
+
+def parse_level(value: str, default: int) -> int:
+    return LEVELS.get(str(value or '').strip().upper(), default)
+
+
+def event_level(msg: str) -> int:
+    if msg.startswith('['):
+        end = msg.find(']')
+        if end > 0:
+            return TAG_LEVELS.get(msg[:end + 1], 20)
+    return 20
+
+
+class EventBus:
+    """Route each ``broadcast`` line to the file, SSE and stdout sinks.
+
+    Every sink has its own minimum level. Sinks that do not take DEBUG receive a
+    ``[PROGRESS]`` summary of the per-file events every ``summary_seconds`` instead.
+    SSE clients do not get a queue each: they keep a sequence-number cursor into one
+    shared ring buffer, and a client that falls more than ``ring_size`` lines behind is
+    told how many it missed.
+    """
+
+    def __init__(
+        self,
+        file_sink: Optional[Callable[[str], None]] = None,
+        file_level: int = 20,
+        sse_level: int = 20,
+        stdout_level: int = 20,
+        ring_size: int = 5000,
+        summary_seconds: float = 5.0,
+    ):
+        self.file_sink = file_sink
+        self.file_level = file_level
+        self.sse_level = sse_level
+        self.stdout_level = stdout_level
+        self.summary_seconds = float(summary_seconds)
+        self._cond = threading.Condition(threading.Lock())
+        self._ring: deque = deque(maxlen=max(1, int(ring_size)))
+        self._next_seq = 0
+        self._clients = 0
+        # Lines SSE clients missed because they fell a full ring behind, over all clients.
+        self.dropped = 0
+        # Called (from the publishing thread) after new SSE lines land in the ring.
+        self._listeners: List[Callable[[], None]] = []
+        self._summary_lock = threading.Lock()
+        self._summary_count = 0
+        self._summary_last = ''
+        self._summary_started = time.monotonic()
+        self._ts: Tuple[int, str] = (-1, '')
+
+    def _timestamp(self) -> str:
+        now = int(time.time())
+        second, text = self._ts
+        if now != second:
+            text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            self._ts = (now, text)
+        return text
+
+    def publish(self, msg: str) -> None:
+        level = event_level(msg)
+        if level <= 10:
+            self._count_file_event(msg)
+        self._emit(msg, level)
+
+    @staticmethod
+    def _wants(sink_level: int, level: int, summary: bool) -> bool:
+        if summary:
+            # Only sinks that did not already get the per-file lines need the summary.
+            return 10 < sink_level <= level
+        return level >= sink_level
+
+    def _emit(self, msg: str, level: int, summary: bool = False) -> None:
+        to_file = self.file_sink is not None and self._wants(self.file_level, level, summary)
+        to_sse = self._wants(self.sse_level, level, summary)
+        to_stdout = self._wants(self.stdout_level, level, summary)
+        if not (to_file or to_sse or to_stdout):
+            return
+        line = f'{self._timestamp()} {msg}'
+        if to_file:
+            try:
+                self.file_sink(line)
+            except Exception:
+                pass
+        if to_sse:
+            with self._cond:
+                self._ring.append(line)
+                self._next_seq += 1
+                self._cond.notify_all()
+                listeners = list(self._listeners)
+            for listener in listeners:
+                try:
+                    listener()
+                except Exception:
+                    pass
+        if to_stdout:
+            try:
+                print(line, flush=True)
+            except Exception:
+                pass
+
+    def _count_file_event(self, msg: str) -> None:
+        now = time.monotonic()
+        with self._summary_lock:
+            if self._summary_count == 0:
+                self._summary_started = now
+            self._summary_count += 1
+            self._summary_last = msg
+            due = now - self._summary_started >= self.summary_seconds
+        if due:
+            self.flush_summary()
+
+    def flush_summary(self) -> None:
+        """Emit the pending ``[PROGRESS]`` summary now (e.g. before a task's ``[DONE]``)."""
+        with self._summary_lock:
+            count = self._summary_count
+            last = self._summary_last
+            elapsed = time.monotonic() - self._summary_started
+            self._summary_count = 0
+            self._summary_last = ''
+            self._summary_started = time.monotonic()
+        if count:
+            latest = last[5:] if last.startswith('[OK] ') else last
+            self._emit(f'[PROGRESS] {count} placeholders created in {elapsed:.1f}s, latest: {latest}', 20, summary=True)
+
+    def subscribe(self, history: int = 100) -> int:
+        """Register an SSE client; returns its starting cursor (``history`` lines back)."""
+        with self._cond:
+            self._clients += 1
+            return max(self._next_seq - len(self._ring), self._next_seq - max(0, history))
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Wake-up hook for readers that cannot block in ``read`` (e.g. an asyncio loop)."""
+        with self._cond:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]) -> None:
+        with self._cond:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self._clients = max(0, self._clients - 1)
+
+    @property
+    def client_count(self) -> int:
+        with self._cond:
+            return self._clients
+
+    def read(self, cursor: int, timeout: float, limit: int = 500) -> Tuple[List[str], int, int]:
+        """Lines after ``cursor``, waiting up to ``timeout`` for new ones.
+
+        Returns ``(lines, next_cursor, dropped)`` where ``dropped`` counts lines that
+        were overwritten in the ring before this client could read them.
+        """
+        with self._cond:
+            if cursor >= self._next_seq:
+                self._cond.wait(timeout)
+            first = self._next_seq - len(self._ring)
+            dropped = max(0, first - cursor)
+            self.dropped += dropped
+            start = max(cursor, first)
+            lines = list(islice(self._ring, start - first, start - first + limit))
+            return lines, start + len(lines), dropped
+
+    def tail(self, n: int = 100) -> List[str]:
+        with self._cond:
+            return list(islice(self._ring, max(0, len(self._ring) - n), None))
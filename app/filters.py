@@ -0,0 +1,141 @@
+"""Per-task file and directory filters, compiled once and matched on raw names."""
+from __future__ import annotations
+
+import fnmatch
+import json
+import re
+from typing import Dict, Iterable, List, Optional
+
+from .config import IMAGE_EXTS, PRUNE_DIRS, SUBTITLE_EXTS, VIDEO_EXTS
+
+COMPANION_KINDS = {'subtitles': SUBTITLE_EXTS, 'images': IMAGE_EXTS}
+SPEC_KEYS = ('include', 'exclude', 'include_regex', 'exclude_regex', 'min_size', 'max_size',
+             'companions', 'prune_dirs')
+
+# What a wanted file becomes in the destination.
+PLACEHOLDER = 'placeholder'
+COMPANION = 'companion'
+
+
+def extension(name: str) -> str:
+    """Lower-cased suffix like ``Path(name).suffix``, without building a ``Path``."""
+    dot = name.rfind('.')
+    if dot <= 0 or dot == len(name) - 1:
+        return ''
+    return name[dot:].lower()
+
+
+def is_video(name: str) -> bool:
+    return extension(name) in VIDEO_EXTS
+
+
+def _as_list(value, field: str) -> List[str]:
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f'{field} must be a list of strings')
+    items = [str(item).strip() for item in value]
+    return [item for item in items if item]
+
+
+def _compile_any(patterns: Iterable[str], field: str, glob: bool) -> Optional['re.Pattern']:
+    """One case-insensitive regex matching any of ``patterns`` (globs or regexes)."""
+    parts = [fnmatch.translate(item) if glob else f'(?:{item})' for item in patterns]
+    if not parts:
+        return None
+    try:
+        return re.compile('|'.join(f'(?:{part})' for part in parts), re.IGNORECASE)
+    except re.error as exc:
+        raise ValueError(f'invalid {field}: {exc}') from exc
+
+
+def _size(value, field: str) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f'{field} must be a number of bytes') from exc
+    if size < 0:
+        raise ValueError(f'{field} must not be negative')
+    return size
+
+
+class FileFilter:
+    """Decide, per raw directory-entry name, what a task does with it.
+
+    Files: the extension must be a video (or any file when not ``videos_only``) or a
+    requested companion type, must match an ``include`` glob/regex if any are given,
+    must not match an ``exclude`` glob/regex, and must be within ``min_size`` /
+    ``max_size`` bytes (checking size costs one source ``stat`` per candidate file, so
+    only set it when needed). Directories whose name matches a prune glob are never
+    listed at all.
+    """
+
+    def __init__(self, spec: Optional[Dict] = None, videos_only: bool = True):
+        spec = dict(spec or {})
+        unknown = set(spec) - set(SPEC_KEYS)
+        if unknown:
+            raise ValueError(f'unknown filter keys: {", ".join(sorted(unknown))}')
+        self.videos_only = bool(videos_only)
+        self.companion_exts = frozenset()
+        for kind in _as_list(spec.get('companions'), 'companions'):
+            if kind not in COMPANION_KINDS:
+                raise ValueError(f'companions must be any of {", ".join(COMPANION_KINDS)}')
+            self.companion_exts |= COMPANION_KINDS[kind]
+        self._include_glob = _compile_any(_as_list(spec.get('include'), 'include'), 'include', glob=True)
+        self._include_re = _compile_any(
+            _as_list(spec.get('include_regex'), 'include_regex'), 'include_regex', glob=False,
+        )
+        self._exclude_glob = _compile_any(_as_list(spec.get('exclude'), 'exclude'), 'exclude', glob=True)
+        self._exclude_re = _compile_any(
+            _as_list(spec.get('exclude_regex'), 'exclude_regex'), 'exclude_regex', glob=False,
+        )
+        self.min_size = _size(spec.get('min_size'), 'min_size')
+        self.max_size = _size(spec.get('max_size'), 'max_size')
+        self.prune_dirs = PRUNE_DIRS + tuple(_as_list(spec.get('prune_dirs'), 'prune_dirs'))
+        self._prune = _compile_any(self.prune_dirs, 'prune_dirs', glob=True)
+        self.spec = {key: spec[key] for key in SPEC_KEYS if spec.get(key) not in (None, '', [])}
+
+    @property
+    def fingerprint(self) -> str:
+        """Stable text for "which files this filter selects", to compare runs by."""
+        return json.dumps({'videos_only': self.videos_only, 'spec': self.spec}, sort_keys=True)
+
+    @property
+    def needs_size(self) -> bool:
+        return self.min_size is not None or self.max_size is not None
+
+    def classify(self, name: str) -> Optional[str]:
+        """``PLACEHOLDER``, ``COMPANION`` or ``None`` (skip), from the name alone."""
+        ext = extension(name)
+        if ext in self.companion_exts:
+            kind = COMPANION
+        elif not self.videos_only or ext in VIDEO_EXTS:
+            kind = PLACEHOLDER
+        else:
+            return None
+        # Globs match the whole name; regexes may match anywhere in it.
+        if self._include_glob is not None or self._include_re is not None:
+            if not (
+                (self._include_glob is not None and self._include_glob.match(name))
+                or (self._include_re is not None and self._include_re.search(name))
+            ):
+                return None
+        if self._exclude_glob is not None and self._exclude_glob.match(name):
+            return None
+        if self._exclude_re is not None and self._exclude_re.search(name):
+            return None
+        return kind
+
+    def wants_size(self, size: int) -> bool:
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return True
+
+    def wants_dir(self, name: str) -> bool:
+        return self._prune is None or not self._prune.match(name)
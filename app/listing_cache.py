@@ -0,0 +1,174 @@
+"""Short-lived directory-listing cache shared by the browse API and the worker."""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .walker import scandir_listing
+
+SORTS = ('name', 'name_desc')
+
+
+class Listing:
+    """One cached directory: its mtime, its (dirs, files) and lazily built sorted views."""
+
+    __slots__ = ('path', 'mtime_ns', 'dirs', 'files', 'loaded_at', '_views', '_lock')
+
+    def __init__(self, path: str, mtime_ns: int, dirs: List[str], files: List[str]):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.dirs = dirs
+        self.files = files
+        self.loaded_at = time.monotonic()
+        self._views: Dict[str, Tuple[List[Tuple[bool, str]], Dict[Tuple[bool, str], int]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.dirs) + len(self.files)
+
+    def view(self, sort: str):
+        """Entries as ``(is_dir, name)`` in ``sort`` order (directories first), plus a position map."""
+        with self._lock:
+            cached = self._views.get(sort)
+            if cached is None:
+                reverse = sort == 'name_desc'
+                dirs = sorted(self.dirs, key=lambda name: (name.lower(), name), reverse=reverse)
+                files = sorted(self.files, key=lambda name: (name.lower(), name), reverse=reverse)
+                entries = [(True, name) for name in dirs] + [(False, name) for name in files]
+                cached = (entries, {entry: index for index, entry in enumerate(entries)})
+                self._views[sort] = cached
+            return cached
+
+
+def encode_cursor(is_dir: bool, name: str) -> str:
+    raw = json.dumps([bool(is_dir), name], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, str]:
+    """Raises ``ValueError`` for a cursor this module did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        is_dir, name = json.loads(raw.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('invalid cursor') from exc
+    if not isinstance(name, str):
+        raise ValueError('invalid cursor')
+    return bool(is_dir), name
+
+
+def cursor_position(listing: Listing, sort: str, cursor: Optional[str]) -> int:
+    """Index of the first entry after ``cursor`` in ``listing.view(sort)``.
+
+    The cursor names the last entry already returned, so a page boundary stays put when
+    entries are added or removed elsewhere in the directory between page requests.
+    """
+    if not cursor:
+        return 0
+    after = decode_cursor(cursor)
+    entries, positions = listing.view(sort)
+    index = positions.get(after)
+    if index is not None:
+        return index + 1
+    # The entry itself vanished: find where it would have been.
+    reverse = sort == 'name_desc'
+    after_key = (after[1].lower(), after[1])
+    for index, (is_dir, name) in enumerate(entries):
+        if is_dir != after[0]:
+            if after[0] and not is_dir:
+                return index
+            continue
+        key = (name.lower(), name)
+        if (key < after_key) if reverse else (key > after_key):
+            return index
+    return len(entries)
+
+
+class ListingCache:
+    """LRU of directory listings, valid while the directory mtime is unchanged and for at
+    most ``ttl`` seconds (FUSE mounts do not always bump a directory's mtime promptly).
+
+    ``max_names`` bounds the total number of names held across all cached directories.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_names: int = 200000):
+        self.ttl = float(ttl)
+        self.max_names = max(0, int(max_names))
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Listing]' = OrderedDict()
+        self._names = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, path: str, mtime_ns: int) -> Optional[Listing]:
+        with self._lock:
+            listing = self._entries.get(path)
+            if listing is None:
+                self.misses += 1
+                return None
+            if listing.mtime_ns != mtime_ns or time.monotonic() - listing.loaded_at > self.ttl:
+                self._drop(path)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return listing
+
+    def store(self, path: str, mtime_ns: int, dirs: List[str], files: List[str]) -> Listing:
+        listing = Listing(path, mtime_ns, list(dirs), list(files))
+        if self.ttl <= 0 or listing.size > self.max_names:
+            return listing
+        with self._lock:
+            self._drop(path)
+            self._entries[path] = listing
+            self._names += listing.size
+            while self._names > self.max_names and self._entries:
+                self._drop(next(iter(self._entries)))
+        return listing
+
+    def get(self, path: str, stat: Optional[Callable] = None, scan: Optional[Callable] = None) -> Listing:
+        """Cached listing of ``path``, re-listing it when the mtime moved or the TTL ran out.
+
+        ``stat`` and ``scan`` default to ``os.stat`` and ``scandir_listing``; the worker
+        passes rate-limited versions. ``OSError`` from either propagates.
+        """
+        stat = stat or os.stat
+        scan = scan or scandir_listing
+        mtime_ns = stat(path).st_mtime_ns
+        listing = self.lookup(path, mtime_ns)
+        if listing is None:
+            dirs, files = scan(path)
+            listing = self.store(path, mtime_ns, dirs, files)
+        return listing
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            self._drop(path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._names = 0
+
+    def _drop(self, path: str) -> None:
+        # Caller holds _lock.
+        listing = self._entries.pop(path, None)
+        if listing is not None:
+            self._names -= listing.size
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'dirs': len(self._entries),
+                'names': self._names,
+                'max_names': self.max_names,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -1,24 +1,317 @@
-"""Buffered service log writer with in-memory tail support."""
+"""Service log: buffered writer, rotation into compressed segments and an indexed reader.
+
+The active log is appended through one long-lived handle. Every ``BLOCK_LINES`` lines
+form a block, described by one line of a JSON sidecar index (``<log>.idx``): its offset,
+line count, time range, a mask of the levels it contains and a Bloom filter of the
+path components and words in it. When the log reaches ``LOG_MAX_BYTES`` or
+``LOG_ROTATE_SECONDS`` it becomes a segment that is compressed one gzip member per
+block, so any single block of any segment can be read back on its own. Paging and
+filtered searches walk the blocks newest first and skip those whose index rules them out.
+"""
 from __future__ import annotations
 
+import base64
+import gzip
+import hashlib
+import json
+import os
 import queue
+import re
 import threading
 import time
+import zlib
 from collections import deque
 from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .config import LOG_KEEP_SEGMENTS, LOG_MAX_BYTES, LOG_ROTATE_SECONDS
+from .events import event_level
+
+BLOCK_LINES = 1000
+BLOOM_BITS = 16384
+BLOOM_HASHES = 4
+# Blocks a single /api/logs call may decompress or read before it returns a partial page.
+SCAN_BLOCKS = 400
+# Parsed indexes of compressed (immutable) segments kept in memory.
+CACHED_SEGMENTS = 4
+# "YYYY-mm-dd HH:MM:SS " in front of every line.
+STAMP = 20
+_TOKEN = re.compile(r'[^/\s]+')
+
+
+def line_tokens(text: str) -> set:
+    return {token.lower() for token in _TOKEN.findall(text)}
+
+
+def whole_tokens(pattern: str) -> List[str]:
+    """Tokens of a search pattern that must appear whole in any line containing it.
+
+    The first and last token may be cut mid-word (``Show`` also matches ``Shows``), so
+    they only count when the pattern itself delimits them.
+    """
+    found = []
+    for match in _TOKEN.finditer(pattern):
+        if match.start() > 0 and match.end() < len(pattern):
+            found.append(match.group().lower())
+    return found
+
+
+def _positions(token: str) -> List[int]:
+    digest = hashlib.blake2b(token.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    first = int.from_bytes(digest[:4], 'little')
+    step = int.from_bytes(digest[4:], 'little') | 1
+    return [(first + index * step) % BLOOM_BITS for index in range(BLOOM_HASHES)]
+
+
+def bloom_encode(tokens) -> str:
+    bits = bytearray(BLOOM_BITS // 8)
+    for token in tokens:
+        for position in _positions(token):
+            bits[position >> 3] |= 1 << (position & 7)
+    return base64.b64encode(zlib.compress(bytes(bits))).decode('ascii')
+
+
+def bloom_decode(text: str) -> bytes:
+    return zlib.decompress(base64.b64decode(text))
+
+
+def bloom_has_all(bits: bytes, tokens: Sequence[str]) -> bool:
+    for token in tokens:
+        for position in _positions(token):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+    return True
+
+
+def _level_bit(line: str) -> int:
+    return 1 << (event_level(line[STAMP:]) // 10)
+
+
+class Block(NamedTuple):
+    offset: int
+    # Bytes in a plain segment, compressed bytes in a gzip one.
+    length: int
+    lines: int
+    levels: int
+    bloom: Optional[str]
+    first: str
+    last: str
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'o': self.offset, 'c': self.length, 'n': self.lines, 'lv': self.levels,
+            'bf': self.bloom, 't0': self.first, 't1': self.last,
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> 'Block':
+        data = json.loads(text)
+        return cls(data['o'], data['c'], data['n'], data['lv'], data.get('bf'), data.get('t0', ''), data.get('t1', ''))
+
+
+class _BlockBuilder:
+    """Statistics of the block being filled."""
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.length = 0
+        self.lines = 0
+        self.levels = 0
+        self.tokens: set = set()
+        self.first = ''
+        self.last = ''
+
+    def add(self, line: str, size: int) -> None:
+        if not self.lines:
+            self.first = line[:STAMP - 1]
+        self.last = line[:STAMP - 1]
+        self.lines += 1
+        self.length += size
+        self.levels |= _level_bit(line)
+        self.tokens.update(line_tokens(line[STAMP:]))
+
+    def build(self, offset: Optional[int] = None, length: Optional[int] = None) -> Block:
+        return Block(
+            self.offset if offset is None else offset,
+            self.length if length is None else length,
+            self.lines, self.levels, bloom_encode(self.tokens), self.first, self.last,
+        )
+
+
+def _read_index(path: Path) -> Tuple[Optional[Dict], List[Block]]:
+    """Header and blocks of a sidecar index; a torn last line is ignored."""
+    header = None
+    blocks: List[Block] = []
+    try:
+        with open(path, 'r', encoding='utf-8') as handle:
+            for number, text in enumerate(handle):
+                try:
+                    if number == 0:
+                        header = json.loads(text)
+                    else:
+                        blocks.append(Block.from_json(text))
+                except (ValueError, KeyError, TypeError):
+                    break
+    except OSError:
+        return None, []
+    return header, blocks
+
+
+def _split_lines(data: bytes) -> List[str]:
+    return data.decode('utf-8', errors='replace').splitlines()
+
+
+def compress_segment(plain: Path, target: Path) -> None:
+    """Write ``plain`` as ``target`` (gzip, one member per block) plus ``target.idx``."""
+    index_path = Path(f'{target}.idx')
+    tmp = Path(f'{target}.tmp')
+    tmp_index = Path(f'{index_path}.tmp')
+    with open(plain, 'rb') as source, open(tmp, 'wb') as out, open(tmp_index, 'w', encoding='utf-8') as index:
+        index.write(json.dumps({'segment': plain.name, 'format': 'gzip'}) + '\n')
+        builder = _BlockBuilder(0)
+        chunk: List[bytes] = []
+
+        def close_block() -> None:
+            member = gzip.compress(b''.join(chunk), compresslevel=6, mtime=0)
+            index.write(builder.build(out.tell(), len(member)).to_json() + '\n')
+            out.write(member)
+
+        for raw in source:
+            if not raw.endswith(b'\n'):
+                raw += b'\n'
+            builder.add(raw.decode('utf-8', errors='replace').rstrip('\n'), len(raw))
+            chunk.append(raw)
+            if builder.lines >= BLOCK_LINES:
+                close_block()
+                builder = _BlockBuilder(0)
+                chunk = []
+        if builder.lines:
+            close_block()
+    os.replace(tmp_index, index_path)
+    os.replace(tmp, target)
+
+
+class Segment(NamedTuple):
+    id: str
+    path: Path
+    compressed: bool
 
 
 class ServiceLogWriter(threading.Thread):
-    def __init__(self, path: Path, max_lines_keep: int = 5000):
+    def __init__(
+        self,
+        path: Path,
+        max_lines_keep: int = 5000,
+        max_bytes: int = LOG_MAX_BYTES,
+        rotate_seconds: float = LOG_ROTATE_SECONDS,
+        keep_segments: int = LOG_KEEP_SEGMENTS,
+    ):
         super().__init__(daemon=True, name='service-log-writer')
         self.path = Path(path)
         self.queue: queue.Queue = queue.Queue(maxsize=10000)
         self.deque: deque = deque(maxlen=max_lines_keep)
+        self.max_bytes = int(max_bytes)
+        self.rotate_seconds = float(rotate_seconds)
+        self.keep_segments = max(1, int(keep_segments))
         self._stop = threading.Event()
+        # Lines lost because the writer fell behind (queue full).
+        self.dropped = 0
+        # Guards the active file's state shared with readers: blocks, size, segment id.
+        self._lock = threading.Lock()
+        self._compress_lock = threading.Lock()
+        self._index_cache: 'Dict[Tuple[str, float], List[Block]]' = {}
+        self._handle = None
+        self._index = None
+        self._blocks: List[Block] = []
+        self._builder = _BlockBuilder(0)
+        self._size = 0
+        self._segment = ''
+        self._opened_at = 0.0
         try:
             self.path.parent.mkdir(parents=True, exist_ok=True)
-        except OSError:
-            pass
+            self._open()
+        except OSError as exc:
+            print(f'[WARN] Cannot open service log {self.path}: {exc}', flush=True)
+        # A log retired by ``_open`` may be gigabytes: never compress it on the caller's thread.
+        self._compress_in_background()
+
+    @property
+    def index_path(self) -> Path:
+        return Path(f'{self.path}.idx')
+
+    def _segment_path(self, segment: str) -> Path:
+        return self.path.with_name(f'{self.path.stem}.{segment}{self.path.suffix}')
+
+    def _new_segment_id(self, started: float) -> str:
+        base = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+        segment, counter = base, 0
+        while self._segment_path(segment).exists() or Path(f'{self._segment_path(segment)}.gz').exists():
+            counter += 1
+            segment = f'{base}.{counter}'
+        return segment
+
+    def _open(self) -> None:
+        """Open the active log, rebuilding whatever part of its index is missing."""
+        header, blocks = _read_index(self.index_path) if self.path.exists() else (None, [])
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if size and header is None:
+            # A log from before indexing (possibly huge): retire it as a segment whole.
+            started = self.path.stat().st_mtime
+            segment = self._new_segment_id(started)
+            os.replace(self.path, self._segment_path(segment))
+            size = 0
+        if header is None or not size:
+            self._opened_at = time.time()
+            self._segment = self._new_segment_id(self._opened_at)
+            with open(self.index_path, 'w', encoding='utf-8') as handle:
+                handle.write(json.dumps({'segment': self._segment, 'started': self._opened_at}) + '\n')
+            blocks = []
+            size = 0
+            open(self.path, 'wb').close()
+        else:
+            self._segment = str(header.get('segment') or self._new_segment_id(time.time()))
+            self._opened_at = float(header.get('started') or time.time())
+            end = 0
+            valid = []
+            for block in blocks:
+                if block.offset != end or block.offset + block.length > size:
+                    break
+                valid.append(block)
+                end = block.offset + block.length
+            if len(valid) != len(blocks):
+                with open(self.index_path, 'w', encoding='utf-8') as handle:
+                    handle.write(json.dumps({'segment': self._segment, 'started': self._opened_at}) + '\n')
+                    handle.writelines(block.to_json() + '\n' for block in valid)
+            blocks = valid
+        self._blocks = blocks
+        self._index = open(self.index_path, 'a', encoding='utf-8')
+        self._handle = open(self.path, 'ab')
+        self._size = size
+        start = blocks[-1].offset + blocks[-1].length if blocks else 0
+        self._builder = _BlockBuilder(start)
+        if start < size:
+            # Lines written after the last indexed block (the index lags by up to a block).
+            with open(self.path, 'rb') as handle:
+                handle.seek(start)
+                for raw in handle:
+                    if not raw.endswith(b'\n'):
+                        self._handle.write(b'\n')
+                        self._size += 1
+                        raw += b'\n'
+                    self._account(raw.decode('utf-8', errors='replace').rstrip('\n'), len(raw))
+
+    def _account(self, line: str, size: int) -> None:
+        self._builder.add(line, size)
+        if self._builder.lines >= BLOCK_LINES:
+            self._close_block()
+
+    def _close_block(self) -> None:
+        block = self._builder.build()
+        self._index.write(block.to_json() + '\n')
+        self._index.flush()
+        with self._lock:
+            self._blocks.append(block)
+        self._builder = _BlockBuilder(block.offset + block.length)
 
     def run(self) -> None:
         buf = []
@@ -36,16 +329,83 @@ class ServiceLogWriter(threading.Thread):
                 self._flush(buf)
                 buf = []
                 last_flush = time.time()
+            self._maybe_rotate()
 
         if buf:
             self._flush(buf)
+        self._close()
 
     def _flush(self, lines) -> None:
+        if self._handle is None:
+            return
         try:
-            with open(self.path, 'a', encoding='utf-8') as f:
-                f.write('\n'.join(lines) + '\n')
+            for line in lines:
+                raw = (line.replace('\n', ' ') + '\n').encode('utf-8', errors='replace')
+                self._handle.write(raw)
+                self._account(line, len(raw))
+            self._handle.flush()
         except OSError:
-            pass
+            return
+        with self._lock:
+            self._size = self._handle.tell()
+
+    def _close(self) -> None:
+        for handle in (self._handle, self._index):
+            if handle is not None:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+        self._handle = self._index = None
+
+    def _maybe_rotate(self) -> None:
+        if self._handle is None or not self._size:
+            return
+        too_old = self.rotate_seconds > 0 and time.time() - self._opened_at >= self.rotate_seconds
+        if self._size < self.max_bytes and not too_old:
+            return
+        try:
+            if self._builder.lines:
+                self._close_block()
+            self._close()
+            with self._lock:
+                target = self._segment_path(self._segment)
+                os.replace(self.index_path, f'{target}.idx')
+                os.replace(self.path, target)
+                self._open()
+        except OSError as exc:
+            print(f'[WARN] Cannot rotate service log {self.path}: {exc}', flush=True)
+            if self._handle is None:
+                try:
+                    self._open()
+                except OSError:
+                    pass
+            return
+        self._compress_in_background()
+
+    def _compress_in_background(self) -> None:
+        threading.Thread(target=self._compress_pending, daemon=True, name='service-log-compress').start()
+
+    def _compress_pending(self) -> None:
+        """Compress rotated plain segments, then enforce the segment limit."""
+        with self._compress_lock:
+            for segment in self.segments():
+                if segment.compressed:
+                    continue
+                target = Path(f'{segment.path}.gz')
+                try:
+                    compress_segment(segment.path, target)
+                    segment.path.unlink()
+                    Path(f'{segment.path}.idx').unlink(missing_ok=True)
+                except OSError as exc:
+                    print(f'[WARN] Cannot compress log segment {segment.path}: {exc}', flush=True)
+            rotated = self.segments()
+            for segment in rotated[:max(0, len(rotated) - self.keep_segments)]:
+                for path in (segment.path, Path(f'{segment.path}.idx')):
+                    try:
+                        path.unlink(missing_ok=True)
+                    except OSError:
+                        pass
 
     def stop(self) -> None:
         self._stop.set()
@@ -58,7 +418,169 @@ class ServiceLogWriter(threading.Thread):
         try:
             self.queue.put_nowait(line)
         except queue.Full:
-            pass
+            self.dropped += 1
 
     def tail_lines(self, n: int = 100):
         return list(self.deque)[-n:]
+
+    # Reading -------------------------------------------------------------------
+
+    def segments(self) -> List[Segment]:
+        """Rotated segments, oldest first (a compressed copy wins over a plain one)."""
+        found: Dict[str, Segment] = {}
+        prefix = f'{self.path.stem}.'
+        for suffix, compressed in ((self.path.suffix, False), (f'{self.path.suffix}.gz', True)):
+            for path in self.path.parent.glob(f'{prefix}*{suffix}'):
+                segment = path.name[len(prefix):-len(suffix)]
+                if not segment or (segment in found and found[segment].compressed):
+                    continue
+                found[segment] = Segment(segment, path, compressed)
+        return [found[key] for key in sorted(found)]
+
+    def _segment_blocks(self, segment: Segment) -> List[Block]:
+        try:
+            mtime = segment.path.stat().st_mtime
+        except OSError:
+            return []
+        key = (str(segment.path), mtime)
+        blocks = self._index_cache.get(key)
+        if blocks is None:
+            _header, blocks = _read_index(Path(f'{segment.path}.idx'))
+            if not segment.compressed:
+                end = blocks[-1].offset + blocks[-1].length if blocks else 0
+                size = segment.path.stat().st_size
+                if end < size:
+                    blocks.append(Block(end, size - end, -1, -1, None, '', ''))
+            if segment.compressed:
+                self._index_cache[key] = blocks
+                while len(self._index_cache) > CACHED_SEGMENTS:
+                    self._index_cache.pop(next(iter(self._index_cache)))
+        return blocks
+
+    def _active(self) -> Tuple[Segment, List[Block]]:
+        with self._lock:
+            blocks = list(self._blocks)
+            size = self._size
+            segment = Segment(self._segment, self.path, False)
+        end = blocks[-1].offset + blocks[-1].length if blocks else 0
+        if end < size:
+            blocks.append(Block(end, size - end, -1, -1, None, '', ''))
+        return segment, blocks
+
+    @staticmethod
+    def _read_block(segment: Segment, block: Block) -> List[str]:
+        try:
+            with open(segment.path, 'rb') as handle:
+                handle.seek(block.offset)
+                data = handle.read(block.length)
+        except OSError:
+            return []
+        if segment.compressed:
+            try:
+                data = zlib.decompressobj(wbits=31).decompress(data)
+            except zlib.error:
+                return []
+        return _split_lines(data)
+
+    def query(
+        self,
+        limit: int = 100,
+        before: Optional[str] = None,
+        min_level: int = 0,
+        search: Optional[str] = None,
+        task_terms: Optional[Sequence[str]] = None,
+    ) -> Dict:
+        """One page of lines older than cursor ``before`` (newest page when ``None``).
+
+        ``search`` is a case-insensitive substring; ``task_terms`` (a task id and its
+        source path) keep lines mentioning any of them. Returns the lines oldest first,
+        ``next_before`` for the page before them (``None`` at the start of the history)
+        and ``truncated`` when the scan budget ran out before the page filled up.
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        position = None
+        if before:
+            parts = str(before).rsplit(':', 2)
+            try:
+                if len(parts) != 3:
+                    raise ValueError(before)
+                # A line of "*" stands for the whole block.
+                position = (parts[0], int(parts[1]), None if parts[2] == '*' else int(parts[2]))
+            except ValueError as exc:
+                raise ValueError('invalid cursor') from exc
+
+        needle = search.lower() if search else None
+        search_tokens = whole_tokens(search) if search else []
+        task_patterns = []
+        task_tokens = []
+        for term in task_terms or ():
+            # Paths must end at a component boundary: /TV/Show is not /TV/Showtime.
+            task_patterns.append(re.compile(re.escape(term) + r'(?=[/\s]|$)'))
+            task_tokens.append([token.lower() for token in _TOKEN.findall(term)])
+        level_mask = ~((1 << (min_level // 10)) - 1)
+
+        def block_may_match(block: Block) -> bool:
+            if block.levels >= 0 and not block.levels & level_mask:
+                return False
+            if block.bloom is None:
+                return True
+            if not search_tokens and not task_tokens:
+                return True
+            bits = bloom_decode(block.bloom)
+            if search_tokens and not bloom_has_all(bits, search_tokens):
+                return False
+            return not task_tokens or any(bloom_has_all(bits, tokens) for tokens in task_tokens)
+
+        def line_matches(line: str) -> bool:
+            if min_level and event_level(line[STAMP:]) < min_level:
+                return False
+            if needle is not None and needle not in line.lower():
+                return False
+            return not task_patterns or any(pattern.search(line) for pattern in task_patterns)
+
+        active, active_blocks = self._active()
+        segments = [(segment, None) for segment in self.segments() if segment.id != active.id]
+        segments.append((active, active_blocks))
+        seg_index = len(segments) - 1
+        block_index: Optional[int] = None
+        line_end: Optional[int] = None
+        if position is not None:
+            ids = [segment.id for segment, _blocks in segments]
+            if position[0] in ids:
+                seg_index = ids.index(position[0])
+                block_index, line_end = position[1], position[2]
+            else:
+                # Rotated away and deleted since: continue with the next older segment.
+                seg_index = sum(1 for item in ids if item < position[0]) - 1
+
+        matches: List[str] = []
+        scanned = 0
+        next_before = None
+        truncated = False
+        while seg_index >= 0 and next_before is None:
+            segment, blocks = segments[seg_index]
+            if blocks is None:
+                blocks = self._segment_blocks(segment)
+            if block_index is None or block_index >= len(blocks):
+                block_index, line_end = len(blocks) - 1, None
+            while block_index >= 0 and next_before is None:
+                block = blocks[block_index]
+                if scanned >= SCAN_BLOCKS:
+                    next_before = f'{segment.id}:{block_index}:{"*" if line_end is None else line_end}'
+                    truncated = True
+                elif block_may_match(block):
+                    lines = self._read_block(segment, block)
+                    scanned += 1
+                    end = len(lines) if line_end is None else min(line_end, len(lines))
+                    for number in range(end - 1, -1, -1):
+                        if line_matches(lines[number]):
+                            matches.append(lines[number])
+                            if len(matches) >= limit:
+                                next_before = f'{segment.id}:{block_index}:{number}'
+                                break
+                block_index -= 1
+                line_end = None
+            seg_index -= 1
+            block_index = None
+        matches.reverse()
+        return {'lines': matches, 'next_before': next_before, 'truncated': truncated, 'scanned_blocks': scanned}
@@ -0,0 +1,408 @@
+"""Manifests: placeholder plans, and file listings imported or exported as task sources.
+
+A ``plan`` task walks the source once and, for every directory with something to do,
+records which placeholders to create and which companions to copy, judged from one
+listing of the destination directory. Nothing is written to the destination. The
+manifest is one JSON object per line: a header, one ``{"dir", "create", "copy",
+"mkdir"}`` record per directory and a closing ``{"summary"}``. It is written plainly
+while the walk runs (an interrupted plan resumes from its last checkpoint) and gzip-compressed
+once it completes. Applying a plan replays the records against the destination without
+listing the source again.
+
+An imported manifest is a plain list of files relative to a source root, produced by
+anything that already knows the remote tree (``rclone lsjson -R --files-only``, an
+Alist or database dump, or ``/api/walks/export`` of an earlier walk): NDJSON with one
+path string or ``{"path", "size"}`` object per line, or CSV with the path in the first
+column and an optional size in the second; either may be gzip-compressed. It is read
+as a stream, so its size does not matter.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import json
+import os
+import posixpath
+import shutil
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .checkpoints import read_json, write_json_atomic
+
+SUMMARY_KEYS = ('create', 'copy', 'exists', 'filtered', 'new_dirs')
+MANIFEST_FORMATS = ('ndjson', 'csv')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class PlanWriter:
+    """Append directory records to a plan manifest and keep its running summary."""
+
+    def __init__(self, path: Path, header: Dict, dest_root: str, placeholder_size: int,
+                 resume: Optional[Dict] = None):
+        self.path = Path(path)
+        self.dest_root = dest_root
+        self.placeholder_size = int(placeholder_size)
+        self.summary = {key: 0 for key in SUMMARY_KEYS}
+        # Destination directories (relative) already checked for existence.
+        self._checked: set = set()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume is not None and self.path.exists():
+            self._recover(int(resume.get('offset', 0)), resume.get('summary') or {})
+            self._handle = open(self.path, 'ab')
+        else:
+            self._handle = open(self.path, 'wb')
+            self._write(header)
+
+    def _recover(self, offset: int, summary: Dict) -> None:
+        """Cut the manifest back to the last checkpoint, whose frontier the walk resumes from."""
+        with open(self.path, 'r+b') as handle:
+            handle.truncate(offset)
+            handle.seek(0)
+            for raw in handle:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    continue
+                # Its ancestors were checked too, or lie above one that exists.
+                rel = record.get('dir')
+                while rel is not None and rel not in self._checked:
+                    self._checked.add(rel)
+                    rel = os.path.dirname(rel) if rel else None
+        for key in SUMMARY_KEYS:
+            self.summary[key] = int(summary.get(key, 0))
+
+    def checkpoint(self) -> Dict:
+        """Where to resume: the manifest's length and the summary up to it."""
+        self._handle.flush()
+        return {'offset': self._handle.tell(), 'summary': dict(self.summary)}
+
+    def _write(self, record: Dict) -> None:
+        self._handle.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+
+    def _missing_dirs(self, rel: str) -> int:
+        """How many of ``rel`` and its ancestors do not exist yet under the destination."""
+        count = 0
+        while rel not in self._checked:
+            self._checked.add(rel)
+            if os.path.isdir(os.path.join(self.dest_root, rel) if rel else self.dest_root):
+                break
+            count += 1
+            if not rel:
+                break
+            rel = os.path.dirname(rel)
+        return count
+
+    def add(self, rel: str, create: List[str], copy: List[str], exists: int, filtered: int) -> None:
+        self.summary['exists'] += exists
+        self.summary['filtered'] += filtered
+        if not create and not copy:
+            return
+        mkdir = self._missing_dirs(rel)
+        record = {'dir': rel, 'create': create}
+        if copy:
+            record['copy'] = copy
+        if mkdir:
+            record['mkdir'] = mkdir
+        if exists:
+            record['exists'] = exists
+        self._write(record)
+        self.summary['create'] += len(create)
+        self.summary['copy'] += len(copy)
+        self.summary['new_dirs'] += mkdir
+
+    def totals(self, dirs: int, files: int) -> Dict:
+        summary = dict(self.summary, dirs=dirs, files=files)
+        summary['inodes'] = summary['create'] + summary['copy'] + summary['new_dirs']
+        summary['bytes'] = summary['create'] * self.placeholder_size
+        return summary
+
+    def close(self, summary: Optional[Dict] = None) -> None:
+        """Close the manifest; with ``summary`` the plan is complete and gets compressed."""
+        if summary is not None:
+            self._write({'summary': summary})
+        self._handle.close()
+        if summary is None:
+            return
+        target = Path(f'{self.path}.gz')
+        tmp = Path(f'{target}.tmp')
+        with open(self.path, 'rb') as source, gzip.open(tmp, 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(source, out, 1 << 20)
+        os.replace(tmp, target)
+        self.path.unlink()
+
+
+class PlanStore:
+    """``plans/<id>.json`` (status and summary) and ``plans/<id>.ndjson[.gz]`` (manifest)."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root) / 'plans'
+
+    @staticmethod
+    def _safe(plan_id: str) -> str:
+        return ''.join(ch for ch in str(plan_id) if ch.isalnum() or ch in '-_')
+
+    def manifest_path(self, plan_id: str) -> Path:
+        return self.root / f'{self._safe(plan_id)}.ndjson'
+
+    def _meta_path(self, plan_id: str) -> Path:
+        return self.root / f'{self._safe(plan_id)}.json'
+
+    def save(self, plan_id: str, **fields) -> Dict:
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta = self.get(plan_id) or {'id': plan_id, 'created_at': time.time()}
+        meta.update(fields)
+        write_json_atomic(self._meta_path(plan_id), meta)
+        return meta
+
+    def get(self, plan_id: str) -> Optional[Dict]:
+        data = read_json(self._meta_path(plan_id))
+        return data if isinstance(data, dict) else None
+
+    def list(self) -> List[Dict]:
+        plans = []
+        for path in self.root.glob('*.json'):
+            data = read_json(path)
+            if isinstance(data, dict):
+                plans.append(data)
+        plans.sort(key=lambda item: item.get('created_at') or 0, reverse=True)
+        return plans
+
+    def delete(self, plan_id: str) -> Optional[Dict]:
+        meta = self.get(plan_id)
+        if meta is None:
+            return None
+        base = self.manifest_path(plan_id)
+        for path in (base, Path(f'{base}.gz'), self._meta_path(plan_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return meta
+
+    def lines(self, plan_id: str) -> Iterator[str]:
+        """The manifest's lines, compressed or not (a running plan is read as far as written)."""
+        base = self.manifest_path(plan_id)
+        compressed = Path(f'{base}.gz')
+        if compressed.exists():
+            handle = gzip.open(compressed, 'rt', encoding='utf-8')
+        else:
+            handle = open(base, 'r', encoding='utf-8')
+        with handle:
+            for line in handle:
+                if line.endswith('\n'):
+                    yield line
+
+    def records(self, plan_id: str) -> Iterator[Dict]:
+        """The directory records of a plan."""
+        for line in self.lines(plan_id):
+            record = json.loads(line)
+            if 'dir' in record:
+                yield record
+
+
+def clean_rel(path) -> Optional[str]:
+    """A manifest path as a safe relative path, or ``None`` if it leaves the root."""
+    if not isinstance(path, str):
+        return None
+    parts = [part for part in path.strip().split('/') if part and part != '.']
+    if not parts or '..' in parts or '\0' in path:
+        return None
+    return '/'.join(parts)
+
+
+def _size(value) -> Optional[int]:
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return None
+    return size if size >= 0 else None
+
+
+def _json_entry(record) -> Optional[Tuple[Optional[str], Optional[int]]]:
+    """``(path, size)`` of one NDJSON record; ``None`` for a directory record."""
+    if isinstance(record, str):
+        return record, None
+    if not isinstance(record, dict):
+        return None, None
+    if record.get('IsDir') or record.get('is_dir'):
+        return None
+    path = record.get('path', record.get('Path'))
+    return path, _size(record.get('size', record.get('Size')))
+
+
+def read_entries(path: Path, fmt: str, invalid: Optional[Dict] = None) -> Iterator[Tuple[str, Optional[int]]]:
+    """``(relative path, size or None)`` for every file listed in a manifest, streamed.
+
+    Blank lines, directory records and a CSV header are skipped. Unsafe or malformed
+    entries are skipped and counted in ``invalid['count']``.
+    """
+    invalid = invalid if invalid is not None else {}
+    invalid.setdefault('count', 0)
+    with open(path, 'rb') as raw:
+        compressed = raw.read(2) == GZIP_MAGIC
+    binary = gzip.open(path, 'rb') if compressed else open(path, 'rb')
+    with io.TextIOWrapper(binary, encoding='utf-8', errors='replace', newline='') as handle:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.reader(handle)):
+                if not row or (number == 0 and row[0].strip().lower() in ('path', 'name', 'file')):
+                    continue
+                rel = clean_rel(row[0])
+                if rel is None:
+                    invalid['count'] += 1
+                    continue
+                yield rel, _size(row[1]) if len(row) > 1 else None
+            return
+        for line in handle:
+            # Also accepts the JSON array rclone lsjson prints: one object per line.
+            line = line.strip().rstrip(',')
+            if not line or line in ('[', ']'):
+                continue
+            try:
+                entry = _json_entry(json.loads(line))
+            except ValueError:
+                entry = (None, None)
+            if entry is None:
+                continue
+            rel = clean_rel(entry[0])
+            if rel is None:
+                invalid['count'] += 1
+                continue
+            yield rel, entry[1]
+
+
+def group_by_dir(entries: Iterable[Tuple[str, Optional[int]]], limit: int) -> Iterator[Tuple[str, List]]:
+    """Batch consecutive entries of the same directory, at most ``limit`` per batch.
+
+    Sorted manifests give one batch per directory; an unsorted one just gives more,
+    smaller batches.
+    """
+    current = None
+    batch: List = []
+    for rel, size in entries:
+        parent, name = posixpath.split(rel)
+        if parent != current or len(batch) >= limit:
+            if batch:
+                yield current, batch
+            current, batch = parent, []
+        batch.append((name, size))
+    if batch:
+        yield current, batch
+
+
+class ManifestStore:
+    """Uploaded manifests: ``manifests/<id>.data`` plus ``manifests/<id>.json`` (metadata)."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root) / 'manifests'
+
+    @staticmethod
+    def _safe(manifest_id: str) -> str:
+        return ''.join(ch for ch in str(manifest_id) if ch.isalnum() or ch in '-_')
+
+    def data_path(self, manifest_id: str) -> Path:
+        return self.root / f'{self._safe(manifest_id)}.data'
+
+    def _meta_path(self, manifest_id: str) -> Path:
+        return self.root / f'{self._safe(manifest_id)}.json'
+
+    def save_upload(self, stream, fmt: Optional[str], name: str = '') -> Dict:
+        """Copy an upload to disk in chunks. Raises ``ValueError`` for an unknown format."""
+        if fmt is not None and fmt not in MANIFEST_FORMATS:
+            raise ValueError(f'format must be one of {", ".join(MANIFEST_FORMATS)}')
+        self.root.mkdir(parents=True, exist_ok=True)
+        manifest_id = uuid.uuid4().hex[:12]
+        path = self.data_path(manifest_id)
+        size = 0
+        with open(path, 'wb') as out:
+            while True:
+                chunk = stream.read(1 << 20)
+                if not chunk:
+                    break
+                out.write(chunk)
+                size += len(chunk)
+        if fmt is None:
+            fmt = self._sniff(path, name)
+        meta = {'id': manifest_id, 'name': name, 'format': fmt, 'bytes': size, 'uploaded_at': time.time()}
+        write_json_atomic(self._meta_path(manifest_id), meta)
+        return meta
+
+    @staticmethod
+    def _sniff(path: Path, name: str) -> str:
+        lowered = name.lower()
+        for fmt in MANIFEST_FORMATS:
+            if lowered.endswith((f'.{fmt}', f'.{fmt}.gz')):
+                return fmt
+        if lowered.endswith(('.json', '.jsonl', '.json.gz', '.jsonl.gz')):
+            return 'ndjson'
+        with open(path, 'rb') as raw:
+            compressed = raw.read(2) == GZIP_MAGIC
+        with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as handle:
+            try:
+                head = handle.read(64).lstrip()
+            except (OSError, EOFError):
+                head = b''
+        return 'ndjson' if head[:1] in (b'{', b'[', b'"') else 'csv'
+
+    def get(self, manifest_id: str) -> Optional[Dict]:
+        data = read_json(self._meta_path(manifest_id))
+        return data if isinstance(data, dict) else None
+
+    def list(self) -> List[Dict]:
+        items = []
+        for path in self.root.glob('*.json'):
+            data = read_json(path)
+            if isinstance(data, dict):
+                items.append(data)
+        items.sort(key=lambda item: item.get('uploaded_at') or 0, reverse=True)
+        return items
+
+    def delete(self, manifest_id: str) -> Optional[Dict]:
+        meta = self.get(manifest_id)
+        if meta is None:
+            return None
+        for path in (self.data_path(manifest_id), self._meta_path(manifest_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return meta
+
+    def update(self, manifest_id: str, **fields) -> None:
+        meta = self.get(manifest_id)
+        if meta is not None:
+            meta.update(fields)
+            write_json_atomic(self._meta_path(manifest_id), meta)
+
+
+def export_lines(rows: Iterable[Tuple[str, List[str]]], fmt: str) -> Iterator[bytes]:
+    """Encode a walk snapshot (``(rel dir, file names)`` rows) as an importable manifest.
+
+    ``ndjson`` gives one ``{"path"}`` object per line; ``csv`` a gzip-compressed CSV with
+    a ``path`` header.
+    """
+    if fmt == 'csv':
+        # wbits=31 writes a gzip stream.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(['path'])
+        for rel, files in rows:
+            for name in files:
+                writer.writerow([posixpath.join(rel, name) if rel else name])
+            if buffer.tell() >= 1 << 16:
+                yield compressor.compress(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+        yield compressor.compress(buffer.getvalue().encode('utf-8')) + compressor.flush()
+        return
+    for rel, files in rows:
+        if files:
+            yield ''.join(
+                json.dumps({'path': posixpath.join(rel, name) if rel else name}, ensure_ascii=False) + '\n'
+                for name in files
+            ).encode('utf-8')
+
@@ -1,9 +1,13 @@
 """Path discovery, allow-list checks, and destination layout helpers."""
 from __future__ import annotations
 
+import os
 import re
+import select
+import threading
+import time
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence
+from typing import FrozenSet, Iterable, List, Optional, Sequence, Tuple
 
 
 SKIP_FS_TYPES = frozenset({
@@ -41,6 +45,105 @@ def discover_mount_points() -> List[Path]:
     return [Path(item) for item in sorted(roots) if item not in SKIP_ROOTS]
 
 
+class MountTable:
+    """Cached ``discover_mount_points()`` result.
+
+    Re-read only when the kernel signals a mount-table change on ``/proc/self/mounts``
+    (``POLLPRI``) or, where that is unavailable, once ``ttl`` seconds have passed.
+    ``generation`` increases whenever the list actually changes.
+    """
+
+    def __init__(self, ttl: float = 30.0, mounts_path: str = '/proc/self/mounts'):
+        self.ttl = float(ttl)
+        self.mounts_path = mounts_path
+        self._lock = threading.Lock()
+        self._points: List[Path] = []
+        self._generation = 0
+        self._loaded_at = 0.0
+        self._loaded = False
+        self._poller = None
+        self._fd: Optional[int] = None
+
+    def _watch(self) -> None:
+        if self._fd is not None or not hasattr(select, 'poll'):
+            return
+        try:
+            self._fd = os.open(self.mounts_path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+            self._poller = select.poll()
+            self._poller.register(self._fd, select.POLLPRI | select.POLLERR)
+            # The first poll reports the current state; consume it.
+            self._poller.poll(0)
+        except OSError:
+            self._fd = None
+            self._poller = None
+
+    def _changed(self) -> bool:
+        if self._poller is None:
+            return False
+        try:
+            return bool(self._poller.poll(0))
+        except OSError:
+            return False
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded = False
+
+    def snapshot(self) -> Tuple[int, List[Path]]:
+        with self._lock:
+            now = time.monotonic()
+            stale = not self._loaded or self._changed() or now - self._loaded_at >= self.ttl
+            if stale:
+                self._watch()
+                points = discover_mount_points()
+                if not self._loaded or points != self._points:
+                    self._points = points
+                    self._generation += 1
+                self._loaded = True
+                self._loaded_at = now
+            return self._generation, list(self._points)
+
+    def points(self) -> List[Path]:
+        return self.snapshot()[1]
+
+
+def mount_point_for(path: Path, mount_points: Optional[Sequence[Path]] = None) -> str:
+    """Return the deepest known mount point containing ``path`` ('/' if none does)."""
+    if mount_points is None:
+        mount_points = discover_mount_points()
+    path_str = str(path)
+    best = '/'
+    for point in mount_points:
+        point_str = str(point).rstrip('/') or '/'
+        if len(point_str) <= len(best):
+            continue
+        if path_str == point_str or path_str.startswith(point_str + '/'):
+            best = point_str
+    return best
+
+
+def fs_type_for(path: Path, mounts_path: str = '/proc/self/mounts') -> str:
+    """Filesystem type of the deepest mount containing ``path`` ('' if unknown)."""
+    path_str = str(path)
+    best = ''
+    best_type = ''
+    try:
+        with open(mounts_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                # Spaces and tabs in mount points are octal-escaped in the mount table.
+                point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), parts[1]).rstrip('/') or '/'
+                inside = point == '/' or path_str == point or path_str.startswith(point + '/')
+                if inside and len(point) >= len(best):
+                    best = point
+                    best_type = parts[2]
+    except OSError:
+        return ''
+    return best_type
+
+
 def normalize_roots(items: Iterable) -> List[Path]:
     normalized: List[Path] = []
     seen = set()
@@ -93,6 +196,54 @@ def is_allowed_path(path: Path, allowed_roots: Sequence[Path], extra_roots: Opti
     return False
 
 
+class AllowList:
+    """Allow-list of resolved roots with O(path depth) membership checks.
+
+    Roots are resolved once (and again only when the optional ``mount_table`` reports a
+    change); checking a path costs a single ``resolve()`` plus set lookups of its
+    ancestors, instead of resolving the path and every root per root.
+    """
+
+    def __init__(self, roots: Iterable, mount_table: Optional[MountTable] = None):
+        self._static = [str(path) for path in normalize_roots(roots)]
+        self._mount_table = mount_table
+        self._lock = threading.Lock()
+        self._generation = -1
+        self._index: FrozenSet[str] = frozenset(self._static)
+
+    def roots(self) -> List[str]:
+        return sorted(self._current())
+
+    def _current(self) -> FrozenSet[str]:
+        if self._mount_table is None:
+            return self._index
+        generation, points = self._mount_table.snapshot()
+        with self._lock:
+            if generation != self._generation:
+                self._index = frozenset(self._static + [str(path) for path in normalize_roots(points)])
+                self._generation = generation
+            return self._index
+
+    def allows_resolved(self, path_str: str) -> bool:
+        index = self._current()
+        if not index:
+            return False
+        current = path_str
+        while True:
+            if current in index:
+                return True
+            if current == '/' or not current:
+                return False
+            current = current[:current.rfind('/')] or '/'
+
+    def allows(self, path: Path) -> bool:
+        try:
+            resolved = Path(path).resolve()
+        except (OSError, RuntimeError, ValueError):
+            return False
+        return self.allows_resolved(str(resolved))
+
+
 def build_dest_final(src: Path, dst: Path) -> Path:
     """Preserve absolute source structure under the selected destination.
 
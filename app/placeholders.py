@@ -0,0 +1,459 @@
+"""Batched placeholder writer with a crash-recovery journal and per-filesystem strategies."""
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+from .config import PLACEHOLDER_SIZE, PLACEHOLDER_STRATEGY
+
+CREATE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_CLOEXEC', 0)
+OVERWRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_CLOEXEC', 0)
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+STRATEGIES = ('auto', 'sparse', 'reflink', 'hardlink')
+TEMPLATE_NAME = '.bnetdisk-template'
+
+
+def fs_top(path: str, dev: int) -> str:
+    """Topmost ancestor of ``path`` that is still on device ``dev``."""
+    current = os.path.abspath(path)
+    while True:
+        parent = os.path.dirname(current)
+        if parent == current:
+            return current
+        try:
+            if os.stat(parent).st_dev != dev:
+                return current
+        except OSError:
+            return current
+        current = parent
+
+
+class Materializer:
+    """How placeholders are made on one destination filesystem.
+
+    ``sparse``: ``ftruncate`` to size, no data blocks where the filesystem supports holes.
+    ``reflink``: ``FICLONE`` of a template file, sharing its extents (btrfs, XFS).
+    ``hardlink``: a hard link to a template file, so no new inode either. Every
+    placeholder is then the same file; only use it if the media server copes.
+    Templates live at the top of the filesystem as ``.bnetdisk-template[-N]``.
+    """
+
+    def __init__(self, strategy: str, size: int, template_dir: Optional[str] = None):
+        self.strategy = strategy
+        self.size = size
+        self.template_dir = template_dir
+        # Top of the destination filesystem this materializer serves (set by ``probe``).
+        self.root: Optional[str] = None
+        self.template_path: Optional[str] = None
+        self._template_fd = -1
+        self._generation = 0
+        self._rotate_lock = threading.Lock()
+
+    def open_template(self) -> None:
+        """(Re)create the template file; raises ``OSError`` if it cannot be written."""
+        self.close()
+        suffix = f'-{self._generation}' if self._generation else ''
+        path = os.path.join(self.template_dir, f'{TEMPLATE_NAME}{suffix}')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0), 0o644)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.write(fd, b'\0' * self.size)
+                os.fsync(fd)
+        except OSError:
+            os.close(fd)
+            raise
+        self.template_path = path
+        self._template_fd = fd
+
+    def close(self) -> None:
+        if self._template_fd >= 0:
+            os.close(self._template_fd)
+            self._template_fd = -1
+
+    def create(self, path: str, overwrite: bool) -> None:
+        """Materialize one placeholder. Raises ``FileExistsError`` or another ``OSError``."""
+        if self.strategy == 'hardlink':
+            if overwrite:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            template = self.template_path
+            try:
+                os.link(template, path)
+            except OSError as exc:
+                if exc.errno != errno.EMLINK:
+                    raise
+                # Per-inode link limit (65000 on ext4): continue with a fresh template,
+                # unless another batch has already started one.
+                with self._rotate_lock:
+                    if self.template_path == template:
+                        self._generation += 1
+                        self.open_template()
+                os.link(self.template_path, path)
+            return
+        fd = os.open(path, OVERWRITE_FLAGS if overwrite else CREATE_FLAGS, 0o666)
+        try:
+            if self.strategy == 'reflink':
+                try:
+                    fcntl.ioctl(fd, FICLONE, self._template_fd)
+                    return
+                except OSError:
+                    pass  # Fall back to a sparse placeholder for this file.
+            os.ftruncate(fd, self.size)
+        except OSError:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            raise
+        finally:
+            os.close(fd)
+
+
+def probe(dest_dir: str, dev: int, size: int, preferred: str = 'auto') -> Materializer:
+    """Pick the cheapest working strategy for the filesystem holding ``dest_dir``.
+
+    ``auto`` keeps ``sparse`` when a truncated probe file really has no data blocks,
+    otherwise tries ``reflink``. ``hardlink`` is only used when asked for explicitly.
+    Anything that cannot be set up falls back to ``sparse``.
+    """
+    top = fs_top(dest_dir, dev)
+    materializer = _probe(dest_dir, top, size, preferred)
+    materializer.root = top
+    return materializer
+
+
+def _probe(dest_dir: str, top: str, size: int, preferred: str) -> Materializer:
+    template_dir = top if os.access(top, os.W_OK) else dest_dir
+    if preferred == 'sparse':
+        return Materializer('sparse', size)
+    if preferred == 'auto':
+        probe_path = os.path.join(dest_dir, f'{TEMPLATE_NAME}.probe.{os.getpid()}')
+        try:
+            fd = os.open(probe_path, CREATE_FLAGS, 0o600)
+            try:
+                os.ftruncate(fd, size)
+                holes = os.fstat(fd).st_blocks == 0
+            finally:
+                os.close(fd)
+                os.unlink(probe_path)
+        except OSError:
+            holes = True
+        if holes:
+            return Materializer('sparse', size)
+    strategy = 'hardlink' if preferred == 'hardlink' else 'reflink'
+    if strategy == 'reflink' and fcntl is None:
+        return Materializer('sparse', size)
+    materializer = Materializer(strategy, size, template_dir)
+    try:
+        materializer.open_template()
+        if strategy == 'reflink':
+            probe_path = os.path.join(template_dir, f'{TEMPLATE_NAME}.probe.{os.getpid()}')
+            fd = os.open(probe_path, CREATE_FLAGS, 0o600)
+            try:
+                fcntl.ioctl(fd, FICLONE, materializer._template_fd)
+            finally:
+                os.close(fd)
+                os.unlink(probe_path)
+    except OSError:
+        materializer.close()
+        return Materializer('sparse', size)
+    return materializer
+
+
+def copy_companion(src: str, dest: str, max_bytes: int) -> bool:
+    """Copy a small companion file (subtitle, poster) for real; ``False`` if it is too big.
+
+    The copy lands under a temporary name and is renamed into place, so a crash never
+    leaves a truncated companion behind.
+    """
+    with open(src, 'rb') as source:
+        if os.fstat(source.fileno()).st_size > max_bytes:
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(dest), f'.{os.path.basename(dest)}.bnetdisk-tmp')
+        try:
+            with open(tmp, 'wb') as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+            os.replace(tmp, dest)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+    return True
+
+
+class PlaceholderWriter:
+    """Create the placeholders of one destination directory in a single batch.
+
+    Each batch creates its parent directory at most once, lists it once instead of
+    stat-ing every target, and creates files in place (no temp file or rename) with the
+    ``Materializer`` probed for the directory's filesystem. Target paths are appended to a
+    journal before the batch starts and the journal is cleared when it ends; ``recover``
+    completes any placeholder a crash left short.
+
+    Batches run concurrently: the lock only guards the directory and materializer caches,
+    and each batch borrows a journal of its own from a pool (``journal_path`` plus
+    ``<journal_path>-N`` files opened as concurrency requires).
+
+    Outcomes per name: ``'created'``, ``'exists'`` (left untouched) or ``'failed'``.
+    ``observe(op, seconds)`` is told how long each ``mkdir``, ``listdir``, ``journal``
+    write and placeholder ``create`` took.
+    """
+
+    def __init__(
+        self,
+        journal_path: Path,
+        size: int = PLACEHOLDER_SIZE,
+        onerror: Optional[Callable[[str], None]] = None,
+        observe: Optional[Callable[[str, float], None]] = None,
+        strategy: str = PLACEHOLDER_STRATEGY,
+    ):
+        self.journal_path = Path(journal_path)
+        self.size = int(size)
+        self.onerror = onerror
+        self.observe = observe
+        self._lock = threading.Lock()
+        # Serializes probing, so one filesystem is probed once (the probe file name is fixed).
+        self._probe_lock = threading.Lock()
+        self.strategy = strategy if strategy in STRATEGIES else 'auto'
+        # Destination directory -> device, and device -> how to make files there.
+        self._known_dirs: Dict[str, int] = {}
+        self._materializers: Dict[int, Materializer] = {}
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self._journal_lock = threading.Lock()
+        self._journals: List[int] = []
+        self._free_journals: List[int] = [self._open_journal(self.journal_path)]
+        self._journals.extend(self._free_journals)
+
+    @staticmethod
+    def _open_journal(path: Path) -> int:
+        return os.open(
+            str(path),
+            os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_CLOEXEC', 0),
+            0o644,
+        )
+
+    def _take_journal(self) -> int:
+        with self._journal_lock:
+            if self._free_journals:
+                return self._free_journals.pop()
+            fd = self._open_journal(Path(f'{self.journal_path}-{len(self._journals)}'))
+            self._journals.append(fd)
+            return fd
+
+    def _give_journal(self, fd: int) -> None:
+        os.ftruncate(fd, 0)
+        with self._journal_lock:
+            self._free_journals.append(fd)
+
+    def close(self) -> None:
+        with self._lock:
+            for materializer in self._materializers.values():
+                materializer.close()
+            self._materializers.clear()
+        with self._journal_lock:
+            for fd in self._journals:
+                os.close(fd)
+            self._journals = []
+            self._free_journals = []
+
+    def _log(self, message: str) -> None:
+        if self.onerror is not None:
+            self.onerror(message)
+
+    def _timed(self, op: str, started: float) -> None:
+        if self.observe is not None:
+            self.observe(op, time.monotonic() - started)
+
+    def recover(self) -> int:
+        """Finish placeholders interrupted mid-batch. Returns how many were repaired.
+
+        Call before the first batch: the pool's extra journals are read and removed.
+        """
+        with self._journal_lock:
+            fd = self._journals[0]
+            repaired = self._recover_journal(fd)
+            os.ftruncate(fd, 0)
+            for path in sorted(self.journal_path.parent.glob(self.journal_path.name + '-*')):
+                try:
+                    extra = os.open(str(path), os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+                except OSError:
+                    continue
+                try:
+                    repaired += self._recover_journal(extra)
+                finally:
+                    os.close(extra)
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            return repaired
+
+    def _recover_journal(self, fd: int) -> int:
+        os.lseek(fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        repaired = 0
+        for raw in b''.join(chunks).split(b'\n'):
+            if not raw:
+                continue
+            path = os.fsdecode(raw)
+            try:
+                info = os.lstat(path)
+                # An interrupted create leaves a short regular file. Anything else at a
+                # journaled path (a real file that appeared before our O_EXCL create,
+                # media that replaced a placeholder) is not ours and must never shrink.
+                if stat.S_ISREG(info.st_mode) and info.st_size < self.size:
+                    os.truncate(path, self.size)
+                    repaired += 1
+            except FileNotFoundError:
+                continue
+            except OSError as exc:
+                self._log(f'[ERROR] Cannot repair placeholder {path}: {exc}')
+        return repaired
+
+    def strategies(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {'root': item.root, 'strategy': item.strategy, 'template': item.template_path}
+                for item in self._materializers.values()
+            ]
+
+    def forget_dirs(self) -> None:
+        """Drop the cache of destination directories known to exist."""
+        with self._lock:
+            self._known_dirs.clear()
+
+    def forget_tree(self, dest_dir: str) -> None:
+        """Drop ``dest_dir`` and everything below it from the cache (it may have been removed)."""
+        dest_dir = os.fspath(dest_dir)
+        prefix = dest_dir.rstrip('/') + '/'
+        with self._lock:
+            for path in [path for path in self._known_dirs if path == dest_dir or path.startswith(prefix)]:
+                del self._known_dirs[path]
+
+    def _make_dir(self, dest_dir: str) -> Optional[int]:
+        """Create ``dest_dir`` and cache its device; ``None`` (logged) on failure."""
+        started = time.monotonic()
+        try:
+            os.makedirs(dest_dir, exist_ok=True)
+            dev = os.stat(dest_dir).st_dev
+        except OSError as exc:
+            self._log(f'[ERROR] Cannot create parent directories for {dest_dir}: {exc}')
+            return None
+        finally:
+            self._timed('mkdir', started)
+        with self._lock:
+            self._known_dirs[dest_dir] = dev
+        return dev
+
+    def _materializer(self, dest_dir: str, dev: int) -> Materializer:
+        with self._lock:
+            materializer = self._materializers.get(dev)
+        if materializer is not None:
+            return materializer
+        with self._probe_lock:
+            with self._lock:
+                materializer = self._materializers.get(dev)
+            if materializer is not None:
+                return materializer
+            materializer = probe(dest_dir, dev, self.size, self.strategy)
+            with self._lock:
+                self._materializers[dev] = materializer
+        self._log(
+            f'[INFO] Placeholder strategy for {materializer.root}: {materializer.strategy}'
+            + (f' (template {materializer.template_path})' if materializer.template_path else '')
+        )
+        return materializer
+
+    def write_dir(
+        self,
+        dest_dir: str,
+        names: Sequence[str],
+        overwrite: bool = False,
+        existing: Optional[set] = None,
+    ) -> List[Tuple[str, str]]:
+        """``existing`` (names already in ``dest_dir``) skips the listing when the caller has one."""
+        dest_dir = os.fspath(dest_dir)
+        listed = existing is not None
+        existing = existing if listed else set()
+        with self._lock:
+            dev = self._known_dirs.get(dest_dir)
+        if dev is None:
+            dev = self._make_dir(dest_dir)
+            if dev is None:
+                return [(name, 'failed') for name in names]
+        materializer = self._materializer(dest_dir, dev)
+        if not overwrite and not listed:
+            started = time.monotonic()
+            try:
+                existing = set(os.listdir(dest_dir))
+            except OSError:
+                existing = set()
+            self._timed('listdir', started)
+
+        results: List[Tuple[str, str]] = []
+        todo: List[str] = []
+        for name in names:
+            if name in existing:
+                results.append((name, 'exists'))
+            else:
+                todo.append(name)
+        if not todo:
+            return results
+
+        paths = [os.path.join(dest_dir, name) for name in todo]
+        journal = self._take_journal()
+        try:
+            started = time.monotonic()
+            os.write(journal, b''.join(os.fsencode(path) + b'\n' for path in paths))
+            self._timed('journal', started)
+            recreated = False
+            for name, path in zip(todo, paths):
+                started = time.monotonic()
+                try:
+                    try:
+                        materializer.create(path, overwrite)
+                    except FileNotFoundError:
+                        # The cached directory was removed behind our back (a prune, or
+                        # by hand): forget it, create it again and retry once.
+                        if recreated:
+                            raise
+                        recreated = True
+                        with self._lock:
+                            self._known_dirs.pop(dest_dir, None)
+                        if self._make_dir(dest_dir) is None:
+                            raise
+                        materializer.create(path, overwrite)
+                    results.append((name, 'created'))
+                except FileExistsError:
+                    results.append((name, 'exists'))
+                except OSError as exc:
+                    self._log(f'[ERROR] Failed to create placeholder {path}: {exc}')
+                    results.append((name, 'failed'))
+                finally:
+                    self._timed('create', started)
+        finally:
+            self._give_journal(journal)
+        return results
@@ -0,0 +1,217 @@
+"""Per-directory work shared by the backup worker and scan shard processes."""
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from .config import COMPANION_MAX_BYTES
+from .filters import COMPANION, PLACEHOLDER, FileFilter
+from .placeholders import copy_companion
+from .walker import scandir_stream
+
+
+class ListingProcessor:
+    """Mixin that turns source listings into placeholders and companion copies.
+
+    The host provides ``rate_limiter``, ``placeholder_writer``, ``tree_index``,
+    ``listing_cache``, ``broadcast(msg)`` and the ``m_limiter_wait`` /
+    ``m_source_seconds`` histograms. ``BackupWorker`` is one host; each scan shard
+    process (``app.shards``) is another.
+    """
+
+    def _source_call(self, op: str, func, *args):
+        """Run one source-mount call under the ``op`` budget and record its latency."""
+        self.m_limiter_wait.observe(self.rate_limiter.acquire(op), op=op)
+        started = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.monotonic() - started
+            self.rate_limiter.observe(op, elapsed)
+            self.m_source_seconds.observe(elapsed, op=op)
+
+    def _indexed_lister(
+        self,
+        root: str,
+        key: str,
+        fast: bool,
+        file_filter: Optional[FileFilter] = None,
+        chunk_size: int = 0,
+    ):
+        """Build the walker's ``list_dir`` that records every listing in the tree index.
+
+        In fast mode a directory whose mtime matches the last successful run is not
+        re-listed (its recorded subdirectories are still descended into), and a changed
+        directory only reports entries that were not present last time. Subdirectories
+        pruned by ``file_filter`` are recorded but never handed to the walker.
+
+        With ``chunk_size`` a directory with more entries is streamed in chunks (each one
+        charged as a ``readdir``). Such a directory is not cached and is indexed chunk by
+        chunk for exports only, so every run lists it again.
+        """
+        wants_dir = file_filter.wants_dir if file_filter is not None else None
+        index = self.tree_index
+        counter_lock = threading.Lock()
+        seen = {'files': 0}
+
+        def list_dir(path: str):
+            rel = os.path.relpath(path, root)
+            rel = '' if rel == '.' else rel
+            mtime_ns = self._source_call('stat', os.stat, path).st_mtime_ns
+            previous = index.get(key, rel) if fast else None
+            if previous is not None and previous.mtime_ns == mtime_ns:
+                index.stage_unchanged(key, rel)
+                with counter_lock:
+                    seen['files'] += len(previous.files)
+                dirs = previous.dirs
+                if wants_dir is not None:
+                    dirs = [name for name in dirs if wants_dir(name)]
+                return dirs, []
+            cached = self.listing_cache.lookup(path, mtime_ns)
+            if cached is not None:
+                dirs, files = cached.dirs, cached.files
+            else:
+                listing = self._source_call('readdir', scandir_stream, path, chunk_size)
+                if len(listing) == 3:
+                    dirs, files, rest = listing
+                    index.stage_chunked(key, rel, dirs, files)
+                    if wants_dir is not None:
+                        dirs = [name for name in dirs if wants_dir(name)]
+                    with counter_lock:
+                        seen['files'] += len(files)
+                    return dirs, files, self._metered_chunks(rest, wants_dir, counter_lock, seen, key, rel)
+                dirs, files = listing
+                self.listing_cache.store(path, mtime_ns, dirs, files)
+            index.stage(key, rel, mtime_ns, dirs, files)
+            with counter_lock:
+                seen['files'] += len(files)
+            if previous is not None:
+                known = set(previous.files)
+                files = [name for name in files if name not in known]
+            if wants_dir is not None:
+                dirs = [name for name in dirs if wants_dir(name)]
+            return dirs, files
+
+        return list_dir, seen
+
+    def _metered_chunks(self, rest, wants_dir, counter_lock, seen, key, rel):
+        try:
+            for page in itertools.count(1):
+                chunk = self._source_call('readdir', next, rest, None)
+                if chunk is None:
+                    return
+                dirs, files = chunk
+                self.tree_index.stage_page(key, rel, page, files)
+                if wants_dir is not None:
+                    dirs = [name for name in dirs if wants_dir(name)]
+                with counter_lock:
+                    seen['files'] += len(files)
+                yield dirs, files
+        finally:
+            rest.close()
+
+    def _select(self, dirpath: str, filenames, file_filter: FileFilter):
+        """Split a listing into (placeholder names, companion names) per the task filter."""
+        placeholders: List[str] = []
+        companions: List[str] = []
+        for fname in filenames:
+            # Name checks are free: the source was already charged for the readdir.
+            kind = file_filter.classify(fname)
+            if kind == PLACEHOLDER:
+                if file_filter.needs_size:
+                    try:
+                        size = self._source_call('stat', os.stat, os.path.join(dirpath, fname)).st_size
+                    except OSError:
+                        continue
+                    if not file_filter.wants_size(size):
+                        continue
+                placeholders.append(fname)
+            elif kind == COMPANION:
+                companions.append(fname)
+        return placeholders, companions
+
+    def _process_listing(self, listing, dest_root: Path, key: str, file_filter: FileFilter, overwrite: bool):
+        """Create the placeholders for one source directory (or chunk of one). Returns (created, skipped)."""
+        dirpath, rel, _dirnames, filenames, chunk = listing
+        placeholders, companions = self._select(dirpath, filenames, file_filter)
+        skipped = len(filenames) - len(placeholders) - len(companions)
+        if not placeholders and not companions:
+            return 0, skipped
+
+        dest_dir = os.path.join(dest_root, rel) if rel else str(dest_root)
+        existing = None
+        if chunk is not None and not overwrite:
+            # Never list the destination copy of a huge directory whole.
+            existing = self._dest_present(dest_dir, placeholders + companions)
+        elif companions and not overwrite:
+            # One listing serves both the placeholder batch and the companion copies.
+            existing = self._dest_names(dest_dir)
+        created, passed = self._write_placeholders(dirpath, rel, dest_dir, key, placeholders, overwrite, existing)
+        copied, not_copied = self._copy_companions(dirpath, rel, dest_dir, key, companions, overwrite, existing)
+        return created + copied, skipped + passed + not_copied
+
+    @staticmethod
+    def _dest_names(dest_dir: str) -> set:
+        try:
+            return set(os.listdir(dest_dir))
+        except OSError:
+            return set()
+
+    @staticmethod
+    def _dest_present(dest_dir: str, names: List[str]) -> set:
+        """The subset of ``names`` already in ``dest_dir``, one ``lstat`` each."""
+        present = set()
+        for name in names:
+            if os.path.lexists(os.path.join(dest_dir, name)):
+                present.add(name)
+        return present
+
+    def _copy_companions(self, dirpath, rel, dest_dir, key, names, overwrite, existing=None):
+        """Copy companion files for real. Returns (copied, not copied)."""
+        if not names:
+            return 0, 0
+        if existing is None and not overwrite:
+            existing = self._dest_names(dest_dir)
+        copied = 0
+        for fname in names:
+            if not overwrite and fname in existing:
+                continue
+            source = os.path.join(dirpath, fname)
+            target = os.path.join(dest_dir, fname)
+            self.m_limiter_wait.observe(self.rate_limiter.acquire('write'), op='write')
+            try:
+                # One source open + read, charged like a stat.
+                if self._source_call('stat', copy_companion, source, target, COMPANION_MAX_BYTES):
+                    copied += 1
+                    self.broadcast(f'[OK] {source} -> {target}')
+            except OSError as exc:
+                self.broadcast(f'[ERROR] Failed to copy {source}: {exc}')
+                self.tree_index.discard(key, rel)
+        return copied, len(names) - copied
+
+    def _write_placeholders(self, dirpath, rel, dest_dir, key, names, overwrite, existing=None):
+        """Write one directory's batch and report each outcome. Returns (created, not created)."""
+        if not names:
+            return 0, 0
+        self.m_limiter_wait.observe(self.rate_limiter.acquire('write', len(names)), op='write')
+        try:
+            outcomes = self.placeholder_writer.write_dir(dest_dir, names, overwrite=overwrite, existing=existing)
+        except Exception as exc:  # noqa: BLE001 - keep worker alive
+            self.broadcast(f'[ERROR] processing directory {dirpath}: {exc}')
+            self.tree_index.discard(key, rel)
+            return 0, len(names)
+        created = 0
+        skipped = 0
+        for fname, outcome in outcomes:
+            if outcome == 'created':
+                created += 1
+                self.broadcast(f'[OK] {os.path.join(dirpath, fname)} -> {os.path.join(dest_dir, fname)}')
+            else:
+                skipped += 1
+                if outcome == 'failed':
+                    self.tree_index.discard(key, rel)
+        return created, skipped
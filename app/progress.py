@@ -0,0 +1,156 @@
+"""Live progress of a running task: counters, current rate and an ETA."""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from .walker import scandir_counts
+
+# The current rate is measured over this many recent seconds.
+RATE_WINDOW = 60.0
+# A tree that grew since it was last counted must not report 100% while still walking.
+MAX_PERCENT = 99.9
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds}s'
+
+
+class ProgressTracker:
+    """Keeps a task's ``progress`` dict current from the walk's running totals.
+
+    Progress is measured in source files seen (directories when the estimated total has
+    no files), against a total from the task's previous run or a ``DirectoryCounter``.
+    The dict is replaced key by key with plain values, so readers never see it torn.
+    """
+
+    def __init__(self, progress: Dict, placeholder_size: int):
+        self.progress = progress
+        self.placeholder_size = int(placeholder_size)
+        self._samples: deque = deque()
+        self._reported = time.monotonic()
+        progress.update(
+            dirs=0, files=0, created=0, skipped=0, bytes=0, rate=0.0,
+            total_dirs=None, total_files=None, percent=None, eta_seconds=None, estimate=None,
+        )
+
+    def set_total(self, dirs: int, files: int, basis: str) -> None:
+        self.progress.update(total_dirs=int(dirs), total_files=int(files), estimate=basis)
+        self._estimate()
+
+    def set_basis(self, basis: str) -> None:
+        self.progress['estimate'] = basis
+
+    def update(self, dirs: int, files: int, created: int, skipped: int) -> None:
+        now = time.monotonic()
+        samples = self._samples
+        if not samples or now - samples[-1][0] >= 1.0:
+            samples.append((now, files))
+            while len(samples) > 2 and now - samples[1][0] >= RATE_WINDOW:
+                samples.popleft()
+        first_at, first_files = samples[0]
+        rate = (files - first_files) / (now - first_at) if now > first_at else 0.0
+        self.progress.update(
+            dirs=dirs, files=files, created=created, skipped=skipped,
+            bytes=created * self.placeholder_size, rate=round(rate, 2),
+        )
+        self._estimate()
+
+    def _estimate(self) -> None:
+        progress = self.progress
+        total_files = progress['total_files']
+        if total_files is None:
+            return
+        if total_files > 0:
+            done, total = progress['files'], total_files
+        else:
+            done, total = progress['dirs'], progress['total_dirs']
+        if not total:
+            return
+        progress['percent'] = round(min(MAX_PERCENT, 100.0 * done / total), 1)
+        rate = progress['rate'] if total_files > 0 else None
+        if rate:
+            progress['eta_seconds'] = int(max(0, total - done) / rate)
+
+    def due(self, interval: float) -> bool:
+        """True once every ``interval`` seconds, for the periodic ``[ETA]`` line."""
+        now = time.monotonic()
+        if interval <= 0 or now - self._reported < interval:
+            return False
+        self._reported = now
+        return True
+
+    def describe(self) -> str:
+        progress = self.progress
+        text = f'{progress["dirs"]} dirs, {progress["files"]} files seen, {progress["created"]} created'
+        if progress['percent'] is not None:
+            text = f'{progress["percent"]}% ({text} of ~{progress["total_files"]} files)'
+        text += f', {progress["rate"]} files/s'
+        if progress['eta_seconds'] is not None:
+            text += f', ETA {format_duration(progress["eta_seconds"])}'
+        elif progress['estimate'] == 'counting':
+            text += ', counting the source tree'
+        return text
+
+
+class DirectoryCounter(threading.Thread):
+    """Background count of the directories and files under a task's source.
+
+    It is the estimate for a task that has never completed: one directory read at a
+    time, each only when the source ``readdir`` bucket has a token to spare, followed
+    by a pause as long as the read took. It stops when the task ends.
+    """
+
+    def __init__(
+        self,
+        rate_limiter,
+        root: str,
+        wants_dir: Optional[Callable[[str], bool]],
+        stop_event: threading.Event,
+        on_done: Callable[[int, int, str], None],
+    ):
+        super().__init__(daemon=True, name='progress-counter')
+        self.rate_limiter = rate_limiter
+        self.root = root
+        self.wants_dir = wants_dir
+        self.task_stop = stop_event
+        self.on_done = on_done
+        self._done = threading.Event()
+
+    def stop(self) -> None:
+        self._done.set()
+
+    def _stopped(self) -> bool:
+        return self._done.is_set() or self.task_stop.is_set()
+
+    def run(self) -> None:
+        pending = [self.root]
+        dirs = files = 0
+        while pending:
+            while not self.rate_limiter.try_acquire('readdir'):
+                if self._done.wait(0.05) or self._stopped():
+                    return
+            path = pending.pop()
+            started = time.monotonic()
+            try:
+                subdirs, count = scandir_counts(path)
+            except OSError:
+                subdirs, count = [], 0
+            elapsed = time.monotonic() - started
+            self.rate_limiter.observe('readdir', elapsed)
+            if self.wants_dir is not None:
+                subdirs = [name for name in subdirs if self.wants_dir(name)]
+            pending.extend(os.path.join(path, name) for name in subdirs)
+            dirs += 1
+            files += count
+            if self._done.wait(elapsed) or self._stopped():
+                return
+        self.on_done(dirs, files, 'count')
@@ -0,0 +1,224 @@
+"""Token-bucket limiter for source-mount operations with adaptive backoff."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Optional
+
+SOURCE_OPS = ('readdir', 'stat')
+MAX_RATE = 5000.0
+MIN_BACKOFF = 1.0 / 16
+# A source op is "slow" once its recent latency doubles the long-run baseline and is
+# above this floor (sub-5ms jitter on local disks should never throttle anything).
+LATENCY_FLOOR = 0.005
+SLOWDOWN_RATIO = 2.0
+RECOVER_RATIO = 1.25
+
+
+def parse_rate(value, maximum: float = MAX_RATE) -> float:
+    try:
+        rate = float(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError('invalid rate') from exc
+    if rate != rate or rate < 0:
+        raise ValueError('rate must be >= 0')
+    # Soft upper bound protects remote mounts from accidental overload.
+    return min(rate, maximum)
+
+
+class TokenBucket:
+    """Thread-safe token bucket. ``rate <= 0`` means unlimited.
+
+    ``acquire`` reserves its tokens immediately (the balance may go negative) and
+    sleeps outside the lock, so concurrent callers queue up fairly.
+    """
+
+    def __init__(self, rate: float = 0.0, burst: float = 1.0):
+        self._lock = threading.Lock()
+        self.rate = 0.0
+        self.burst = 1.0
+        self.scale = 1.0
+        self.tokens = 0.0
+        self.acquired = 0
+        self.waited = 0.0
+        self._stamp = time.monotonic()
+        self.configure(rate, burst)
+        self.tokens = self.burst
+
+    @property
+    def effective_rate(self) -> float:
+        return self.rate * self.scale
+
+    def configure(self, rate: Optional[float] = None, burst: Optional[float] = None) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate is not None:
+                self.rate = max(0.0, float(rate))
+            if burst is not None:
+                self.burst = max(1.0, float(burst))
+            self.tokens = min(self.tokens, self.burst)
+
+    def set_scale(self, scale: float) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.scale = scale
+
+    def _refill(self, now: float) -> None:
+        rate = self.rate * self.scale
+        if rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * rate)
+        else:
+            self.tokens = self.burst
+        self._stamp = now
+
+    def acquire(self, n: float = 1.0) -> float:
+        """Take ``n`` tokens, sleeping as long as needed. Returns the time slept."""
+        with self._lock:
+            self.acquired += 1
+            rate = self.rate * self.scale
+            if rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= n
+            delay = 0.0 if self.tokens >= 0 else -self.tokens / rate
+            self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        """Take ``n`` tokens only if they are available right now (never sleeps or borrows)."""
+        with self._lock:
+            rate = self.rate * self.scale
+            if rate <= 0:
+                self.acquired += 1
+                return True
+            self._refill(time.monotonic())
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            self.acquired += 1
+            return True
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate': self.rate,
+                'effective_rate': round(self.rate * self.scale, 3),
+                'burst': self.burst,
+                'tokens': round(self.tokens, 3),
+                'acquired': self.acquired,
+                'waited_seconds': round(self.waited, 3),
+            }
+
+
+class RateLimiter:
+    """Separate budgets for source ``readdir``/``stat`` calls and placeholder writes.
+
+    Callers report how long each source call took via ``observe``; when the recent
+    latency of the mount climbs well above its long-run baseline the source buckets are
+    slowed down multiplicatively, and sped back up as latency recovers.
+    """
+
+    def __init__(
+        self,
+        readdir_per_sec: float = 0.0,
+        stat_per_sec: float = 0.0,
+        write_per_sec: float = 0.0,
+        burst: float = 1.0,
+        adaptive: bool = True,
+    ):
+        self._lock = threading.Lock()
+        self.buckets: Dict[str, TokenBucket] = {
+            'readdir': TokenBucket(readdir_per_sec, burst),
+            'stat': TokenBucket(stat_per_sec, burst),
+            'write': TokenBucket(write_per_sec, burst),
+        }
+        self.burst = max(1.0, float(burst))
+        self.adaptive = bool(adaptive)
+        self.backoff = 1.0
+        self._latency: Dict[str, Dict[str, float]] = {
+            op: {'recent': 0.0, 'baseline': 0.0, 'samples': 0} for op in SOURCE_OPS
+        }
+        self._last_adjust = time.monotonic()
+
+    def configure(
+        self,
+        readdir_per_sec: Optional[float] = None,
+        stat_per_sec: Optional[float] = None,
+        write_per_sec: Optional[float] = None,
+        burst: Optional[float] = None,
+        adaptive: Optional[bool] = None,
+    ) -> None:
+        if burst is not None:
+            self.burst = max(1.0, float(burst))
+        for op, rate in (('readdir', readdir_per_sec), ('stat', stat_per_sec), ('write', write_per_sec)):
+            self.buckets[op].configure(rate, burst)
+        if adaptive is not None:
+            with self._lock:
+                self.adaptive = bool(adaptive)
+                if not self.adaptive:
+                    self._set_backoff(1.0)
+
+    def acquire(self, op: str, n: float = 1.0) -> float:
+        return self.buckets[op].acquire(n)
+
+    def try_acquire(self, op: str, n: float = 1.0) -> bool:
+        return self.buckets[op].try_acquire(n)
+
+    def observe(self, op: str, seconds: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stats = self._latency[op]
+            if stats['samples'] == 0:
+                stats['recent'] = stats['baseline'] = seconds
+            else:
+                stats['recent'] += 0.2 * (seconds - stats['recent'])
+                stats['baseline'] += 0.01 * (seconds - stats['baseline'])
+            stats['samples'] += 1
+            if self.adaptive and now - self._last_adjust >= 1.0:
+                self._last_adjust = now
+                self._adjust()
+
+    def _adjust(self) -> None:
+        slow = False
+        healthy = True
+        for stats in self._latency.values():
+            if not stats['samples'] or stats['baseline'] <= 0:
+                continue
+            ratio = stats['recent'] / stats['baseline']
+            if ratio >= SLOWDOWN_RATIO and stats['recent'] >= LATENCY_FLOOR:
+                slow = True
+            if ratio > RECOVER_RATIO:
+                healthy = False
+        if slow:
+            self._set_backoff(max(MIN_BACKOFF, self.backoff * 0.5))
+        elif healthy and self.backoff < 1.0:
+            self._set_backoff(min(1.0, self.backoff * 1.25))
+
+    def _set_backoff(self, value: float) -> None:
+        self.backoff = value
+        for op in SOURCE_OPS:
+            self.buckets[op].set_scale(value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latency = {
+                op: {
+                    'recent_ms': round(stats['recent'] * 1000, 3),
+                    'baseline_ms': round(stats['baseline'] * 1000, 3),
+                    'samples': int(stats['samples']),
+                }
+                for op, stats in self._latency.items()
+            }
+            backoff = self.backoff
+            adaptive = self.adaptive
+        return {
+            'burst': self.burst,
+            'adaptive': adaptive,
+            'backoff': round(backoff, 4),
+            'buckets': {op: bucket.snapshot() for op, bucket in self.buckets.items()},
+            'latency': latency,
+        }
@@ -0,0 +1,367 @@
+"""Task bookkeeping for the concurrent backup scheduler."""
+from __future__ import annotations
+
+import bisect
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import SYNC_ORPHANS
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+DONE = 'done'
+
+# Walk modes from weakest to strongest: a stronger walk does everything a weaker one
+# does, so two requests for the same tree become one task in the stronger mode.
+MODE_RANK = {'fast': 0, 'incremental': 1, 'full': 2}
+# Modes whose task handles every directory below its source, so a request for a
+# subdirectory folds into it.
+NESTING_MODES = ('fast', 'incremental', 'full', 'sync')
+# Merge records kept on the surviving task, and by the worker across all tasks.
+KEEP_TASK_MERGES = 50
+KEEP_MERGES = 200
+
+
+def path_under(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip('/') + '/')
+
+
+def work_key(options: Dict) -> str:
+    """What a task does, apart from where, how urgently and how thoroughly: equal keys may merge.
+
+    Accepts task options or a queued task's payload (which only carries ``dry_run`` and
+    ``orphans`` for sync tasks). The walk modes share a key; ``MODE_RANK`` orders them.
+    """
+    mode = options.get('mode', 'incremental')
+    sync = mode == 'sync'
+    return json.dumps({
+        'mode': 'walk' if mode in MODE_RANK else mode,
+        'videos_only': bool(options.get('videos_only', True)),
+        'mirror': bool(options.get('mirror')),
+        'filters': options.get('filters') or {},
+        'dry_run': bool(options.get('dry_run')) if sync else False,
+        'orphans': options.get('orphans', SYNC_ORPHANS) if sync else SYNC_ORPHANS,
+        'plan': options.get('plan'),
+        'manifest': options.get('manifest'),
+    }, sort_keys=True)
+
+
+def mode_covers(mode: str, other: str) -> bool:
+    """True if a ``mode`` task does all the work of an ``other`` task with the same work key."""
+    return MODE_RANK.get(mode, 0) >= MODE_RANK.get(other, 0)
+
+
+def _ancestors(src: str, dst: str) -> Iterator[Tuple[str, str, str]]:
+    """``(source, destination, rel)`` of each ancestor task whose walk would cover ``src -> dst``.
+
+    An ancestor covers the pair only if the relative path below its source is also the
+    relative path below its destination, which is how ``build_dest_final`` lays trees out.
+    """
+    parts: List[str] = []
+    while True:
+        parent = os.path.dirname(src)
+        if parent == src or os.path.basename(src) != os.path.basename(dst):
+            return
+        parts.insert(0, os.path.basename(src))
+        src, dst = parent, os.path.dirname(dst)
+        yield src, dst, '/'.join(parts)
+
+
+class TaskState:
+    """One queued or running task plus its control signals."""
+
+    def __init__(self, payload: Dict, priority: int = 0, mount: str = '/', task_id: Optional[str] = None):
+        self.id = task_id or uuid.uuid4().hex[:12]
+        self.payload = payload
+        self.priority = int(priority)
+        self.mount = mount
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        # Live counters of the current walk, updated by the task's thread.
+        self.progress = {'dirs': 0, 'created': 0, 'skipped': 0}
+        # Requests folded into this task (newest last), and how many there were in total.
+        self.merged: List[Dict] = []
+        self.merge_count = 0
+        # Relative directories the running walk still has to list; set while it walks.
+        self.frontier: Optional[Callable[[], List[str]]] = None
+        # Set when the task must stop walking: cancelled, or the service is shutting down.
+        self.stop_event = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._paused = False
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def pause(self) -> None:
+        self._paused = True
+        self._resume.clear()
+        if self.status == RUNNING:
+            self.status = PAUSED
+
+    def resume(self) -> None:
+        self._paused = False
+        if self.status == PAUSED:
+            self.status = RUNNING
+        self._resume.set()
+
+    def cancel(self) -> None:
+        self.status = CANCELLED
+        self.stop_event.set()
+        self._resume.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.status == CANCELLED
+
+    def wait_if_paused(self) -> None:
+        """Block the task's thread while it is paused (returns early if it is stopped)."""
+        while not self._resume.wait(0.5):
+            if self.stop_event.is_set():
+                return
+
+    def to_record(self) -> Dict:
+        """Serializable form used to persist the queue across restarts."""
+        return {
+            'id': self.id,
+            'payload': self.payload,
+            'priority': self.priority,
+            'mount': self.mount,
+            'status': self.status,
+            'paused': self._paused,
+            'created_at': self.created_at,
+            'merged': self.merged,
+            'merge_count': self.merge_count,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict) -> 'TaskState':
+        state = cls(
+            dict(record.get('payload') or {}),
+            priority=int(record.get('priority', 0)),
+            mount=str(record.get('mount') or '/'),
+            task_id=record.get('id'),
+        )
+        state.created_at = float(record.get('created_at') or state.created_at)
+        state.merged = [item for item in record.get('merged') or [] if isinstance(item, dict)]
+        state.merge_count = int(record.get('merge_count') or len(state.merged))
+        if record.get('paused'):
+            state.pause()
+        return state
+
+    def to_dict(self) -> Dict:
+        data = dict(self.payload)
+        data.update({
+            'id': self.id,
+            'priority': self.priority,
+            'mount': self.mount,
+            'status': self.status,
+            'paused': self._paused,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'progress': dict(self.progress),
+            'merged': list(self.merged),
+            'merge_count': self.merge_count,
+        })
+        return data
+
+    def absorb(self, other: 'TaskState', reason: str) -> Dict:
+        """Record that ``other`` was folded into this task; returns the merge record."""
+        merge = {
+            'id': other.id,
+            'src': other.payload.get('src'),
+            'dst': other.payload.get('dst'),
+            'mode': other.payload.get('mode'),
+            'priority': other.priority,
+            'into': self.id,
+            'reason': reason,
+            'at': time.time(),
+        }
+        self.merged = (self.merged + other.merged + [merge])[-KEEP_TASK_MERGES:]
+        self.merge_count += other.merge_count + 1
+        return merge
+
+
+class TaskQueue:
+    """Thread-safe pending-task list: highest priority first, FIFO within a priority.
+
+    The dispatcher asks for the best task it is allowed to start right now
+    (``pop_runnable``), so a task blocked by a busy mount does not hold back tasks on
+    other mounts. Paused tasks stay queued but are never picked.
+
+    Tasks are also keyed by ``(src, dst, work_key)`` and kept in source order, so
+    ``coalesce`` finds an identical, ancestor or nested task without scanning the queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._tasks: List[TaskState] = []
+        self._order: Dict[str, int] = {}
+        self._counter = itertools.count()
+        self._by_key: Dict[Tuple[str, str, str], TaskState] = {}
+        self._sources: List[Tuple[str, str]] = []
+        self._keys: Dict[str, Tuple[str, str, str]] = {}
+        self._by_id: Dict[str, TaskState] = {}
+
+    def put(self, state: TaskState) -> TaskState:
+        with self._changed:
+            self._insert(state)
+        return state
+
+    def _insert(self, state: TaskState) -> None:
+        # Caller holds the lock.
+        key = (state.payload.get('src', ''), state.payload.get('dst', ''), work_key(state.payload))
+        self._tasks.append(state)
+        self._order[state.id] = next(self._counter)
+        self._by_key[key] = state
+        self._keys[state.id] = key
+        self._by_id[state.id] = state
+        bisect.insort(self._sources, (key[0], state.id))
+        self._resort()
+
+    def _resort(self) -> None:
+        self._tasks.sort(key=lambda item: (-item.priority, self._order[item.id]))
+        self._changed.notify_all()
+
+    def _forget(self, state: TaskState) -> None:
+        # Caller holds the lock and has already taken ``state`` out of ``_tasks``.
+        self._order.pop(state.id, None)
+        self._by_id.pop(state.id, None)
+        key = self._keys.pop(state.id)
+        if self._by_key.get(key) is state:
+            del self._by_key[key]
+        index = bisect.bisect_left(self._sources, (key[0], state.id))
+        if index < len(self._sources) and self._sources[index] == (key[0], state.id):
+            del self._sources[index]
+
+    def coalesce(
+        self,
+        state: TaskState,
+        running: Iterable[TaskState] = (),
+        reaches: Callable[[TaskState, str], bool] = lambda task, rel: True,
+    ) -> Tuple[TaskState, List[Dict]]:
+        """Queue ``state`` unless a queued or running task already does its work.
+
+        * an identical queued task (same source, destination and work) absorbs it,
+          switching to the stronger walk mode when the two differ;
+        * a queued or running task on an ancestor source with the matching destination
+          absorbs it, if its mode covers the request and ``reaches(task, rel)`` says
+          its walk has not yet passed the subdirectory;
+        * otherwise it is queued and absorbs the queued tasks nested below it.
+
+        Returns the task that will do the work and the merge records made.
+        """
+        payload = state.payload
+        src, dst = payload.get('src', ''), payload.get('dst', '')
+        mode = payload.get('mode', 'incremental')
+        work = work_key(payload)
+        with self._changed:
+            same = self._by_key.get((src, dst, work))
+            if same is not None:
+                if mode_covers(same.payload.get('mode'), mode):
+                    return same, [self._fold(state, same, 'duplicate')]
+                if reaches(same, ''):
+                    same.payload['mode'] = mode
+                    return same, [self._fold(state, same, 'upgraded')]
+            if mode not in NESTING_MODES:
+                self._insert(state)
+                return state, []
+            for parent_src, parent_dst, rel in _ancestors(src, dst):
+                parent = self._by_key.get((parent_src, parent_dst, work))
+                if parent is not None and mode_covers(parent.payload.get('mode'), mode) and reaches(parent, rel):
+                    return parent, [self._fold(state, parent, 'nested')]
+            for task in running:
+                task_src = task.payload.get('src', '')
+                if (
+                    work_key(task.payload) != work
+                    or not path_under(src, task_src)
+                    or not mode_covers(task.payload.get('mode'), mode)
+                ):
+                    continue
+                rel = os.path.relpath(src, task_src) if src != task_src else ''
+                if os.path.normpath(os.path.join(task.payload.get('dst', ''), rel)) == dst and reaches(task, rel):
+                    return task, [self._fold(state, task, 'nested in running task')]
+            merges = [self._fold(child, state, 'absorbed') for child in self._nested(state, src, dst, work, mode)]
+            self._insert(state)
+            return state, merges
+
+    def _nested(self, state: TaskState, src: str, dst: str, work: str, mode: str) -> List[TaskState]:
+        """Queued tasks below ``src`` that a ``state`` walk covers; removes them from the queue."""
+        prefix = src.rstrip('/') + '/'
+        found = []
+        index = bisect.bisect_left(self._sources, (prefix, ''))
+        while index < len(self._sources) and self._sources[index][0].startswith(prefix):
+            child_src, child_id = self._sources[index]
+            index += 1
+            child = self._by_id[child_id]
+            if (
+                child.paused
+                or self._keys[child_id][2] != work
+                or not mode_covers(mode, child.payload.get('mode'))
+                or child.payload.get('dst') != os.path.join(dst, os.path.relpath(child_src, src))
+            ):
+                continue
+            found.append(child)
+        for child in found:
+            self._tasks.remove(child)
+            self._forget(child)
+        return found
+
+    def _fold(self, state: TaskState, into: TaskState, reason: str) -> Dict:
+        # Caller holds the lock.
+        merge = into.absorb(state, reason)
+        if state.priority > into.priority:
+            into.priority = state.priority
+            if into.id in self._order:
+                self._resort()
+        return merge
+
+    def pop_runnable(self, can_run: Callable[[TaskState], bool]) -> Optional[TaskState]:
+        with self._lock:
+            for index, state in enumerate(self._tasks):
+                if state.paused or not can_run(state):
+                    continue
+                del self._tasks[index]
+                self._forget(state)
+                return state
+        return None
+
+    def get(self, task_id: str) -> Optional[TaskState]:
+        with self._lock:
+            return self._by_id.get(task_id)
+
+    def remove(self, task_id: str) -> Optional[TaskState]:
+        with self._changed:
+            for index, state in enumerate(self._tasks):
+                if state.id == task_id:
+                    del self._tasks[index]
+                    self._forget(state)
+                    self._changed.notify_all()
+                    return state
+        return None
+
+    def notify(self) -> None:
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait(self, timeout: float) -> None:
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def snapshot(self) -> List[TaskState]:
+        with self._lock:
+            return list(self._tasks)
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._tasks)
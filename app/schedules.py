@@ -0,0 +1,386 @@
+"""Recurring jobs: interval or cron triggers, time windows and per-window source rates."""
+from __future__ import annotations
+
+import datetime as dt
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from .checkpoints import read_json, write_json_atomic
+from .ratelimit import parse_rate
+
+MACROS = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+MONTH_NAMES = {name: index + 1 for index, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'))}
+DAY_NAMES = {name: index for index, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))}
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+MIN_INTERVAL = 60
+# Longest a tick may sleep, so window edges and new jobs are noticed promptly.
+TICK_SECONDS = 30.0
+
+
+def _cron_field(text: str, low: int, high: int, names: Optional[Dict[str, int]] = None) -> Set[int]:
+    values: Set[int] = set()
+    for part in text.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f'invalid step in {text!r}')
+        if part in ('*', ''):
+            start, end = low, high
+        else:
+            bounds = [names[item] if names and item in names else int(item) for item in part.split('-', 1)]
+            start = bounds[0]
+            # "5/15" means 5, 20, 35, ... up to the field maximum.
+            end = bounds[1] if len(bounds) > 1 else (high if step > 1 else start)
+        if not low <= start <= end <= high:
+            raise ValueError(f'{text!r} is outside {low}-{high}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpr:
+    """Five-field cron expression (minute hour day-of-month month day-of-week), local time.
+
+    Supports ``*``, lists, ranges, steps, month/day names and the ``@hourly``-style macros.
+    As in Vixie cron, when both day fields are restricted a day matching either one fires.
+    """
+
+    def __init__(self, text: str):
+        self.text = ' '.join(str(text).split())
+        fields = MACROS.get(self.text.lower(), self.text).split()
+        if len(fields) != 5:
+            raise ValueError('cron expression needs 5 fields: minute hour day month weekday')
+        try:
+            self.minutes = _cron_field(fields[0], 0, 59)
+            self.hours = _cron_field(fields[1], 0, 23)
+            self.days = _cron_field(fields[2], 1, 31)
+            self.months = _cron_field(fields[3], 1, 12, MONTH_NAMES)
+            weekdays = _cron_field(fields[4], 0, 7, DAY_NAMES)
+        except (KeyError, ValueError) as exc:
+            raise ValueError(f'invalid cron expression: {exc}') from exc
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+        self.next_after(dt.datetime.now())  # rejects expressions that never fire, e.g. Feb 30
+
+    def _day_matches(self, moment: dt.datetime) -> bool:
+        in_days = moment.day in self.days
+        # Python: Monday == 0; cron: Sunday == 0.
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment: dt.datetime) -> dt.datetime:
+        candidate = moment.replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+        for _ in range(200000):
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                candidate = candidate.replace(year=year, month=candidate.month % 12 + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + dt.timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + dt.timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += dt.timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f'cron expression {self.text!r} never fires')
+
+
+class TimeWindow:
+    """Daily local-time window like ``02:00-06:00``; it may wrap past midnight."""
+
+    def __init__(self, text: str):
+        match = re.fullmatch(r'\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*', str(text))
+        if not match:
+            raise ValueError('window must look like HH:MM-HH:MM')
+        hour1, minute1, hour2, minute2 = (int(item) for item in match.groups())
+        if hour1 > 23 or hour2 > 23 or minute1 > 59 or minute2 > 59:
+            raise ValueError('window times must be between 00:00 and 23:59')
+        self.start = hour1 * 60 + minute1
+        self.end = hour2 * 60 + minute2
+        if self.start == self.end:
+            raise ValueError('window start and end must differ')
+        self.text = f'{hour1:02d}:{minute1:02d}-{hour2:02d}:{minute2:02d}'
+
+    def contains(self, moment: dt.datetime) -> bool:
+        minute = moment.hour * 60 + moment.minute
+        if self.start < self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+    def next_open(self, moment: dt.datetime) -> dt.datetime:
+        """``moment`` itself if inside the window, else the next time it opens."""
+        if self.contains(moment):
+            return moment
+        opening = moment.replace(hour=self.start // 60, minute=self.start % 60, second=0, microsecond=0)
+        if opening <= moment:
+            opening += dt.timedelta(days=1)
+        return opening
+
+
+def parse_interval(value) -> int:
+    """Seconds from ``3600``, ``"90m"``, ``"6h"`` or ``"1d"``."""
+    text = str(value).strip().lower()
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([smhd]?)', text)
+    if not match:
+        raise ValueError('interval must be seconds or a number with s/m/h/d')
+    seconds = int(float(match.group(1)) * INTERVAL_UNITS[match.group(2) or 's'])
+    if seconds < MIN_INTERVAL:
+        raise ValueError(f'interval must be at least {MIN_INTERVAL} seconds')
+    return seconds
+
+
+class Job:
+    """One schedule definition plus its runtime state (``next_run_at``, last task)."""
+
+    def __init__(self, record: Dict):
+        self.record = record
+        self.id = record['id']
+        self.every = parse_interval(record['every']) if record.get('every') else None
+        self.cron = CronExpr(record['cron']) if record.get('cron') else None
+        if (self.every is None) == (self.cron is None):
+            raise ValueError('give exactly one of every or cron')
+        self.window = TimeWindow(record['window']) if record.get('window') else None
+        self.rate = parse_rate(record['rate']) if record.get('rate') not in (None, '') else None
+
+    @property
+    def window_paused(self) -> bool:
+        """True while the scheduler (not a user) holds the job's task paused outside its window."""
+        return bool(self.record.get('window_paused'))
+
+    @window_paused.setter
+    def window_paused(self, value: bool) -> None:
+        self.record['window_paused'] = bool(value)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.record.get('enabled', True))
+
+    def next_run(self, after: dt.datetime) -> dt.datetime:
+        """First trigger strictly after ``after`` that falls inside the window."""
+        if self.cron is not None:
+            moment = self.cron.next_after(after)
+            for _ in range(100000):
+                if self.window is None or self.window.contains(moment):
+                    return moment
+                moment = self.cron.next_after(moment)
+            raise ValueError('cron expression never fires inside the window')
+        moment = after + dt.timedelta(seconds=self.every)
+        return self.window.next_open(moment) if self.window is not None else moment
+
+    def first_run(self, now: dt.datetime) -> dt.datetime:
+        if self.cron is not None:
+            return self.next_run(now)
+        return self.window.next_open(now) if self.window is not None else now
+
+    def to_dict(self) -> Dict:
+        return dict(self.record)
+
+
+class JobScheduler:
+    """Enqueue each job's task when it is due; ``host`` is the worker.
+
+    A job is coalesced: while the task it last enqueued is still queued or running, a due
+    trigger is skipped instead of piling up another task. Outside its window a job's
+    running task is paused and resumed when the window opens again; inside it, a job
+    ``rate`` replaces the source readdir/stat budget while its task runs.
+    """
+
+    def __init__(self, host, root: Path):
+        self.host = host
+        self.path = Path(root) / 'schedules.json'
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._jobs: Dict[str, Job] = {}
+        self._thread: Optional[threading.Thread] = None
+        data = read_json(self.path)
+        records = data.get('jobs') if isinstance(data, dict) else None
+        for record in records if isinstance(records, list) else []:
+            try:
+                job = Job(record)
+            except (KeyError, TypeError, ValueError) as exc:
+                host.broadcast(f'[WARN] Ignoring invalid schedule record: {exc}')
+                continue
+            self._jobs[job.id] = job
+
+    def _persist(self) -> None:
+        # Caller holds _lock.
+        try:
+            write_json_atomic(self.path, {'jobs': [job.record for job in self._jobs.values()]})
+        except OSError as exc:
+            self.host.broadcast(f'[WARN] Cannot save schedules: {exc}')
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name='job-scheduler')
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def add(self, task: Dict, every=None, cron=None, window=None, rate=None) -> Dict:
+        """``task`` holds the ``add_task`` arguments. Raises ``ValueError`` on a bad schedule."""
+        record = {
+            'id': uuid.uuid4().hex[:12],
+            'task': task,
+            'every': every,
+            'cron': cron,
+            'window': window,
+            'rate': rate,
+            'enabled': True,
+            'created_at': time.time(),
+            'last_run_at': None,
+            'last_task_id': None,
+            'window_paused': False,
+        }
+        job = Job(record)
+        record['next_run_at'] = job.first_run(dt.datetime.now()).timestamp()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._persist()
+        self._wake.set()
+        return job.to_dict()
+
+    def remove(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return None
+            self._persist()
+        self._release(job)
+        return job.to_dict()
+
+    def set_enabled(self, job_id: str, enabled: bool) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.record['enabled'] = bool(enabled)
+            if enabled:
+                job.record['next_run_at'] = job.first_run(dt.datetime.now()).timestamp()
+            self._persist()
+        if not enabled:
+            self._release(job)
+        self._wake.set()
+        return job.to_dict()
+
+    def run_now(self, job_id: str) -> Optional[Dict]:
+        """Trigger a job immediately (still coalesced with its running task)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.record['next_run_at'] = time.time()
+            job.record['force'] = True
+            self._persist()
+        self._wake.set()
+        return job.to_dict()
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def _active_task(self, job: Job):
+        task_id = job.record.get('last_task_id')
+        return self.host._find_task(task_id) if task_id else None
+
+    def _release(self, job: Job) -> None:
+        """Undo what the scheduler holds for a job: its rate override and window pause."""
+        self.host.override_source_rate(job.id, None)
+        if job.window_paused:
+            job.window_paused = False
+            state = self._active_task(job)
+            if state is not None:
+                self.host.resume_task(state.id)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                delay = self._tick()
+            except Exception as exc:  # noqa: BLE001 - keep the scheduler alive
+                self.host.broadcast(f'[ERROR] Scheduler tick failed: {exc}')
+                delay = TICK_SECONDS
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _tick(self) -> float:
+        now = dt.datetime.now()
+        delay = TICK_SECONDS
+        with self._lock:
+            jobs = list(self._jobs.values())
+        changed = False
+        for job in jobs:
+            if not job.enabled or job.id not in self._jobs:
+                continue
+            record = job.record
+            state = self._active_task(job)
+            inside = job.window is None or job.window.contains(now)
+            if state is not None and job.window is not None:
+                changed |= self._enforce_window(job, state, inside)
+            elif job.window_paused:
+                job.window_paused = False
+                changed = True
+            running = state is not None and state.started_at is not None and not state.paused
+            self.host.override_source_rate(job.id, job.rate if running and inside else None)
+            if job.rate is not None and state is not None and state.started_at is None:
+                # Catch the task's start quickly so its window rate applies from the first readdir.
+                delay = 1.0
+            next_run_at = record.get('next_run_at') or 0
+            if next_run_at <= now.timestamp():
+                forced = record.pop('force', False)
+                if state is not None:
+                    self.host.broadcast(
+                        f'[SCHEDULE] Job {job.id}: task {state.id} for {record["task"]["src"]} '
+                        'is still queued or running, skipping this run'
+                    )
+                elif inside or forced:
+                    self._enqueue(job)
+                    if job.rate is not None:
+                        delay = 1.0
+                record['next_run_at'] = job.next_run(now).timestamp()
+                changed = True
+            delay = min(delay, max(1.0, record['next_run_at'] - time.time()))
+        if changed:
+            with self._lock:
+                self._persist()
+        return delay
+
+    def _enforce_window(self, job: Job, state, inside: bool) -> bool:
+        """Pause or resume the job's task at its window edges; True if anything changed."""
+        if not inside and not state.paused:
+            job.window_paused = True
+            self.host.broadcast(f'[SCHEDULE] Job {job.id}: window {job.window.text} closed, pausing task {state.id}')
+            self.host.pause_task(state.id)
+            return True
+        if inside and job.window_paused:
+            job.window_paused = False
+            self.host.broadcast(f'[SCHEDULE] Job {job.id}: window {job.window.text} open, resuming task {state.id}')
+            self.host.resume_task(state.id)
+            return True
+        return False
+
+    def _enqueue(self, job: Job) -> None:
+        task = dict(job.record['task'])
+        state = self.host.add_task(
+            Path(task.pop('src')),
+            Path(task.pop('dst')),
+            **task,
+        )
+        job.record['last_task_id'] = state.id
+        job.record['last_run_at'] = time.time()
+        self.host.broadcast(f'[SCHEDULE] Job {job.id}: queued task {state.id}')
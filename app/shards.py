@@ -0,0 +1,404 @@
+"""Sharded scans: the top-level subtrees of one task walked in separate processes.
+
+A single worker process is bound by the GIL once a library has millions of files:
+path joins, filter matching and per-file bookkeeping all compete with the walker
+threads. With ``SCAN_PROCESSES`` > 1 every top-level directory of the source becomes a
+shard that one pool process lists and materializes end to end with the same
+``ListingProcessor`` code the worker uses.
+
+The parent stays in charge of everything shared: shard processes take rate-limit
+tokens from the worker's ``RateLimiter`` (fed through one semaphore per operation), and
+report their log lines, source-call latencies, index rows and per-directory counts back
+in batches, which the parent replays into ``broadcast``, the metrics, the adaptive
+backoff and the tree index.
+"""
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .filters import FileFilter
+from .listing_cache import ListingCache
+from .placeholders import PlaceholderWriter
+from .processing import ListingProcessor
+from .walker import ParallelWalker
+
+OPS = ('readdir', 'stat', 'write')
+JOURNAL_PREFIX = 'placeholder.journal.'
+# Messages a shard buffers before sending, and the longest it holds one back.
+BATCH_ITEMS = 256
+BATCH_SECONDS = 0.2
+# Batches in flight per shard process before senders block on the parent.
+CHANNEL_DEPTH = 8
+GRANT_POLL_SECONDS = 0.01
+
+# Set in each pool process by _init_process.
+_channel = None
+_stop = None
+_running = None
+_grants: Dict = {}
+_limited = None
+# One writer per pool process, so each destination filesystem is probed once.
+_writer: Optional[PlaceholderWriter] = None
+
+
+def _context():
+    # forkserver children start from a clean interpreter that never imported the Flask
+    # app, and do not inherit the worker's threads and locks the way fork would.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _init_process(channel, stop, running, grants, limited) -> None:
+    global _channel, _stop, _running, _grants, _limited
+    _channel = channel
+    _stop = stop
+    _running = running
+    _grants = grants
+    _limited = limited
+
+
+def _journal_path(backup_dir, pid: int) -> Path:
+    return Path(backup_dir) / f'{JOURNAL_PREFIX}{pid}'
+
+
+def _process_writer(job: Dict, onerror: Callable[[str], None]) -> PlaceholderWriter:
+    global _writer
+    if _writer is None:
+        _writer = PlaceholderWriter(
+            _journal_path(job['backup_dir'], os.getpid()),
+            size=job['size'],
+            strategy=job['strategy'],
+        )
+    # Errors go to whichever shard is running in this process now.
+    _writer.onerror = onerror
+    return _writer
+
+
+def recover_journals(
+    backup_dir: Path,
+    size: int,
+    onerror: Optional[Callable[[str], None]] = None,
+    pids: Optional[Sequence[int]] = None,
+) -> int:
+    """Finish placeholders that shard processes left short, then drop their journals.
+
+    Without ``pids`` every shard journal is handled (at startup, before any shard runs).
+    """
+    repaired = 0
+    if pids is None:
+        paths = sorted(Path(backup_dir).glob(JOURNAL_PREFIX + '*'))
+    else:
+        paths = [path for path in (_journal_path(backup_dir, pid) for pid in pids) if path.exists()]
+    for path in paths:
+        writer = PlaceholderWriter(path, size=size, onerror=onerror)
+        try:
+            repaired += writer.recover()
+        finally:
+            writer.close()
+        try:
+            path.unlink()
+        except OSError:
+            pass
+    return repaired
+
+
+class _Outbox:
+    """Batches a shard's messages to the parent; safe to use from walker threads."""
+
+    def __init__(self, shard: str):
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._items: List[Tuple] = []
+        self._sent = time.monotonic()
+
+    def put(self, *item) -> None:
+        with self._lock:
+            self._items.append(item)
+            if len(self._items) >= BATCH_ITEMS or time.monotonic() - self._sent >= BATCH_SECONDS:
+                self._send()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._send()
+
+    def _send(self) -> None:
+        # Caller holds _lock. Blocks while the parent is behind, which throttles the shard.
+        if self._items:
+            _channel.put(('batch', self.shard, self._items))
+            self._items = []
+        self._sent = time.monotonic()
+
+    def done(self, result: Dict) -> None:
+        self.flush()
+        _channel.put(('done', self.shard, result))
+
+
+class _Forward:
+    """Histogram stand-in whose observations are replayed by the parent."""
+
+    def __init__(self, outbox: _Outbox, kind: str):
+        self.outbox = outbox
+        self.kind = kind
+
+    def observe(self, value: float, op: str = '') -> None:
+        self.outbox.put(self.kind, op, value)
+
+
+class _GrantLimiter:
+    """``RateLimiter`` stand-in: each token comes from the worker's limiter via a semaphore.
+
+    Latencies go to the parent through ``m_source_seconds``, so ``observe`` has nothing to do.
+    """
+
+    def acquire(self, op: str, n: float = 1.0) -> float:
+        index = OPS.index(op)
+        grant = _grants[op]
+        started = time.monotonic()
+        needed = int(math.ceil(n))
+        while needed and _limited[index] and not _stop.is_set():
+            if grant.acquire(timeout=0.2):
+                needed -= 1
+        return time.monotonic() - started
+
+    def observe(self, op: str, seconds: float) -> None:
+        pass
+
+
+class _IndexForward:
+    """The part of ``TreeIndex`` a shard uses; rows are staged by the parent."""
+
+    def __init__(self, outbox: _Outbox):
+        self.outbox = outbox
+
+    def get(self, key: str, rel: str):
+        return None
+
+    def stage(self, key: str, rel: str, mtime_ns: int, dirs: List[str], files: List[str]) -> None:
+        self.outbox.put('stage', rel, mtime_ns, dirs, files)
+
+    def stage_chunked(self, key: str, rel: str, dirs: List[str], files: List[str]) -> None:
+        self.outbox.put('chunked', rel, dirs, files)
+
+    def stage_page(self, key: str, rel: str, page: int, files: List[str]) -> None:
+        self.outbox.put('page', rel, page, files)
+
+    def discard(self, key: str, rel: str) -> None:
+        self.outbox.put('discard', rel)
+
+
+class ShardScanner(ListingProcessor):
+    """Walks and materializes one shard inside a pool process."""
+
+    def __init__(self, job: Dict, outbox: _Outbox):
+        self.job = job
+        self.outbox = outbox
+        self.rate_limiter = _GrantLimiter()
+        self.tree_index = _IndexForward(outbox)
+        self.listing_cache = ListingCache(ttl=0, max_names=0)
+        self.m_limiter_wait = _Forward(outbox, 'wait')
+        self.m_source_seconds = _Forward(outbox, 'source')
+        self.placeholder_writer = _process_writer(job, self.broadcast)
+
+    def broadcast(self, msg: str) -> None:
+        self.outbox.put('log', msg)
+
+    def run(self) -> Dict:
+        job = self.job
+        file_filter = FileFilter(job['filters'], videos_only=job['videos_only'])
+        list_dir, seen = self._indexed_lister(job['src'], '', False, file_filter, job['chunk_size'])
+        reported = 0
+        walker = ParallelWalker(
+            concurrency=job['concurrency'],
+            list_dir=list_dir,
+            onerror=lambda path, exc: self.broadcast(f'[WARN] Cannot list {path}: {exc}'),
+            stop_event=_stop,
+        )
+        for listing in walker.walk(job['src'], start=[job['shard']]):
+            while not _running.wait(0.5):
+                if _stop.is_set():
+                    break
+            created, skipped = self._process_listing(
+                listing, job['dest_root'], '', file_filter, job['overwrite'],
+            )
+            files, reported = seen['files'] - reported, seen['files']
+            self.outbox.put('dir', created, skipped, int(not listing.chunk), files)
+        return {'stopped': _stop.is_set(), 'pid': os.getpid()}
+
+
+def scan_shard(job: Dict) -> Dict:
+    """Pool entry point: walk ``job['shard']`` (relative to ``job['src']``)."""
+    outbox = _Outbox(job['shard'])
+    try:
+        result = ShardScanner(job, outbox).run()
+    finally:
+        outbox.flush()
+    outbox.done(result)
+    return result
+
+
+class ShardBudget:
+    """Feeds tokens from the worker's limiter to shard processes, at most ``burst`` ahead.
+
+    Shards therefore share one budget with every other running task, follow rate changes
+    made through the API at once, and slow down with the worker's adaptive backoff.
+    """
+
+    def __init__(self, limiter, ctx):
+        self.limiter = limiter
+        self.grants = {op: ctx.Semaphore(0) for op in OPS}
+        # 1 while the worker enforces a rate for the op; shards skip the semaphore otherwise.
+        self.limited = ctx.Array('b', [1 if limiter.buckets[op].rate > 0 else 0 for op in OPS])
+        self._done = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for index, op in enumerate(OPS):
+            thread = threading.Thread(
+                target=self._feed, args=(index, op), daemon=True, name=f'shard-grants-{op}',
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _feed(self, index: int, op: str) -> None:
+        grant = self.grants[op]
+        bucket = self.limiter.buckets[op]
+        while not self._done.is_set():
+            limited = bucket.rate > 0
+            self.limited[index] = 1 if limited else 0
+            if not limited or grant.get_value() >= self.limiter.burst:
+                self._done.wait(GRANT_POLL_SECONDS)
+                continue
+            self.limiter.acquire(op)
+            grant.release()
+
+    def close(self) -> None:
+        self._done.set()
+        for thread in self._threads:
+            thread.join()
+
+
+class ShardRunner:
+    """Parent side of a sharded walk.
+
+    ``run`` submits one job per planned shard and yields ``(created, skipped, new_dir)``
+    for every listing a shard finishes (``new_dir`` is 0 for later chunks of a large
+    directory), after replaying that shard's log lines, latencies, index rows and seen
+    file counts into ``host`` (the worker). ``frontier()`` lists the shards that have not
+    completed, in the walker's checkpoint format, so an interrupted task resumes them.
+    """
+
+    def __init__(self, host, key: str, job: Dict, processes: int, stop_event, state, seen: Dict):
+        self.host = host
+        self.key = key
+        self.job = job
+        self.processes = max(1, int(processes))
+        self.stop_event = stop_event
+        self.state = state
+        self.seen = seen
+        self._remaining: Dict[str, None] = {}
+
+    def frontier(self) -> List[str]:
+        return list(self._remaining)
+
+    def plan(self, shards: Sequence[str]) -> None:
+        self._remaining = dict.fromkeys(shards)
+
+    def run(self) -> Iterator[Tuple[int, int, int]]:
+        shards = list(self._remaining)
+        if not shards:
+            return
+        ctx = _context()
+        budget = ShardBudget(self.host.rate_limiter, ctx)
+        processes = min(self.processes, len(shards))
+        channel = ctx.Queue(maxsize=CHANNEL_DEPTH * processes)
+        stop = ctx.Event()
+        running = ctx.Event()
+        running.set()
+        budget.start()
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=ctx,
+            initializer=_init_process,
+            initargs=(channel, stop, running, budget.grants, budget.limited),
+        )
+        futures = {}
+        pids = set()
+        try:
+            for rel in shards:
+                futures[pool.submit(scan_shard, dict(self.job, shard=rel))] = rel
+            waiting = set(shards)
+            checked = time.monotonic()
+            while waiting:
+                if self.stop_event.is_set():
+                    stop.set()
+                if self.state is not None and self.state.paused:
+                    running.clear()
+                else:
+                    running.set()
+                try:
+                    kind, rel, payload = channel.get(timeout=0.25)
+                except queue.Empty:
+                    kind = None
+                if kind == 'batch':
+                    yield from self._replay(payload)
+                elif kind == 'done':
+                    waiting.discard(rel)
+                    pids.add(payload['pid'])
+                    if not payload['stopped']:
+                        self._remaining.pop(rel, None)
+                if kind is None or time.monotonic() - checked >= 1.0:
+                    checked = time.monotonic()
+                    for future, rel in futures.items():
+                        if rel in waiting and future.done() and future.exception() is not None:
+                            # A crashed shard never reports 'done'; it stays in the frontier.
+                            waiting.discard(rel)
+                            self.host.broadcast(f'[ERROR] Scan shard {rel} failed: {future.exception()}')
+        finally:
+            stop.set()
+            running.set()
+            # Keep draining so no shard blocks on a full channel while the pool shuts down.
+            while not all(future.done() for future in futures):
+                try:
+                    channel.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            pool.shutdown(wait=True)
+            budget.close()
+            channel.close()
+            # Journals are empty unless a shard process died mid-batch.
+            recover_journals(self.job['backup_dir'], self.job['size'], self.host.broadcast, pids)
+
+    def _replay(self, items: List[Tuple]) -> Iterator[Tuple[int, int, int]]:
+        host = self.host
+        for item in items:
+            kind = item[0]
+            if kind == 'dir':
+                _kind, created, skipped, new_dir, files = item
+                self.seen['files'] += files
+                yield created, skipped, new_dir
+            elif kind == 'log':
+                host.broadcast(item[1])
+            elif kind == 'source':
+                host.rate_limiter.observe(item[1], item[2])
+                host.m_source_seconds.observe(item[2], op=item[1])
+            elif kind == 'wait':
+                host.m_limiter_wait.observe(item[2], op=item[1])
+            elif kind == 'stage':
+                _kind, rel, mtime_ns, dirs, files = item
+                host.tree_index.stage(self.key, rel, mtime_ns, dirs, files)
+            elif kind == 'chunked':
+                _kind, rel, dirs, files = item
+                host.tree_index.stage_chunked(self.key, rel, dirs, files)
+            elif kind == 'page':
+                _kind, rel, page, files = item
+                host.tree_index.stage_page(self.key, rel, page, files)
+            elif kind == 'discard':
+                host.tree_index.discard(self.key, item[1])
@@ -2,6 +2,7 @@
 (() => {
   const cfg = window.__BNETDISK__ || {};
   const $ = (id) => document.getElementById(id);
+  const LIST_PAGE_SIZE = 500;
 
   const els = {
     srcRootSelect: $('srcRootSelect'),
@@ -252,20 +253,9 @@
     container.innerHTML = '<div class="muted-msg">加载中...</div>';
 
     try {
-      const res = await fetchWithTimeout('/api/listdir?path=' + encodeURIComponent(path));
-      const raw = await res.text();
-      let data = {};
-      try {
-        data = raw ? JSON.parse(raw) : {};
-      } catch (_) {
-        data = { error: raw || res.statusText || 'invalid response' };
-      }
-      if (!res.ok) {
-        container.innerHTML = `<div class="err">读取目录失败: ${escapeHtml(data.error || raw || res.statusText)}</div>`;
-        return;
-      }
+      const data = await fetchListPage(path);
       if (data.error) {
-        container.innerHTML = `<div class="err">${escapeHtml(data.error)}</div>`;
+        container.innerHTML = `<div class="err">读取目录失败: ${escapeHtml(data.error)}</div>`;
         return;
       }
 
@@ -278,37 +268,8 @@
         return;
       }
 
-      entries.forEach((entry) => {
-        const row = document.createElement('div');
-        const isDir = !!entry.is_dir;
-        const isVideo = !!entry.is_video;
-        row.className = 'entry ' + (isDir ? 'dir' : (isVideo ? 'file video' : 'file'));
-        row.setAttribute('role', 'listitem');
-
-        const name = document.createElement('div');
-        name.className = 'entry-name';
-        name.textContent = entry.name + (isDir ? '/' : '');
-
-        const meta = document.createElement('div');
-        meta.className = 'entry-meta';
-        meta.textContent = isDir ? '目录' : (isVideo ? '视频' : '文件');
-
-        if (isDir) {
-          row.onclick = async () => {
-            if (which === 'src') {
-              state.currentSrcPath = entry.path;
-              await loadEntries(entry.path, 'src');
-            } else {
-              state.currentDstPath = entry.path;
-              await loadEntries(entry.path, 'dst');
-            }
-          };
-        }
-
-        row.appendChild(name);
-        row.appendChild(meta);
-        container.appendChild(row);
-      });
+      appendEntries(container, entries, which);
+      appendLoadMore(container, path, which, data);
     } catch (err) {
       if (err.name === 'AbortError') {
         container.innerHTML = '<div class="err">请求超时（目录较大或挂载点不可用），请重试。</div>';
@@ -322,6 +283,80 @@
     }
   }
 
+  async function fetchListPage(path, cursor) {
+    let url = '/api/listdir?limit=' + LIST_PAGE_SIZE + '&path=' + encodeURIComponent(path);
+    if (cursor) url += '&cursor=' + encodeURIComponent(cursor);
+    const res = await fetchWithTimeout(url);
+    const raw = await res.text();
+    let data = {};
+    try {
+      data = raw ? JSON.parse(raw) : {};
+    } catch (_) {
+      data = { error: raw || res.statusText || 'invalid response' };
+    }
+    if (!res.ok && !data.error) data.error = raw || res.statusText;
+    return data;
+  }
+
+  function appendEntries(container, entries, which) {
+    entries.forEach((entry) => {
+      const row = document.createElement('div');
+      const isDir = !!entry.is_dir;
+      const isVideo = !!entry.is_video;
+      row.className = 'entry ' + (isDir ? 'dir' : (isVideo ? 'file video' : 'file'));
+      row.setAttribute('role', 'listitem');
+
+      const name = document.createElement('div');
+      name.className = 'entry-name';
+      name.textContent = entry.name + (isDir ? '/' : '');
+
+      const meta = document.createElement('div');
+      meta.className = 'entry-meta';
+      meta.textContent = isDir ? '目录' : (isVideo ? '视频' : '文件');
+
+      if (isDir) {
+        row.onclick = async () => {
+          if (which === 'src') {
+            state.currentSrcPath = entry.path;
+            await loadEntries(entry.path, 'src');
+          } else {
+            state.currentDstPath = entry.path;
+            await loadEntries(entry.path, 'dst');
+          }
+        };
+      }
+
+      row.appendChild(name);
+      row.appendChild(meta);
+      container.appendChild(row);
+    });
+  }
+
+  function appendLoadMore(container, path, which, data) {
+    if (!data.next_cursor) return;
+    const btn = document.createElement('button');
+    btn.type = 'button';
+    btn.className = 'btn load-more';
+    const shown = container.querySelectorAll('.entry').length;
+    btn.textContent = `加载更多（已显示 ${shown} / ${data.total}）`;
+    btn.onclick = async () => {
+      btn.disabled = true;
+      btn.textContent = '加载中...';
+      try {
+        const next = await fetchListPage(path, data.next_cursor);
+        if (next.error) throw new Error(next.error);
+        btn.remove();
+        appendEntries(container, next.entries || [], which);
+        appendLoadMore(container, path, which, next);
+      } catch (err) {
+        btn.disabled = false;
+        btn.textContent = '加载失败，点击重试';
+        console.error(err);
+      }
+    };
+    container.appendChild(btn);
+  }
+
   function shortPath(path) {
     if (!path) return '';
     const parts = String(path).split('/').filter(Boolean);
@@ -396,6 +431,38 @@
     els.logEl.scrollTop = els.logEl.scrollHeight;
   }
 
+  async function taskAction(taskId, action) {
+    try {
+      const res = await fetch(`/api/tasks/${encodeURIComponent(taskId)}/${action}`, { method: 'POST' });
+      const data = await res.json().catch(() => ({}));
+      if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+      await loadQueue();
+    } catch (err) {
+      toast(`操作失败：${err.message}`, 'error');
+    }
+  }
+
+  document.addEventListener('click', (event) => {
+    const btn = event.target.closest('[data-task-action]');
+    if (!btn) return;
+    taskAction(btn.getAttribute('data-task-id'), btn.getAttribute('data-task-action'));
+  });
+
+  function formatDuration(seconds) {
+    if (seconds >= 3600) return `${Math.floor(seconds / 3600)}时${Math.floor((seconds % 3600) / 60)}分`;
+    if (seconds >= 60) return `${Math.floor(seconds / 60)}分${seconds % 60}秒`;
+    return `${seconds}秒`;
+  }
+
+  function progressText(progress) {
+    if (!progress || progress.files === undefined) return '';
+    let text = ` · ${progress.dirs} 目录 / ${progress.files} 文件 · 新建 ${progress.created} · ${progress.rate} 文件/秒`;
+    if (progress.percent !== null && progress.percent !== undefined) text += ` · ${progress.percent}%`;
+    if (progress.eta_seconds !== null && progress.eta_seconds !== undefined) text += ` · 剩余约 ${formatDuration(progress.eta_seconds)}`;
+    else if (progress.estimate === 'counting') text += ' · 正在统计总量';
+    return text;
+  }
+
   async function loadQueue() {
     try {
       const res = await fetch('/api/queue');
@@ -404,13 +471,19 @@
       els.queueEl.innerHTML = '';
       els.queueCountEl.textContent = `${items.length} 项`;
 
-      if (data.current) {
+      const running = data.running || (data.current ? [data.current] : []);
+      if (running.length) {
         els.currentTask.classList.remove('hidden');
-        els.currentTask.innerHTML = `
-          <strong>正在执行</strong><br>
-          ${escapeHtml(data.current.src)}<br>
-          → ${escapeHtml(data.current.dst)}
-          <div class="queue-meta">mode=${escapeHtml(data.current.mode || 'incremental')}</div>`;
+        els.currentTask.innerHTML = `<strong>正在执行（${running.length}）</strong>` + running.map((task) => `
+          <div class="running-task">
+            ${escapeHtml(task.src)}<br>
+            → ${escapeHtml(task.dst)}
+            <div class="queue-meta">mode=${escapeHtml(task.mode || 'incremental')}${task.paused ? ' · 已暂停' : ''}${task.merge_count ? ` · 已合并 ${task.merge_count} 个请求` : ''}${progressText(task.progress)}</div>
+            ${task.id ? `<div class="task-actions">
+              <button type="button" class="btn soft" data-task-action="${task.paused ? 'resume' : 'pause'}" data-task-id="${escapeHtml(task.id)}">${task.paused ? '继续' : '暂停'}</button>
+              <button type="button" class="btn soft" data-task-action="cancel" data-task-id="${escapeHtml(task.id)}">取消</button>
+            </div>` : ''}
+          </div>`).join('');
       } else {
         els.currentTask.classList.add('hidden');
         els.currentTask.innerHTML = '';
@@ -425,7 +498,11 @@
         const li = document.createElement('li');
         li.innerHTML = `
           <strong>${index + 1}.</strong> ${escapeHtml(item.src)}
-          <div class="queue-meta">→ ${escapeHtml(item.dst)} · mode=${escapeHtml(item.mode || 'incremental')}</div>`;
+          <div class="queue-meta">→ ${escapeHtml(item.dst)} · mode=${escapeHtml(item.mode || 'incremental')}${item.paused ? ' · 已暂停' : ''}</div>
+          ${item.id ? `<div class="task-actions">
+            <button type="button" class="btn soft" data-task-action="${item.paused ? 'resume' : 'pause'}" data-task-id="${escapeHtml(item.id)}">${item.paused ? '继续' : '暂停'}</button>
+            <button type="button" class="btn soft" data-task-action="cancel" data-task-id="${escapeHtml(item.id)}">取消</button>
+          </div>` : ''}`;
         els.queueEl.appendChild(li);
       });
     } catch (_) {
@@ -604,7 +681,9 @@
     const n = Math.min(state.srcs.length, state.dsts.length);
     if (!n) return toast('请先各选一个源和目标', 'warn');
 
-    const mode = document.querySelector('input[name="mode"]:checked')?.value || 'incremental';
+    const choice = document.querySelector('input[name="mode"]:checked')?.value || 'incremental';
+    const dryRun = choice === 'sync-dry';
+    const mode = dryRun ? 'sync' : choice;
     const tasks = [];
     const usedIndexes = [];
     for (let i = 0; i < n; i += 1) {
@@ -621,6 +700,7 @@
         dst: dst.path,
         dst_root: dst.root,
         mode,
+        dry_run: dryRun,
       });
       usedIndexes.push(i);
     }
@@ -661,7 +741,8 @@
         renderLists();
         loadQueue();
         const skipped = (data.skipped && data.skipped.length) || 0;
-        toast(`已提交 ${data.added || 0} 个任务${skipped ? `，跳过 ${skipped} 个` : ''}`, skipped ? 'warn' : 'success');
+        const merged = (data.merged && data.merged.length) || 0;
+        toast(`已提交 ${data.added || 0} 个任务${merged ? `，合并 ${merged} 个` : ''}${skipped ? `，跳过 ${skipped} 个` : ''}`, skipped ? 'warn' : 'success');
       } else {
         toast('添加失败: ' + (data.error || JSON.stringify(data)), 'error');
       }
@@ -0,0 +1,176 @@
+"""Sync mode: merge one source listing with its destination directory and prune orphans."""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Orphans are moved here (inside the destination root) when not deleted outright.
+# Plex, Emby and Jellyfin all skip dot-directories.
+QUARANTINE_DIR = '.bnetdisk-quarantine'
+ORPHAN_ACTIONS = ('quarantine', 'delete')
+
+
+class DirDiff(NamedTuple):
+    missing: List[str]
+    existing: set
+    orphan_files: List[str]
+    orphan_dirs: List[str]
+
+
+def scan_dest(dest_dir: str) -> Tuple[List[str], List[str]]:
+    """``(dirs, files)`` of a destination directory, both sorted; a missing directory is empty."""
+    dirs: List[str] = []
+    files: List[str] = []
+    try:
+        with os.scandir(dest_dir) as iterator:
+            for entry in iterator:
+                if entry.name == QUARANTINE_DIR:
+                    continue
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                (dirs if is_dir else files).append(entry.name)
+    except FileNotFoundError:
+        pass
+    dirs.sort()
+    files.sort()
+    return dirs, files
+
+
+def diff_dir(
+    src_dirs: Sequence[str],
+    wanted: Sequence[str],
+    dest_dirs: Sequence[str],
+    dest_files: Sequence[str],
+    owned: Callable[[str], bool],
+) -> DirDiff:
+    """Merge sorted name lists in one pass.
+
+    ``wanted`` are the source files that should have placeholders. A destination file is
+    an orphan when no wanted source file has its name and ``owned(name)`` says the task
+    would have produced it (e.g. a video name in videos-only mode); a destination
+    directory is an orphan when the source has no directory of that name.
+    """
+    missing: List[str] = []
+    existing: set = set()
+    orphan_files: List[str] = []
+    i = j = 0
+    while i < len(wanted) or j < len(dest_files):
+        if j >= len(dest_files) or (i < len(wanted) and wanted[i] < dest_files[j]):
+            missing.append(wanted[i])
+            i += 1
+        elif i >= len(wanted) or dest_files[j] < wanted[i]:
+            if owned(dest_files[j]):
+                orphan_files.append(dest_files[j])
+            j += 1
+        else:
+            existing.add(wanted[i])
+            i += 1
+            j += 1
+
+    orphan_dirs: List[str] = []
+    i = j = 0
+    while j < len(dest_dirs):
+        if i >= len(src_dirs) or dest_dirs[j] < src_dirs[i]:
+            orphan_dirs.append(dest_dirs[j])
+            j += 1
+        elif src_dirs[i] < dest_dirs[j]:
+            i += 1
+        else:
+            i += 1
+            j += 1
+    return DirDiff(missing, existing, orphan_files, orphan_dirs)
+
+
+class Pruner:
+    """Delete or quarantine orphaned placeholders under ``dest_root``.
+
+    Only regular files of exactly ``size`` bytes are treated as placeholders, so real
+    media that replaced a placeholder (phase two of the Plex workflow) is never touched.
+    With ``dry_run`` nothing changes on disk; every action is still reported.
+    ``forget_tree(path)`` is told about each pruned directory tree, whose directories
+    may be gone afterwards.
+    """
+
+    def __init__(
+        self,
+        dest_root: Path,
+        size: int,
+        action: str = 'quarantine',
+        dry_run: bool = False,
+        report: Optional[Callable[[str, str], None]] = None,
+        onerror: Optional[Callable[[str], None]] = None,
+        forget_tree: Optional[Callable[[str], None]] = None,
+    ):
+        if action not in ORPHAN_ACTIONS:
+            raise ValueError(f'orphan action must be one of {", ".join(ORPHAN_ACTIONS)}')
+        self.dest_root = str(dest_root)
+        self.size = int(size)
+        self.action = action
+        self.dry_run = bool(dry_run)
+        self.report = report
+        self.onerror = onerror
+        self.forget_tree = forget_tree
+        self.quarantine_root = os.path.join(
+            self.dest_root, QUARANTINE_DIR, time.strftime('%Y%m%d-%H%M%S'),
+        )
+        self.removed = 0
+        self._lock = threading.Lock()
+
+    def _error(self, message: str) -> None:
+        if self.onerror is not None:
+            self.onerror(message)
+
+    def _is_placeholder(self, path: str) -> bool:
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        return (st.st_mode & 0o170000) == 0o100000 and st.st_size == self.size
+
+    def _remove(self, path: str) -> bool:
+        if self.report is not None:
+            self.report(self.action, path)
+        if self.dry_run:
+            return True
+        try:
+            if self.action == 'delete':
+                os.unlink(path)
+            else:
+                target = os.path.join(self.quarantine_root, os.path.relpath(path, self.dest_root))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+        except OSError as exc:
+            self._error(f'[WARN] Cannot {self.action} orphan {path}: {exc}')
+            return False
+        return True
+
+    def prune_files(self, dest_dir: str, names: Sequence[str]) -> int:
+        removed = 0
+        for name in names:
+            path = os.path.join(dest_dir, name)
+            if self._is_placeholder(path) and self._remove(path):
+                removed += 1
+        with self._lock:
+            self.removed += removed
+        return removed
+
+    def prune_tree(self, dest_dir: str, owned: Callable[[str], bool]) -> int:
+        """Prune every owned placeholder below an orphaned directory, then drop the
+        directories left empty. Other files keep their directories alive."""
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(dest_dir, topdown=False):
+            removed += self.prune_files(dirpath, [name for name in filenames if owned(name)])
+            if self.dry_run:
+                continue
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass  # Not empty: something we do not own lives here.
+        if self.forget_tree is not None and not self.dry_run:
+            self.forget_tree(dest_dir)
+        return removed
@@ -0,0 +1,231 @@
+"""Persistent per-task index of source directory listings (SQLite)."""
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    task_key TEXT NOT NULL,
+    rel TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    dirs TEXT NOT NULL,
+    files TEXT NOT NULL,
+    PRIMARY KEY (task_key, rel)
+);
+CREATE TABLE IF NOT EXISTS staging (
+    task_key TEXT NOT NULL,
+    rel TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    dirs TEXT NOT NULL,
+    files TEXT NOT NULL,
+    PRIMARY KEY (task_key, rel)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    task_key TEXT NOT NULL,
+    rel TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    PRIMARY KEY (task_key, rel, page)
+);
+CREATE TABLE IF NOT EXISTS staging_pages (
+    task_key TEXT NOT NULL,
+    rel TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    PRIMARY KEY (task_key, rel, page)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    task_key TEXT PRIMARY KEY,
+    finished_at REAL NOT NULL,
+    dir_count INTEGER NOT NULL,
+    file_count INTEGER NOT NULL,
+    filters TEXT NOT NULL DEFAULT ''
+);
+"""
+
+# mtime of a row kept only for exports: fast runs never trust it and list the directory again.
+STALE = -1
+
+
+class RunTotals(NamedTuple):
+    finished_at: float
+    dir_count: int
+    file_count: int
+
+
+class IndexedDir(NamedTuple):
+    mtime_ns: int
+    dirs: List[str]
+    files: List[str]
+
+
+def task_key(src: Path, dest_root: Path) -> str:
+    return f'{src}\0{dest_root}'
+
+
+class TreeIndex:
+    """Directory mtimes and entry lists from the last successful run of each task.
+
+    A run stages every directory it visits; ``commit_run`` swaps the staged rows in
+    atomically, ``abort_run`` throws them away so an interrupted walk never leaves a
+    half-updated snapshot behind. A directory too large to list in one piece keeps its
+    first chunk in ``dirs`` and the files of later chunks in ``pages``. Safe to use from
+    walker threads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(runs)')}
+        if 'filters' not in columns:  # an index from before runs recorded their filter
+            self._conn.execute("ALTER TABLE runs ADD COLUMN filters TEXT NOT NULL DEFAULT ''")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def get(self, key: str, rel: str) -> Optional[IndexedDir]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT mtime_ns, dirs, files FROM dirs WHERE task_key = ? AND rel = ? AND mtime_ns != ?',
+                (key, rel, STALE),
+            ).fetchone()
+        if row is None:
+            return None
+        return IndexedDir(row[0], json.loads(row[1]), json.loads(row[2]))
+
+    def has_snapshot(self, key: str, filters: Optional[str] = None) -> bool:
+        """True if the task has a snapshot (taken with the ``filters`` fingerprint, if given).
+
+        A fast run skips files it saw last time, so it may only trust a snapshot taken
+        with the same filter: a broader one must still create what was filtered out.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT filters FROM runs WHERE task_key = ?', (key,)).fetchone()
+        return row is not None and (filters is None or row[0] == filters)
+
+    def last_run(self, key: str) -> Optional[RunTotals]:
+        """Totals of the last successful run of a task, if there was one."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT finished_at, dir_count, file_count FROM runs WHERE task_key = ?', (key,),
+            ).fetchone()
+        return RunTotals(*row) if row is not None else None
+
+    def completed_runs(self) -> List[Dict]:
+        """Every task with a committed snapshot: its source, destination and totals."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT task_key, finished_at, dir_count, file_count FROM runs ORDER BY finished_at DESC'
+            ).fetchall()
+        runs = []
+        for key, finished_at, dir_count, file_count in rows:
+            src, _sep, dest_root = key.partition('\0')
+            runs.append({'src': src, 'dest_root': dest_root, 'finished_at': finished_at,
+                         'dir_count': dir_count, 'file_count': file_count})
+        return runs
+
+    def iter_snapshot(self, key: str, page: int = 500) -> Iterator[Tuple[str, List[str]]]:
+        """``(rel, files)`` of every directory in a task's snapshot, a page at a time.
+
+        A chunked directory comes back once per stored chunk. The lock is only held per
+        page, so a long export does not stall running walks.
+        """
+        yield from self._iter_rows(
+            'SELECT rel, files, 0 FROM dirs WHERE task_key = ? AND (rel, 0) > (?, ?) ORDER BY rel LIMIT ?',
+            key, page,
+        )
+        yield from self._iter_rows(
+            'SELECT rel, files, page FROM pages WHERE task_key = ? AND (rel, page) > (?, ?) '
+            'ORDER BY rel, page LIMIT ?',
+            key, page,
+        )
+
+    def _iter_rows(self, sql: str, key: str, page: int) -> Iterator[Tuple[str, List[str]]]:
+        after = ('', -1)
+        while True:
+            with self._lock:
+                rows = self._conn.execute(sql, (key, after[0], after[1], page)).fetchall()
+            for rel, files, _number in rows:
+                yield rel, json.loads(files)
+            if len(rows) < page:
+                return
+            after = (rows[-1][0], rows[-1][2])
+
+    def begin_run(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM staging WHERE task_key = ?', (key,))
+            self._conn.execute('DELETE FROM staging_pages WHERE task_key = ?', (key,))
+
+    def stage(self, key: str, rel: str, mtime_ns: int, dirs: List[str], files: List[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO staging (task_key, rel, mtime_ns, dirs, files) VALUES (?, ?, ?, ?, ?)',
+                (key, rel, int(mtime_ns), json.dumps(dirs, ensure_ascii=False), json.dumps(files, ensure_ascii=False)),
+            )
+
+    def stage_unchanged(self, key: str, rel: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO staging SELECT * FROM dirs WHERE task_key = ? AND rel = ?',
+                (key, rel),
+            )
+
+    def stage_chunked(self, key: str, rel: str, dirs: List[str], files: List[str]) -> None:
+        """Stage the first chunk of a directory streamed in chunks (``stage_page`` adds the rest)."""
+        with self._lock:
+            self._conn.execute('DELETE FROM staging_pages WHERE task_key = ? AND rel = ?', (key, rel))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO staging (task_key, rel, mtime_ns, dirs, files) VALUES (?, ?, ?, ?, ?)',
+                (key, rel, STALE, json.dumps(dirs, ensure_ascii=False), json.dumps(files, ensure_ascii=False)),
+            )
+
+    def stage_page(self, key: str, rel: str, page: int, files: List[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO staging_pages (task_key, rel, page, files) VALUES (?, ?, ?, ?)',
+                (key, rel, int(page), json.dumps(files, ensure_ascii=False)),
+            )
+
+    def discard(self, key: str, rel: str) -> None:
+        """Make the next fast run re-list a staged directory; its listing stays for exports."""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE staging SET mtime_ns = ? WHERE task_key = ? AND rel = ?', (STALE, key, rel),
+            )
+
+    def commit_run(self, key: str, finished_at: float, file_count: int, filters: str = '') -> None:
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM dirs WHERE task_key = ?', (key,))
+                conn.execute('INSERT INTO dirs SELECT * FROM staging WHERE task_key = ?', (key,))
+                dir_count = conn.execute('SELECT COUNT(*) FROM dirs WHERE task_key = ?', (key,)).fetchone()[0]
+                conn.execute('DELETE FROM staging WHERE task_key = ?', (key,))
+                conn.execute('DELETE FROM pages WHERE task_key = ?', (key,))
+                conn.execute('INSERT INTO pages SELECT * FROM staging_pages WHERE task_key = ?', (key,))
+                conn.execute('DELETE FROM staging_pages WHERE task_key = ?', (key,))
+                conn.execute(
+                    'INSERT OR REPLACE INTO runs (task_key, finished_at, dir_count, file_count, filters) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, finished_at, dir_count, int(file_count), filters),
+                )
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+
+    def abort_run(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM staging WHERE task_key = ?', (key,))
+            self._conn.execute('DELETE FROM staging_pages WHERE task_key = ?', (key,))
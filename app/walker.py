@@ -0,0 +1,282 @@
+"""Concurrent directory walker for slow (remote / FUSE) source mounts."""
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+Chunks = Iterator[Tuple[List[str], List[str]]]
+
+
+class DirListing(NamedTuple):
+    path: str
+    rel: str
+    dirs: List[str]
+    files: List[str]
+    # None for a complete listing; 0, 1, ... for the successive chunks of a directory
+    # too large to list at once (see ``scandir_stream``).
+    chunk: Optional[int] = None
+
+
+def _add_entry(entry, dirs: List[str], files: List[str]) -> None:
+    try:
+        is_dir = entry.is_dir()
+    except OSError:
+        is_dir = False
+    if is_dir:
+        try:
+            # Match os.walk(followlinks=False): symlinked dirs are listed, not descended.
+            if entry.is_symlink():
+                return
+        except OSError:
+            return
+        dirs.append(entry.name)
+    else:
+        files.append(entry.name)
+
+
+def scandir_listing(path: str) -> Tuple[List[str], List[str]]:
+    """List one directory the way ``os.walk`` classifies entries.
+
+    Directories (including symlinks to directories) go to ``dirs``; everything else,
+    including entries whose type cannot be determined, goes to ``files``. Raises
+    ``OSError`` if the directory itself cannot be read.
+    """
+    dirs: List[str] = []
+    files: List[str] = []
+    with os.scandir(path) as iterator:
+        for entry in iterator:
+            _add_entry(entry, dirs, files)
+    return dirs, files
+
+
+def scandir_counts(path: str) -> Tuple[List[str], int]:
+    """Subdirectories and the number of other entries, classified like ``scandir_listing``.
+
+    Only the subdirectory names are kept, so counting a huge flat directory is cheap.
+    """
+    dirs: List[str] = []
+    files: List[str] = []
+    count = 0
+    with os.scandir(path) as iterator:
+        for entry in iterator:
+            _add_entry(entry, dirs, files)
+            if files:
+                count += 1
+                files.clear()
+    return dirs, count
+
+
+def scandir_stream(path: str, chunk_size: int):
+    """``scandir_listing`` that holds at most ``chunk_size`` names at a time.
+
+    Returns ``(dirs, files)`` when the directory has at most ``chunk_size`` entries.
+    Otherwise returns ``(dirs, files, rest)`` with the first ``chunk_size`` entries;
+    ``rest`` yields the following chunks from the same open directory handle, so the
+    listing is consistent, and closes it when exhausted or closed.
+    """
+    if chunk_size <= 0:
+        return scandir_listing(path)
+    iterator = os.scandir(path)
+    try:
+        dirs: List[str] = []
+        files: List[str] = []
+        for entry in iterator:
+            _add_entry(entry, dirs, files)
+            if len(dirs) + len(files) >= chunk_size:
+                break
+        else:
+            iterator.close()
+            return dirs, files
+        lookahead = next(iterator, None)
+    except BaseException:
+        iterator.close()
+        raise
+    if lookahead is None:
+        iterator.close()
+        return dirs, files
+    return dirs, files, _scandir_rest(iterator, lookahead, chunk_size)
+
+
+def _scandir_rest(iterator, first, chunk_size: int) -> Chunks:
+    with iterator:
+        dirs: List[str] = []
+        files: List[str] = []
+        _add_entry(first, dirs, files)
+        for entry in iterator:
+            if len(dirs) + len(files) >= chunk_size:
+                yield dirs, files
+                dirs, files = [], []
+            _add_entry(entry, dirs, files)
+        yield dirs, files
+
+
+class _Stream:
+    """A directory being listed chunk by chunk; one chunk is held back until the next
+    arrives, so the walker knows which chunk is the last."""
+
+    __slots__ = ('rest', 'held', 'subdirs', 'index')
+
+    def __init__(self, rest: Chunks, first: Tuple[List[str], List[str]]):
+        self.rest = rest
+        self.held = first
+        self.subdirs: List[str] = []
+        self.index = 0
+
+
+class ParallelWalker:
+    """Walk a tree listing up to ``concurrency`` directories at the same time.
+
+    Listings are yielded to the caller as they complete (not in ``os.walk`` order), so
+    all per-file work and rate limiting stays on the consuming thread. Only ``readdir``
+    runs on the pool. With ``concurrency=1`` no threads are started.
+
+    ``list_dir`` may return ``(dirs, files, rest)`` for a large directory (see
+    ``scandir_stream``); its chunks are then yielded one ``DirListing`` each, numbered by
+    ``chunk``, and its subdirectories are queued once the last chunk is read.
+
+    Between two listings, ``frontier()`` returns every directory that still has to be
+    visited (queued, being listed or partly yielded); passing it back as ``start``
+    resumes the walk. One walker instance serves one walk at a time.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        list_dir: Callable[[str], Tuple] = scandir_listing,
+        onerror: Optional[Callable[[str, OSError], None]] = None,
+        stop_event: Optional[threading.Event] = None,
+    ):
+        self.concurrency = max(1, int(concurrency))
+        self.list_dir = list_dir
+        self.onerror = onerror
+        self.stop_event = stop_event
+        self._pending: List[Tuple[str, str]] = []
+        self._running: Dict[Future, Tuple[str, str, Optional[_Stream]]] = {}
+        # Directories partly yielded by the serial walk (the parallel one keeps them in _running).
+        self._open: List[str] = []
+
+    def _stopped(self) -> bool:
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def _list(self, path: str) -> Optional[Tuple]:
+        try:
+            return self.list_dir(path)
+        except OSError as exc:
+            if self.onerror is not None:
+                self.onerror(path, exc)
+            return None
+
+    def _next_chunk(self, path: str, rest: Chunks) -> Optional[Tuple[List[str], List[str]]]:
+        try:
+            return next(rest, None)
+        except OSError as exc:
+            if self.onerror is not None:
+                self.onerror(path, exc)
+            return None
+
+    @staticmethod
+    def _push(pending: List[Tuple[str, str]], path: str, rel: str, dirs: List[str]) -> None:
+        for name in reversed(dirs):
+            pending.append((os.path.join(path, name), os.path.join(rel, name) if rel else name))
+
+    def frontier(self) -> List[str]:
+        return (
+            [rel for _path, rel in self._pending]
+            + [item[1] for item in self._running.values()]
+            + list(self._open)
+        )
+
+    def walk(self, root: str, start: Optional[Sequence[str]] = None) -> Iterator[DirListing]:
+        root = os.fspath(root)
+        if start is None:
+            start = ['']
+        self._pending = [(os.path.join(root, rel) if rel else root, rel) for rel in reversed(list(start))]
+        self._running = {}
+        self._open = []
+        if self.concurrency <= 1:
+            yield from self._walk_serial()
+            return
+        yield from self._walk_parallel()
+
+    def _walk_serial(self) -> Iterator[DirListing]:
+        stack = self._pending
+        while stack and not self._stopped():
+            path, rel = stack.pop()
+            listing = self._list(path)
+            if listing is None:
+                continue
+            if len(listing) == 2:
+                dirs, files = listing
+                self._push(stack, path, rel, dirs)
+                yield DirListing(path, rel, dirs, files)
+                continue
+            stream = _Stream(listing[2], listing[:2])
+            self._open.append(rel)
+            try:
+                while True:
+                    held = stream.held
+                    stream.subdirs.extend(held[0])
+                    following = self._next_chunk(path, stream.rest)
+                    if following is None:
+                        self._open.remove(rel)
+                        self._push(stack, path, rel, stream.subdirs)
+                    yield DirListing(path, rel, held[0], held[1], stream.index)
+                    if following is None:
+                        break
+                    if self._stopped():
+                        # Stays in the frontier; a resumed walk lists it again.
+                        return
+                    stream.held = following
+                    stream.index += 1
+            finally:
+                stream.rest.close()
+
+    def _walk_parallel(self) -> Iterator[DirListing]:
+        pending = self._pending
+        running = self._running
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='walker') as pool:
+                try:
+                    while (pending or running) and not self._stopped():
+                        while pending and len(running) < self.concurrency:
+                            path, rel = pending.pop()
+                            running[pool.submit(self._list, path)] = (path, rel, None)
+                        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            path, rel, stream = running.pop(future)
+                            listing = future.result()
+                            if stream is None:
+                                if listing is None:
+                                    continue
+                                if len(listing) == 2:
+                                    dirs, files = listing
+                                    self._push(pending, path, rel, dirs)
+                                    yield DirListing(path, rel, dirs, files)
+                                else:
+                                    # Nothing to yield until the second chunk tells whether
+                                    # the first one is the last.
+                                    stream = _Stream(listing[2], listing[:2])
+                                    running[pool.submit(self._next_chunk, path, stream.rest)] = (path, rel, stream)
+                            else:
+                                held = stream.held
+                                stream.subdirs.extend(held[0])
+                                if listing is None:
+                                    self._push(pending, path, rel, stream.subdirs)
+                                    stream.rest.close()
+                                else:
+                                    stream.held = listing
+                                    running[pool.submit(self._next_chunk, path, stream.rest)] = (path, rel, stream)
+                                yield DirListing(path, rel, held[0], held[1], stream.index)
+                                stream.index += 1
+                            if self._stopped():
+                                break
+                finally:
+                    for future in running:
+                        future.cancel()
+        finally:
+            # The pool has finished, so no chunk read is in flight any more.
+            for _path, _rel, stream in running.values():
+                if stream is not None:
+                    stream.rest.close()
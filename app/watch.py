@@ -0,0 +1,497 @@
+"""Watch mode: keep a destination current from source change events instead of rescans.
+
+A watch walks its source once (creating any missing placeholders and registering every
+directory with the backend), then only revisits directories that changed. Each changed
+directory is merged with its destination copy exactly like a sync task does, so new,
+renamed and deleted files all end up as created or pruned placeholders, and a new
+subdirectory is walked in full. Events are debounced per directory: a large copy emits
+bursts of them, and one listing after the burst settles is enough.
+
+Backends: ``inotify`` (through libc with ctypes, no extra dependency) for local and NFS
+sources, and ``poll``, which re-checks directory mtimes every ``WATCH_POLL_SECONDS`` under
+the source rate limit, for FUSE mounts that never report remote changes.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .checkpoints import read_json, write_json_atomic
+from .config import (
+    SYNC_ORPHANS,
+    WATCH_BACKEND,
+    WATCH_DEBOUNCE_SECONDS,
+    WATCH_MAX_DELAY,
+    WATCH_POLL_SECONDS,
+)
+from .filters import FileFilter
+from .paths import fs_type_for
+from .sync import Pruner
+from .tree_index import task_key
+from .walker import DirListing, scandir_listing
+
+BACKENDS = ('auto', 'inotify', 'poll')
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+# Names appearing and disappearing is all a placeholder tree cares about; content writes
+# (IN_MODIFY) would only add load during large copies.
+WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _inotify_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def inotify_available() -> bool:
+    try:
+        return hasattr(_inotify_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+def _errno_error(path: Optional[str] = None) -> OSError:
+    code = ctypes.get_errno()
+    return OSError(code, os.strerror(code), path)
+
+
+class Inotify:
+    """Directory watches on one inotify descriptor."""
+
+    def __init__(self):
+        self._libc = _inotify_libc()
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise _errno_error()
+        self.fd = fd
+
+    def add(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise _errno_error(path)
+        return wd
+
+    def remove(self, wd: int) -> None:
+        # Fails harmlessly when the kernel already dropped the watch.
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """``(wd, mask, name)`` for every event available within ``timeout`` seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            events.append((wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b'\0'))))
+            offset += length
+        return events
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def _join(rel: str, name: str) -> str:
+    return os.path.join(rel, name) if rel else name
+
+
+def _below(rel: str, item: str) -> bool:
+    return not rel or item == rel or item.startswith(rel + os.sep)
+
+
+class InotifyBackend:
+    name = 'inotify'
+
+    def __init__(self):
+        self.inotify = Inotify()
+        self._wds: Dict[str, int] = {}
+        self._rels: Dict[int, str] = {}
+
+    @property
+    def count(self) -> int:
+        return len(self._wds)
+
+    def tracked(self, rel: str) -> bool:
+        return rel in self._wds
+
+    def track(self, rel: str, path: str) -> None:
+        wd = self.inotify.add(path)
+        previous = self._rels.get(wd)
+        if previous is not None and previous != rel:
+            # Same directory under a new name: the kernel hands back its existing watch.
+            self._wds.pop(previous, None)
+        self._wds[rel] = wd
+        self._rels[wd] = rel
+
+    def untrack(self, rel: str) -> None:
+        """Stop watching ``rel`` and everything below it (``''``: the whole tree)."""
+        for item in [item for item in self._wds if _below(rel, item)]:
+            wd = self._wds.pop(item)
+            if self._rels.get(wd) == item:
+                del self._rels[wd]
+                self.inotify.remove(wd)
+
+    def changes(self, timeout: float) -> Tuple[Set[str], bool]:
+        """Directories with events, and whether the kernel queue overflowed (events lost)."""
+        dirty: Set[str] = set()
+        overflow = False
+        for wd, mask, name in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            rel = self._rels.get(wd)
+            if rel is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._rels[wd]
+                if self._wds.get(rel) == wd:
+                    del self._wds[rel]
+                continue
+            if mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+                self.untrack(_join(rel, name))
+            dirty.add(rel)
+        return dirty, overflow
+
+    def close(self) -> None:
+        self.inotify.close()
+
+
+class PollBackend:
+    name = 'poll'
+
+    def __init__(self, root: Path, stat: Callable, interval: float, stop_event: threading.Event):
+        self.root = str(root)
+        self._stat = stat
+        self.interval = float(interval)
+        self._stop = stop_event
+        self._mtimes: Dict[str, int] = {}
+        self._next = time.monotonic() + self.interval
+
+    @property
+    def count(self) -> int:
+        return len(self._mtimes)
+
+    def tracked(self, rel: str) -> bool:
+        return rel in self._mtimes
+
+    def track(self, rel: str, path: str) -> None:
+        self._mtimes[rel] = self._stat(path).st_mtime_ns
+
+    def untrack(self, rel: str) -> None:
+        for item in [item for item in self._mtimes if _below(rel, item)]:
+            del self._mtimes[item]
+
+    def changes(self, timeout: float) -> Tuple[Set[str], bool]:
+        wait = min(timeout, self._next - time.monotonic())
+        if wait > 0 and (self._stop.wait(wait) or time.monotonic() < self._next):
+            return set(), False
+        dirty: Set[str] = set()
+        for rel, mtime_ns in list(self._mtimes.items()):
+            if self._stop.is_set():
+                break
+            try:
+                current = self._stat(os.path.join(self.root, rel) if rel else self.root).st_mtime_ns
+            except OSError:
+                # Gone: the parent's mtime moved too, and its listing prunes the rest.
+                self._mtimes.pop(rel, None)
+                continue
+            if current != mtime_ns:
+                dirty.add(rel)
+        self._next = time.monotonic() + self.interval
+        return dirty, False
+
+    def close(self) -> None:
+        pass
+
+
+class _WatchLimit(Exception):
+    """inotify ran out of watches (``fs.inotify.max_user_watches``)."""
+
+
+class Watch:
+    """One source directory kept in sync with its destination. ``host`` is the worker."""
+
+    def __init__(self, host, record: Dict):
+        self.host = host
+        self.record = record
+        self.id = record['id']
+        self.src = Path(record['src'])
+        self.dst = Path(record['dst'])
+        self.key = task_key(self.src, self.dst)
+        self.file_filter = FileFilter(record.get('filters'), videos_only=record.get('videos_only', True))
+        self.stop_event = threading.Event()
+        self.status = 'starting'
+        self.backend_name = ''
+        self.directories = 0
+        self.stats = {'dirs': 0, 'created': 0, 'skipped': 0, 'removed': 0}
+        self.last_change_at: Optional[float] = None
+        self._dirty: Dict[str, List[float]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._pruner: Optional[Pruner] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'watch-{self.id}')
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def to_dict(self) -> Dict:
+        data = dict(self.record)
+        data.update({
+            'status': self.status,
+            'backend': self.backend_name,
+            'directories': self.directories,
+            'pending': len(self._dirty),
+            'last_change_at': self.last_change_at,
+        })
+        data.update(self.stats)
+        return data
+
+    def _backend(self, preferred: str):
+        if preferred == 'auto':
+            fuse = fs_type_for(self.src).startswith('fuse')
+            preferred = 'poll' if fuse or not inotify_available() else 'inotify'
+        if preferred == 'inotify':
+            try:
+                return InotifyBackend()
+            except OSError as exc:
+                self.host.broadcast(f'[WARN] inotify unavailable for {self.src} ({exc}), polling instead')
+        return PollBackend(
+            self.src,
+            lambda path: self.host._source_call('stat', os.stat, path),
+            WATCH_POLL_SECONDS,
+            self.stop_event,
+        )
+
+    def _run(self) -> None:
+        host = self.host
+        self._pruner = Pruner(
+            self.dst,
+            host.placeholder_writer.size,
+            action=self.record.get('orphans') or SYNC_ORPHANS,
+            report=lambda action, path: host.broadcast(f'[PRUNE] {action} {path}'),
+            onerror=host.broadcast,
+            forget_tree=host.placeholder_writer.forget_tree,
+        )
+        backend = self._backend(WATCH_BACKEND if WATCH_BACKEND in BACKENDS else 'auto')
+        try:
+            while True:
+                try:
+                    self._watch(backend)
+                    return
+                except _WatchLimit:
+                    host.broadcast(
+                        f'[WARN] inotify watch limit reached for {self.src} '
+                        '(raise fs.inotify.max_user_watches), polling instead'
+                    )
+                    backend.close()
+                    backend = self._backend('poll')
+        except Exception as exc:  # noqa: BLE001 - a broken watch must not take the worker down
+            self.status = 'error'
+            host.broadcast(f'[ERROR] Watch {self.id} on {self.src} stopped: {exc}')
+        finally:
+            backend.close()
+            if self.status != 'error':
+                self.status = 'stopped'
+
+    def _watch(self, backend) -> None:
+        host = self.host
+        self.backend_name = backend.name
+        self.status = 'scanning'
+        self._dirty.clear()
+        host.broadcast(f'[WATCH] Scanning {self.src} -> {self.dst} ({backend.name})')
+        # The first pass catches up on anything that changed while nobody was watching,
+        # and registers every directory with the backend on the way.
+        self._sync('', backend)
+        if self.stop_event.is_set():
+            return
+        self.status = 'watching'
+        host.broadcast(f'[WATCH] Watching {self.src}: {backend.count} directories ({backend.name})')
+        while not self.stop_event.is_set():
+            dirty, overflow = backend.changes(self._timeout())
+            now = time.monotonic()
+            if overflow:
+                host.broadcast(f'[WARN] Change events for {self.src} overflowed, rescanning')
+                backend.untrack('')
+                dirty.add('')
+            for rel in dirty:
+                entry = self._dirty.get(rel)
+                if entry is None:
+                    self._dirty[rel] = [now, now]
+                else:
+                    entry[1] = now
+            if dirty:
+                self.last_change_at = time.time()
+            for rel in sorted(self._due(now)):
+                self._sync(rel, backend)
+
+    def _timeout(self) -> float:
+        if not self._dirty:
+            return 1.0
+        now = time.monotonic()
+        soonest = min(
+            min(last + WATCH_DEBOUNCE_SECONDS, first + WATCH_MAX_DELAY) for first, last in self._dirty.values()
+        )
+        return min(1.0, max(0.05, soonest - now))
+
+    def _due(self, now: float) -> List[str]:
+        due = [
+            rel for rel, (first, last) in self._dirty.items()
+            if now - last >= WATCH_DEBOUNCE_SECONDS or now - first >= WATCH_MAX_DELAY
+        ]
+        for rel in due:
+            del self._dirty[rel]
+        return due
+
+    def _sync(self, rel: str, backend) -> None:
+        """Merge ``rel`` with its destination, descending into subdirectories not yet watched."""
+        host = self.host
+        wants_dir = self.file_filter.wants_dir
+        stack = [rel]
+        while stack and not self.stop_event.is_set():
+            rel = stack.pop()
+            path = os.path.join(self.src, rel) if rel else str(self.src)
+            try:
+                # Watch first, then list: nothing created in between is missed.
+                backend.track(rel, path)
+                dirs, files = host._source_call('readdir', scandir_listing, path)
+            except OSError as exc:
+                if exc.errno == errno.ENOSPC and backend.name == 'inotify':
+                    raise _WatchLimit() from exc
+                # Removed meanwhile; the parent's listing prunes its placeholders.
+                backend.untrack(rel)
+                continue
+            dirs = [name for name in dirs if wants_dir(name)]
+            created, skipped, removed = host._sync_listing(
+                DirListing(path, rel, dirs, files), self.dst, self.key, self.file_filter,
+                self._pruner, self._pruner.report,
+            )
+            self.stats['dirs'] += 1
+            self.stats['created'] += created
+            self.stats['skipped'] += skipped
+            self.stats['removed'] += removed
+            for name in dirs:
+                child = _join(rel, name)
+                if not backend.tracked(child):
+                    stack.append(child)
+        self.directories = backend.count
+
+
+class WatchManager:
+    """The worker's watches, persisted in ``watches.json`` and restarted with the service."""
+
+    def __init__(self, host, root: Path):
+        self.host = host
+        self.path = Path(root) / 'watches.json'
+        self._lock = threading.Lock()
+        self._watches: Dict[str, Watch] = {}
+        self._started = False
+        data = read_json(self.path)
+        records = data.get('watches') if isinstance(data, dict) else None
+        for record in records if isinstance(records, list) else []:
+            try:
+                watch = Watch(host, record)
+            except (KeyError, TypeError, ValueError) as exc:
+                host.broadcast(f'[WARN] Ignoring invalid watch record: {exc}')
+                continue
+            self._watches[watch.id] = watch
+
+    def _persist(self) -> None:
+        # Caller holds _lock.
+        try:
+            write_json_atomic(self.path, {'watches': [watch.record for watch in self._watches.values()]})
+        except OSError as exc:
+            self.host.broadcast(f'[WARN] Cannot save watches: {exc}')
+
+    def start(self) -> None:
+        with self._lock:
+            self._started = True
+            for watch in self._watches.values():
+                watch.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._started = False
+            watches = list(self._watches.values())
+        for watch in watches:
+            watch.stop_event.set()
+        for watch in watches:
+            watch.stop()
+
+    def add(self, src: Path, dst: Path, videos_only: bool = True, filters: Optional[Dict] = None,
+            orphans: str = SYNC_ORPHANS) -> Watch:
+        record = {
+            'id': uuid.uuid4().hex[:12],
+            'src': str(src),
+            'dst': str(dst),
+            'videos_only': bool(videos_only),
+            'orphans': orphans,
+            'created_at': time.time(),
+        }
+        if filters:
+            record['filters'] = dict(filters)
+        watch = Watch(self.host, record)
+        with self._lock:
+            for other in self._watches.values():
+                if other.record['src'] == record['src'] and other.record['dst'] == record['dst']:
+                    raise ValueError(f'{src} is already watched as {other.id}')
+            self._watches[watch.id] = watch
+            self._persist()
+            if self._started:
+                watch.start()
+        return watch
+
+    def remove(self, watch_id: str) -> Optional[Dict]:
+        with self._lock:
+            watch = self._watches.pop(watch_id, None)
+            if watch is None:
+                return None
+            self._persist()
+        watch.stop()
+        self.host.broadcast(f'[WATCH] Stopped watching {watch.src}')
+        return watch.to_dict()
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            watches = list(self._watches.values())
+        return [watch.to_dict() for watch in watches]
@@ -2,44 +2,102 @@
 from __future__ import annotations
 
 import os
-import queue
 import threading
 import time
+from collections import deque
 from pathlib import Path
 from typing import Dict, List, Optional, Sequence
 
-from .config import PLACEHOLDER_SIZE, VIDEO_EXTS
+from .bulk import BulkSubmitter
+from .checkpoints import TaskStore
+from .config import (
+    CHECKPOINT_SECONDS,
+    LISTING_CACHE_NAMES,
+    LISTING_CACHE_TTL,
+    LOG_LEVEL_FILE,
+    LOG_LEVEL_SSE,
+    LOG_LEVEL_STDOUT,
+    LOG_SUMMARY_SECONDS,
+    MAX_CONCURRENT_TASKS,
+    PER_MOUNT_TASKS,
+    PROGRESS_ESTIMATE,
+    PROGRESS_REPORT_SECONDS,
+    RATE_ADAPTIVE,
+    RATE_BURST,
+    SCAN_PROCESSES,
+    SYNC_ORPHANS,
+    WALK_CHUNK_ENTRIES,
+    WALK_CONCURRENCY,
+    WRITE_RATE,
+)
+from .events import EventBus, parse_level
+from .filters import PLACEHOLDER, FileFilter, is_video
+from .listing_cache import ListingCache
+from .manifest import ManifestStore, PlanStore, PlanWriter, export_lines, group_by_dir, read_entries
 from .logging_service import ServiceLogWriter
-from .paths import discover_mount_points, is_allowed_path, path_under_root
+from .metrics import Registry
+from .paths import AllowList, MountTable, mount_point_for, path_under_root
+from .placeholders import PlaceholderWriter
+from .progress import DirectoryCounter, ProgressTracker
+from .processing import ListingProcessor
+from .ratelimit import SOURCE_OPS, RateLimiter, parse_rate
+from .scheduler import DONE, KEEP_MERGES, PAUSED, QUEUED, RUNNING, TaskQueue, TaskState
+from .schedules import JobScheduler
+from .shards import ShardRunner, recover_journals
+from .sync import ORPHAN_ACTIONS, Pruner, diff_dir, scan_dest
+from .tree_index import TreeIndex, task_key
+from .walker import DirListing, ParallelWalker
+from .watch import WatchManager
 
 
-class BackupWorker(threading.Thread):
+def _format_rate(rate: float) -> str:
+    return 'unlimited' if rate <= 0 else f'{rate:g}/s'
+
+
+class BackupWorker(ListingProcessor, threading.Thread):
     def __init__(
         self,
-        task_queue: queue.Queue,
+        task_queue: TaskQueue,
         backup_dir: Path,
         allowed_roots: Sequence[Path],
         ops_per_sec: float = 20.0,
         service_log_path: Optional[Path] = None,
         strict_allowed: bool = False,
+        walk_concurrency: int = WALK_CONCURRENCY,
+        index_path: Optional[Path] = None,
+        burst: float = RATE_BURST,
+        write_per_sec: float = WRITE_RATE,
+        adaptive: bool = RATE_ADAPTIVE,
+        max_tasks: int = MAX_CONCURRENT_TASKS,
+        per_mount_tasks: int = PER_MOUNT_TASKS,
+        mount_table: Optional[MountTable] = None,
+        scan_processes: int = SCAN_PROCESSES,
     ):
         super().__init__(daemon=True, name='backup-worker')
         self.task_queue = task_queue
         self.backup_dir = Path(backup_dir)
         self.strict_allowed = bool(strict_allowed)
+        self.walk_concurrency = max(1, int(walk_concurrency))
+        self.max_tasks = max(1, int(max_tasks))
+        self.per_mount_tasks = max(1, int(per_mount_tasks))
+        self.scan_processes = max(1, int(scan_processes))
         self.allowed_roots: List[Path] = []
         for root in allowed_roots:
             try:
                 self.allowed_roots.append(Path(root).resolve())
             except (OSError, RuntimeError):
                 continue
+        self.mount_table = mount_table if mount_table is not None else MountTable()
+        # strict_allowed=True: only configured roots (ALLOWED_ROOTS env).
+        # strict_allowed=False: configured roots plus currently discovered mounts.
+        self.allow_list = AllowList(self.allowed_roots, None if self.strict_allowed else self.mount_table)
 
-        self._clients: List[queue.Queue] = []
-        self._clients_lock = threading.RLock()
         self._stop_event = threading.Event()
-        self._current_task: Optional[Dict] = None
+        self._running: Dict[str, TaskState] = {}
         self._stats_lock = threading.RLock()
         self._last_result: Optional[Dict] = None
+        # Recent requests folded into another task, newest last (reported by /api/queue).
+        self._merges: deque = deque(maxlen=KEEP_MERGES)
 
         try:
             initial_rate = float(os.environ.get('BACKUP_RATE', str(ops_per_sec)))
@@ -47,156 +105,450 @@ class BackupWorker(threading.Thread):
             initial_rate = ops_per_sec
         self._rate_lock = threading.RLock()
         self.ops_per_sec = 0.0
-        self._delay = 0.0
+        # Schedule windows may replace the readdir/stat budget for a while; the
+        # configured rates are kept aside until the last override is released.
+        self._rate_overrides: Dict[str, float] = {}
+        self._rate_base: Optional[Dict[str, float]] = None
+        self.rate_limiter = RateLimiter(write_per_sec=write_per_sec, burst=burst, adaptive=adaptive)
+        self._init_metrics()
 
         if service_log_path is None:
             service_log_path = self.backup_dir / 'service_log.txt'
         self.service_writer = ServiceLogWriter(service_log_path)
         self.service_writer.start()
+        self.events = EventBus(
+            file_sink=self.service_writer.append,
+            file_level=parse_level(LOG_LEVEL_FILE, 20),
+            sse_level=parse_level(LOG_LEVEL_SSE, 20),
+            stdout_level=parse_level(LOG_LEVEL_STDOUT, 20),
+            summary_seconds=LOG_SUMMARY_SECONDS,
+        )
+        if index_path is None:
+            index_path = self.backup_dir / 'tree_index.sqlite3'
+        self.tree_index = TreeIndex(index_path)
+        # Shared with the browse API: a directory just opened in the panel is not
+        # listed again by the task that follows, and vice versa.
+        self.listing_cache = ListingCache(LISTING_CACHE_TTL, LISTING_CACHE_NAMES)
+        self.placeholder_writer = PlaceholderWriter(
+            self.backup_dir / 'placeholder.journal',
+            onerror=self.broadcast,
+            observe=lambda op, seconds: self.m_dest_seconds.observe(seconds, op=op),
+        )
+        repaired = self.placeholder_writer.recover()
+        repaired += recover_journals(self.backup_dir, self.placeholder_writer.size, onerror=self.broadcast)
+        if repaired:
+            self.broadcast(f'[INFO] Repaired {repaired} placeholders interrupted by a previous crash')
+        self.task_store = TaskStore(self.backup_dir)
+        self.plans = PlanStore(self.backup_dir)
+        self.manifests = ManifestStore(self.backup_dir)
+        self.watches = WatchManager(self, self.backup_dir)
+        self.schedules = JobScheduler(self, self.backup_dir)
+        self.bulk = BulkSubmitter(self)
         # Apply after logger exists so the rate change is recorded cleanly.
         self.set_rate(initial_rate)
+        self._restore_tasks()
+
+    def _init_metrics(self) -> None:
+        """Hot-path timings are recorded as they happen; gauges are read at scrape time."""
+        metrics = self.metrics = Registry()
+        self.m_source_seconds = metrics.histogram(
+            'bnetdisk_source_op_seconds', 'Latency of source mount calls (readdir, stat).')
+        self.m_dest_seconds = metrics.histogram(
+            'bnetdisk_dest_op_seconds', 'Latency of destination calls (mkdir, listdir, journal, create, checkpoint).')
+        self.m_limiter_wait = metrics.histogram(
+            'bnetdisk_ratelimit_wait_seconds', 'Time spent sleeping in the rate limiter per acquire.')
+        self.m_dirs = metrics.counter('bnetdisk_dirs_processed_total', 'Source directories processed.')
+        self.m_merged = metrics.counter(
+            'bnetdisk_tasks_merged_total', 'Task requests folded into another task, by reason.')
+        self.m_files = metrics.counter(
+            'bnetdisk_files_total', 'Source files handled, by outcome (created, skipped).')
+        metrics.gauge_callback('bnetdisk_queue_size', 'Tasks waiting in the queue.',
+                               lambda: [({}, self.task_queue.qsize())])
+        metrics.gauge_callback('bnetdisk_tasks_running', 'Tasks currently running.',
+                               lambda: [({}, len(self._running_states()))])
+        metrics.gauge_callback('bnetdisk_task_files_per_second',
+                               'Files handled per second by each running task since it started.',
+                               self._task_throughput_samples)
+        metrics.gauge_callback('bnetdisk_ratelimit_backoff', 'Adaptive backoff factor applied to source rates.',
+                               lambda: [({}, self.rate_limiter.backoff)])
+        metrics.gauge_callback('bnetdisk_sse_clients', 'Connected SSE clients.',
+                               lambda: [({}, self.events.client_count)])
+        metrics.counter_callback('bnetdisk_listing_cache_hits_total', 'Directory listings served from the cache.',
+                                 lambda: [({}, self.listing_cache.hits)])
+        metrics.counter_callback('bnetdisk_listing_cache_misses_total', 'Directory listings read from the mount.',
+                                 lambda: [({}, self.listing_cache.misses)])
+        metrics.counter_callback('bnetdisk_sse_dropped_lines_total',
+                                 'Log lines SSE clients missed because they fell behind.',
+                                 lambda: [({}, self.events.dropped)])
+        metrics.counter_callback('bnetdisk_log_dropped_lines_total',
+                                 'Log lines dropped because the service log writer queue was full.',
+                                 lambda: [({}, self.service_writer.dropped)])
+
+    def _running_states(self) -> List[TaskState]:
+        with self._stats_lock:
+            return list(self._running.values())
+
+    def _task_throughput_samples(self):
+        now = time.time()
+        for state in self._running_states():
+            elapsed = now - (state.started_at or now)
+            done = state.progress['created'] + state.progress['skipped']
+            yield {'task': state.id}, round(done / elapsed, 3) if elapsed > 0 else 0.0
+
+    def _restore_tasks(self) -> None:
+        """Re-queue tasks from the previous run; interrupted ones go first and resume."""
+        records = self.task_store.load_tasks()
+        records.sort(key=lambda record: record.get('status') not in (RUNNING, PAUSED))
+        for record in records:
+            try:
+                state = TaskState.from_record(record)
+            except (TypeError, ValueError):
+                continue
+            if not state.payload.get('src') or not state.payload.get('dst'):
+                continue
+            self.task_queue.put(state)
+            verb = 'Resuming interrupted' if record.get('status') in (RUNNING, PAUSED) else 'Restored queued'
+            self.broadcast(f'[QUEUE] {verb} task {state.id}: {state.payload["src"]} -> {state.payload["dst"]}')
+
+    def _persist_tasks(self) -> None:
+        with self._stats_lock:
+            records = [state.to_record() for state in self._running.values()]
+        records.extend(state.to_record() for state in self.task_queue.snapshot())
+        try:
+            self.task_store.save_tasks(records)
+        except OSError as exc:
+            self.broadcast(f'[WARN] Cannot save task queue: {exc}')
 
     def stop(self) -> None:
         self._stop_event.set()
+        with self._stats_lock:
+            for state in self._running.values():
+                state.stop_event.set()
+        self.task_queue.notify()
+        self.watches.stop()
+        self.schedules.stop()
+        self.bulk.stop()
         try:
             self.service_writer.stop()
         except Exception:
             pass
 
     def broadcast(self, msg: str) -> None:
-        ts = time.strftime('%Y-%m-%d %H:%M:%S')
-        line = f'{ts} {msg}'
-        writer = getattr(self, 'service_writer', None)
-        if writer is not None:
-            try:
-                writer.append(line)
-            except Exception:
-                pass
-        with self._clients_lock:
-            for client_q in list(self._clients):
-                try:
-                    client_q.put_nowait(line)
-                except queue.Full:
-                    pass
+        events = getattr(self, 'events', None)
+        if events is not None:
+            events.publish(msg)
+            return
         try:
-            print(line, flush=True)
+            print(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {msg}', flush=True)
         except Exception:
             pass
 
-    def register_client(self) -> queue.Queue:
-        client_q: queue.Queue = queue.Queue(maxsize=1000)
-        with self._clients_lock:
-            self._clients.append(client_q)
-        try:
-            client_q.put_nowait('[INFO] connected')
-            for line in self.service_writer.tail_lines(100):
-                try:
-                    client_q.put_nowait(line)
-                except queue.Full:
-                    break
-        except queue.Full:
-            pass
-        return client_q
+    def set_rate(self, ops_per_sec: float) -> float:
+        """Update the source readdir/stat budget at runtime. 0 means unlimited."""
+        return self.configure_rate(ops_per_sec=ops_per_sec)['ops_per_sec']
+
+    def configure_rate(
+        self,
+        ops_per_sec=None,
+        readdir_per_sec=None,
+        stat_per_sec=None,
+        write_per_sec=None,
+        burst=None,
+        adaptive=None,
+    ) -> Dict:
+        """Apply any subset of limiter settings; ``ops_per_sec`` sets readdir and stat together.
 
-    def unregister_client(self, client_q: queue.Queue) -> None:
-        with self._clients_lock:
+        Raises ``ValueError`` before changing anything if a value is invalid.
+        """
+        rates = {}
+        if ops_per_sec is not None:
+            rates['readdir_per_sec'] = rates['stat_per_sec'] = parse_rate(ops_per_sec)
+        if readdir_per_sec is not None:
+            rates['readdir_per_sec'] = parse_rate(readdir_per_sec)
+        if stat_per_sec is not None:
+            rates['stat_per_sec'] = parse_rate(stat_per_sec)
+        if write_per_sec is not None:
+            rates['write_per_sec'] = parse_rate(write_per_sec, maximum=100000.0)
+        if burst is not None:
             try:
-                self._clients.remove(client_q)
-            except ValueError:
-                pass
+                burst = float(burst)
+            except (TypeError, ValueError) as exc:
+                raise ValueError('invalid burst') from exc
+            if not 1 <= burst <= 10000:
+                raise ValueError('burst must be between 1 and 10000')
+        with self._rate_lock:
+            if self._rate_base is not None:
+                # A schedule override is active: remember the new source rates for later.
+                for op in SOURCE_OPS:
+                    value = rates.pop(f'{op}_per_sec', None)
+                    if value is not None:
+                        self._rate_base[op] = value
+            self.rate_limiter.configure(
+                burst=burst,
+                adaptive=None if adaptive is None else bool(adaptive),
+                **rates,
+            )
+            if ops_per_sec is not None:
+                self.ops_per_sec = parse_rate(ops_per_sec)
+            info = self.get_rate_info()
+        buckets = info['limiter']['buckets']
+        self.broadcast(
+            '[INFO] Source rate limit: '
+            f'readdir={_format_rate(buckets["readdir"]["rate"])}, '
+            f'stat={_format_rate(buckets["stat"]["rate"])}, '
+            f'write={_format_rate(buckets["write"]["rate"])}, '
+            f'burst={info["limiter"]["burst"]:g}, adaptive={info["limiter"]["adaptive"]}'
+        )
+        return info
 
-    def set_rate(self, ops_per_sec: float) -> float:
-        """Update generation speed at runtime. 0 means unlimited."""
-        try:
-            rate = float(ops_per_sec)
-        except (TypeError, ValueError) as exc:
-            raise ValueError('invalid rate') from exc
-        if rate < 0:
-            raise ValueError('rate must be >= 0')
-        # Soft upper bound protects remote mounts from accidental overload.
-        if rate > 5000:
-            rate = 5000.0
+    def override_source_rate(self, owner: str, rate: Optional[float]) -> None:
+        """Replace the readdir/stat budget while ``owner`` holds an override; ``None`` releases it.
+
+        With several overrides the lowest rate wins (0, unlimited, counts as highest).
+        """
         with self._rate_lock:
-            self.ops_per_sec = rate
-            self._delay = 0.0 if rate <= 0 else max(0.0, 1.0 / rate)
-            applied = self.ops_per_sec
-        self.broadcast(f'[INFO] Source scan rate set to {applied:g} files/sec' + (' (unlimited)' if applied <= 0 else '') + ' — protects source/cloud mounts')
-        return applied
+            if self._rate_overrides.get(owner) == rate:
+                return
+            if rate is None:
+                self._rate_overrides.pop(owner, None)
+            else:
+                self._rate_overrides[owner] = rate
+            if self._rate_overrides:
+                if self._rate_base is None:
+                    self._rate_base = {op: self.rate_limiter.buckets[op].rate for op in SOURCE_OPS}
+                limited = [value for value in self._rate_overrides.values() if value > 0]
+                effective = min(limited) if limited else 0.0
+                self.rate_limiter.configure(readdir_per_sec=effective, stat_per_sec=effective)
+                message = f'[SCHEDULE] Source rate for schedule window: readdir/stat={_format_rate(effective)}'
+            elif self._rate_base is not None:
+                base, self._rate_base = self._rate_base, None
+                self.rate_limiter.configure(readdir_per_sec=base['readdir'], stat_per_sec=base['stat'])
+                message = (
+                    '[SCHEDULE] Schedule window rate released: '
+                    f'readdir={_format_rate(base["readdir"])}, stat={_format_rate(base["stat"])}'
+                )
+            else:
+                return
+        self.broadcast(message)
 
     def get_rate(self) -> float:
         with self._rate_lock:
             return float(self.ops_per_sec)
 
-    def _sleep_for_rate(self) -> None:
+    def get_rate_info(self) -> Dict:
         with self._rate_lock:
-            delay = self._delay
-        if delay > 0:
-            time.sleep(delay)
+            overrides = dict(self._rate_overrides)
+        return {
+            'ops_per_sec': self.get_rate(),
+            'limiter': self.rate_limiter.snapshot(),
+            'schedule_overrides': overrides,
+        }
 
     def get_status(self) -> Dict:
         with self._stats_lock:
-            current = self._current_task
+            running = [state.to_dict() for state in self._running.values()]
             last_result = self._last_result
+        running.sort(key=lambda item: item['started_at'] or 0)
         return {
             'running': not self._stop_event.is_set(),
             'queue_size': self.task_queue.qsize(),
-            'current': current,
+            # Oldest running task, kept for clients that only know about one.
+            'current': running[0] if running else None,
+            'tasks': running,
+            'max_tasks': self.max_tasks,
+            'per_mount_tasks': self.per_mount_tasks,
             'last_result': last_result,
             'ops_per_sec': self.get_rate(),
+            'walk_concurrency': self.walk_concurrency,
+            'placeholder_strategies': self.placeholder_writer.strategies(),
+            'watches': self.watches.snapshot(),
+            'schedules': self.schedules.snapshot(),
             'videos_only': True,
         }
 
+    def get_queue(self) -> List[Dict]:
+        return [state.to_dict() for state in self.task_queue.snapshot()]
+
+    def get_merges(self) -> List[Dict]:
+        return list(self._merges)
+
+    def _find_task(self, task_id: str) -> Optional[TaskState]:
+        with self._stats_lock:
+            state = self._running.get(task_id)
+        return state or self.task_queue.get(task_id)
+
+    def cancel_task(self, task_id: str) -> Optional[Dict]:
+        state = self.task_queue.remove(task_id)
+        if state is None:
+            with self._stats_lock:
+                state = self._running.get(task_id)
+            if state is None:
+                return None
+        state.cancel()
+        self.task_store.delete_checkpoint(task_id)
+        self._persist_tasks()
+        self.broadcast(f'[CANCEL] Task {task_id}: {state.payload.get("src")}')
+        return state.to_dict()
+
+    def pause_task(self, task_id: str) -> Optional[Dict]:
+        state = self._find_task(task_id)
+        if state is None:
+            return None
+        state.pause()
+        self._persist_tasks()
+        self.broadcast(f'[PAUSE] Task {task_id}: {state.payload.get("src")}')
+        return state.to_dict()
+
+    def resume_task(self, task_id: str) -> Optional[Dict]:
+        state = self._find_task(task_id)
+        if state is None:
+            return None
+        state.resume()
+        self.task_queue.notify()
+        self._persist_tasks()
+        self.broadcast(f'[RESUME] Task {task_id}: {state.payload.get("src")}')
+        return state.to_dict()
+
+    def add_watch(
+        self,
+        src: Path,
+        dst: Path,
+        videos_only: bool = True,
+        orphans: str = SYNC_ORPHANS,
+        filters: Optional[Dict] = None,
+    ) -> Dict:
+        """Start keeping ``dst`` current from changes under ``src``. Raises ``ValueError``
+        if the pair is already watched."""
+        watch = self.watches.add(
+            src, dst, videos_only=videos_only,
+            filters=filters, orphans=orphans if orphans in ORPHAN_ACTIONS else 'quarantine',
+        )
+        self.broadcast(f'[WATCH] Added watch {watch.id}: {src} -> {dst}')
+        return watch.to_dict()
+
+    def remove_watch(self, watch_id: str) -> Optional[Dict]:
+        return self.watches.remove(watch_id)
+
+    def get_watches(self) -> List[Dict]:
+        return self.watches.snapshot()
+
+    def add_schedule(self, task: Dict, every=None, cron=None, window=None, rate=None) -> Dict:
+        """Register a recurring job for the ``add_task`` arguments in ``task``. Raises
+        ``ValueError`` for an invalid trigger, window or rate."""
+        job = self.schedules.add(task, every=every, cron=cron, window=window, rate=rate)
+        trigger = f'cron "{job["cron"]}"' if job['cron'] else f'every {job["every"]}'
+        window_text = f', window {job["window"]}' if job['window'] else ''
+        self.broadcast(f'[SCHEDULE] Added job {job["id"]}: {task["src"]} -> {task["dst"]} ({trigger}{window_text})')
+        return job
+
+    def remove_schedule(self, job_id: str) -> Optional[Dict]:
+        job = self.schedules.remove(job_id)
+        if job is not None:
+            self.broadcast(f'[SCHEDULE] Removed job {job_id}')
+        return job
+
+    def set_schedule_enabled(self, job_id: str, enabled: bool) -> Optional[Dict]:
+        return self.schedules.set_enabled(job_id, enabled)
+
+    def run_schedule(self, job_id: str) -> Optional[Dict]:
+        return self.schedules.run_now(job_id)
+
+    def get_schedules(self) -> List[Dict]:
+        return self.schedules.snapshot()
+
+    def submit_bulk(self, payload: Dict) -> Dict:
+        """Accept a bulk batch for background validation. Raises ``ValueError`` if malformed."""
+        batch = self.bulk.submit(payload)
+        self.broadcast(f'[BULK] Batch {batch["id"]}: {batch["requested"]} tasks, {len(batch["expand"])} to expand')
+        return batch
+
+    def get_bulk(self, batch_id: str) -> Optional[Dict]:
+        return self.bulk.get(batch_id)
+
+    def get_bulk_batches(self) -> List[Dict]:
+        return self.bulk.snapshot()
+
+    def get_plans(self) -> List[Dict]:
+        return self.plans.list()
+
+    def get_plan(self, plan_id: str) -> Optional[Dict]:
+        return self.plans.get(plan_id)
+
+    def delete_plan(self, plan_id: str) -> Optional[Dict]:
+        meta = self.plans.get(plan_id)
+        if meta is not None and meta.get('status') == 'running':
+            raise ValueError('plan is still running')
+        return self.plans.delete(plan_id)
+
+    def apply_plan(self, plan_id: str, priority: int = 0) -> Optional[TaskState]:
+        """Queue a task that applies a finished plan. Raises ``ValueError`` if it is unfinished."""
+        meta = self.plans.get(plan_id)
+        if meta is None:
+            return None
+        if meta.get('status') != 'done':
+            raise ValueError(f'plan is {meta.get("status")}, only finished plans can be applied')
+        return self.add_task(
+            Path(meta['src']), Path(meta['dest_root']),
+            videos_only=bool(meta.get('videos_only', True)), mode='apply', priority=priority,
+            filters=meta.get('filters'), plan=meta['id'],
+        )
+
+    def upload_manifest(self, stream, fmt: Optional[str] = None, name: str = '') -> Dict:
+        """Store an uploaded file listing. Raises ``ValueError`` for an unknown format."""
+        meta = self.manifests.save_upload(stream, fmt, name)
+        self.broadcast(f'[MANIFEST] Uploaded {meta["id"]} ({meta["format"]}, {meta["bytes"]} bytes)')
+        return meta
+
+    def get_manifests(self) -> List[Dict]:
+        return self.manifests.list()
+
+    def delete_manifest(self, manifest_id: str) -> Optional[Dict]:
+        return self.manifests.delete(manifest_id)
+
+    def import_manifest(self, manifest_id: str, dst: Path, src: Optional[str] = None, videos_only: bool = True,
+                        filters: Optional[Dict] = None, priority: int = 0) -> Optional[TaskState]:
+        """Queue a task that builds placeholders under ``dst`` from an uploaded manifest."""
+        meta = self.manifests.get(manifest_id)
+        if meta is None:
+            return None
+        # The source only labels the task (and roots companion paths); it is never listed.
+        return self.add_task(
+            Path(src or f'manifest:{manifest_id}'), dst, videos_only=videos_only, mode='import',
+            priority=priority, filters=filters, manifest=meta['id'],
+        )
+
+    def get_walks(self) -> List[Dict]:
+        return self.tree_index.completed_runs()
+
+    def export_walk(self, src: str, dest_root: str, fmt: str = 'ndjson'):
+        """Encoded chunks of the file manifest of a completed walk, or ``None`` if there is none."""
+        key = task_key(Path(src), Path(dest_root))
+        if self.tree_index.last_run(key) is None:
+            return None
+        return export_lines(self.tree_index.iter_snapshot(key), fmt)
+
+    def query_logs(self, limit: int, before: Optional[str] = None, min_level: int = 0,
+                   search: Optional[str] = None, task_id: Optional[str] = None) -> Dict:
+        """Page backwards through the service log; raises ValueError for a bad cursor."""
+        terms = None
+        if task_id:
+            # Task lines carry the id, progress lines only the paths below the source.
+            state = self._find_task(task_id)
+            terms = [task_id] + ([state.payload['src']] if state and state.payload.get('src') else [])
+        return self.service_writer.query(limit, before, min_level, search, terms)
+
     def _is_allowed_path(self, path: Path) -> bool:
-        # strict_allowed=True: only configured roots (ALLOWED_ROOTS env).
-        # strict_allowed=False: configured roots plus currently discovered mounts.
-        if self.strict_allowed:
-            return is_allowed_path(path, self.allowed_roots)
-        return is_allowed_path(path, self.allowed_roots, discover_mount_points())
+        return self.allow_list.allows(path)
 
     @staticmethod
     def is_video_file(filename: str) -> bool:
-        return Path(filename).suffix.lower() in VIDEO_EXTS
+        return is_video(filename)
 
     def should_skip(self, filename: str, videos_only: bool = True) -> bool:
         if videos_only:
             return not self.is_video_file(filename)
         return False
 
-    def _create_placeholder(self, dest_file: Path, overwrite: bool = False) -> str:
-        """Create or refresh a 1KB placeholder.
-
-        Returns:
-            'created'  - new placeholder written
-            'exists'   - already present and left untouched (incremental)
-            'failed'   - write error
-        """
-        try:
-            if dest_file.exists() and not overwrite:
-                return 'exists'
-        except OSError:
-            pass
-
-        try:
-            dest_file.parent.mkdir(parents=True, exist_ok=True)
-        except OSError as exc:
-            self.broadcast(f'[ERROR] Cannot create parent directories for {dest_file}: {exc}')
-            return 'failed'
-
-        tmp = dest_file.parent / f'.{dest_file.name}.{os.getpid()}.{threading.get_ident()}.tmp'
-        try:
-            with tmp.open('wb') as handle:
-                handle.write(b'\0' * PLACEHOLDER_SIZE)
-            os.replace(str(tmp), str(dest_file))
-            return 'created'
-        except OSError as exc:
-            try:
-                if tmp.exists():
-                    tmp.unlink()
-            except OSError:
-                pass
-            self.broadcast(f'[ERROR] Failed to create placeholder {dest_file}: {exc}')
-            return 'failed'
-
     def add_task(
         self,
         src: Path,
@@ -204,7 +556,20 @@ class BackupWorker(threading.Thread):
         videos_only: bool = True,
         mirror: bool = False,
         mode: str = 'incremental',
-    ) -> None:
+        priority: int = 0,
+        dry_run: bool = False,
+        orphans: str = SYNC_ORPHANS,
+        filters: Optional[Dict] = None,
+        persist: bool = True,
+        plan: Optional[str] = None,
+        manifest: Optional[str] = None,
+        merges: Optional[List[Dict]] = None,
+    ) -> TaskState:
+        """Queue a task, or fold it into a queued or running task that already does its work.
+
+        Returns the task that will do the work; the merge records made are appended to
+        ``merges``. ``persist=False`` leaves saving the queue to the caller (bulk adds).
+        """
         payload = {
             'src': str(src),
             'dst': str(dst),
@@ -212,44 +577,142 @@ class BackupWorker(threading.Thread):
             'mirror': bool(mirror),
             'mode': str(mode),
         }
-        self.task_queue.put(payload)
-        self.broadcast(
-            f'[QUEUE] Added task: {src} -> {dst} '
-            f'(mode={mode}, videos_only={videos_only})'
-        )
+        if filters:
+            payload['filters'] = dict(filters)
+        if mode == 'sync':
+            payload['dry_run'] = bool(dry_run)
+            payload['orphans'] = orphans if orphans in ORPHAN_ACTIONS else 'quarantine'
+        if mode == 'apply':
+            payload['plan'] = str(plan)
+        if mode == 'import':
+            payload['manifest'] = str(manifest)
+        try:
+            mount = mount_point_for(Path(src), self.mount_table.points())
+        except Exception:  # noqa: BLE001 - fall back to one shared slot
+            mount = '/'
+        request = TaskState(payload, priority=priority, mount=mount)
+        with self._stats_lock:
+            # Held so that no queued task starts, and no running one ends, while we look.
+            state, made = self.task_queue.coalesce(request, list(self._running.values()), self._reaches)
+        if state is request:
+            self.broadcast(
+                f'[QUEUE] Added task {state.id}: {src} -> {dst} '
+                f'(mode={mode}, videos_only={videos_only}, priority={priority})'
+            )
+        for merge in made:
+            if merge['reason'] == 'absorbed':
+                # The absorbed task was queued before; its walk restarts inside this one.
+                self.task_store.delete_checkpoint(merge['id'])
+            self._merges.append(merge)
+            self.m_merged.inc(reason=merge['reason'])
+            self.broadcast(
+                f'[QUEUE] Merged {merge["src"]} -> {merge["dst"]} into task {merge["into"]} '
+                f'({merge["reason"]}, mode={state.payload.get("mode")})'
+            )
+        if merges is not None:
+            merges.extend(made)
+        if persist:
+            self._persist_tasks()
+        return state
+
+    def _reaches(self, state: TaskState, rel: str) -> bool:
+        """Whether ``state``'s walk has yet to list ``rel`` (relative to its source).
+
+        A queued task walks everything unless it resumes from a checkpoint; a running
+        one only what is left in its frontier.
+        """
+        if state.stop_event.is_set():
+            return False
+        if state.status == QUEUED:
+            checkpoint = self.task_store.load_checkpoint(state.id)
+            if checkpoint is None:
+                return True
+            frontier = checkpoint.get('frontier')
+        else:
+            try:
+                frontier = state.frontier() if state.frontier is not None else None
+            except RuntimeError:  # the walk changed its frontier while we read it
+                frontier = None
+        if not isinstance(frontier, list):
+            return False
+        return any(not pending or rel == pending or rel.startswith(pending + '/') for pending in frontier)
+
+    def _can_start(self, state: TaskState) -> bool:
+        # Caller holds _stats_lock.
+        same_mount = sum(1 for item in self._running.values() if item.mount == state.mount)
+        return same_mount < self.per_mount_tasks
 
     def run(self) -> None:
         self.broadcast('[INFO] Worker started')
+        self.watches.start()
+        self.schedules.start()
+        self.bulk.start()
         while not self._stop_event.is_set():
-            try:
-                task = self.task_queue.get(timeout=1)
-            except queue.Empty:
+            started = False
+            with self._stats_lock:
+                if len(self._running) < self.max_tasks:
+                    state = self.task_queue.pop_runnable(self._can_start)
+                    if state is not None:
+                        state.status = RUNNING
+                        state.started_at = time.time()
+                        self._running[state.id] = state
+                        started = True
+            if started:
+                self._persist_tasks()
+                threading.Thread(
+                    target=self._run_task,
+                    args=(state,),
+                    daemon=True,
+                    name=f'task-{state.id}',
+                ).start()
                 continue
-            try:
-                self._process_task(task)
-            finally:
-                self.task_queue.task_done()
+            self.task_queue.wait(1)
 
-    def _process_task(self, task: Dict) -> None:
+    def _run_task(self, state: TaskState) -> None:
+        try:
+            self._process_task(state.payload, state)
+        except Exception as exc:  # noqa: BLE001 - keep scheduler alive
+            self.broadcast(f'[ERROR] Task {state.id} crashed: {exc}')
+        finally:
+            with self._stats_lock:
+                self._running.pop(state.id, None)
+            self.task_queue.notify()
+            # Shutting down: leave the task and its checkpoint on disk to resume later.
+            if not self._stop_event.is_set():
+                if not state.cancelled:
+                    state.status = DONE
+                self.task_store.delete_checkpoint(state.id)
+                self._persist_tasks()
+
+    def _process_task(self, task: Dict, state: Optional[TaskState] = None) -> None:
         src = Path(task.get('src', ''))
         dst = Path(task.get('dst', ''))
         videos_only = bool(task.get('videos_only', True))
         mirror = bool(task.get('mirror', False))
         mode = task.get('mode', 'incremental') or 'incremental'
+        sync = mode == 'sync'
+        dry_run = sync and bool(task.get('dry_run', False))
+        plan = mode == 'plan'
 
-        with self._stats_lock:
-            self._current_task = {
-                'src': str(src),
-                'dst': str(dst),
-                'mode': mode,
-                'videos_only': videos_only,
-            }
+        stop_event = state.stop_event if state is not None else self._stop_event
+        if mode == 'apply':
+            self._apply_plan(task, state, stop_event)
+            return
+        if mode == 'import':
+            self._import_manifest(task, state, stop_event)
+            return
 
         self.broadcast(
             f'[START] {src} -> {dst} '
             f'(videos_only={videos_only}, mirror={mirror}, mode={mode})'
         )
 
+        try:
+            file_filter = FileFilter(task.get('filters'), videos_only=videos_only)
+        except ValueError as exc:
+            self.broadcast(f'[WARN] Invalid filters for {src}: {exc}')
+            self._finish(None)
+            return
         if not self._is_allowed_path(src):
             self.broadcast(f'[WARN] Source not allowed: {src}')
             self._finish(None)
@@ -264,7 +727,9 @@ class BackupWorker(threading.Thread):
             return
 
         try:
-            dst.mkdir(parents=True, exist_ok=True)
+            # A plan must not write anything to the destination, not even its root.
+            if not plan:
+                dst.mkdir(parents=True, exist_ok=True)
         except OSError as exc:
             self.broadcast(f'[WARN] Cannot create destination {dst}: {exc}')
             self._finish(None)
@@ -295,49 +760,508 @@ class BackupWorker(threading.Thread):
 
         backed = 0
         skipped = 0
+        removed = 0
         overwrite = mode == 'full'
 
-        for dirpath, _dirnames, filenames in os.walk(src):
-            if self._stop_event.is_set():
-                break
-            rel = os.path.relpath(dirpath, src)
-            rel = '' if rel == '.' else rel
-            for fname in filenames:
-                try:
-                    # Rate limit is keyed off SOURCE directory walking/reads.
-                    # Even skipped files cost readdir + metadata on remote mounts.
-                    if self.should_skip(fname, videos_only=videos_only):
-                        skipped += 1
-                        continue
-                    src_file = Path(dirpath) / fname
-                    target_file = dest_root / rel / fname
-                    outcome = self._create_placeholder(target_file, overwrite=overwrite)
-                    if outcome == 'created':
-                        backed += 1
-                        self.broadcast(f'[OK] {src_file} -> {target_file}')
-                    elif outcome == 'exists':
-                        skipped += 1
-                    else:
-                        skipped += 1
-                except Exception as exc:  # noqa: BLE001 - keep worker alive
-                    self.broadcast(f'[ERROR] processing file {fname}: {exc}')
-                    skipped += 1
-                finally:
-                    # Throttle after every source file examined to avoid hammering cloud mounts.
-                    self._sleep_for_rate()
+        key = task_key(src, dest_root)
+        fast = mode == 'fast' and self.tree_index.has_snapshot(key, file_filter.fingerprint)
+        if mode == 'fast' and not fast:
+            if self.tree_index.has_snapshot(key):
+                self.broadcast(
+                    f'[INFO] Filters of {src} changed since its index was taken, running a regular incremental walk'
+                )
+            else:
+                self.broadcast(f'[INFO] No index for {src} yet, running a regular incremental walk')
+
+        checkpoint = self._load_checkpoint(state, src, dest_root)
+        start = None
+        dirs_done = 0
+        if checkpoint is not None:
+            # Keep the index rows staged before the interruption; they describe
+            # directories this run will not visit again.
+            start = checkpoint['frontier']
+            dirs_done = int(checkpoint.get('dirs_done', 0))
+            backed = int(checkpoint.get('backed', 0))
+            skipped = int(checkpoint.get('skipped', 0))
+            removed = int(checkpoint.get('removed', 0))
+            self.broadcast(
+                f'[RESUME] {src}: {dirs_done} directories already done, {len(start)} left in the frontier'
+            )
+        else:
+            self.tree_index.begin_run(key)
+        sharded = self.scan_processes > 1 and mode in ('incremental', 'full')
+        # Sync merges whole listings and shard planning needs every top-level directory,
+        # so only the plain walk streams large directories.
+        chunk_size = 0 if sync or sharded else WALK_CHUNK_ENTRIES
+        list_dir, seen = self._indexed_lister(str(src), key, fast, file_filter, chunk_size)
+        if checkpoint is not None:
+            seen['files'] = int(checkpoint.get('files_seen', 0))
+        tracker = counter = None
+        if state is not None:
+            tracker = ProgressTracker(state.progress, self.placeholder_writer.size)
+            tracker.update(dirs_done, seen['files'], backed, skipped)
+            counter = self._start_estimate(tracker, key, src, file_filter, stop_event)
+
+        walker = ParallelWalker(
+            concurrency=self.walk_concurrency,
+            list_dir=list_dir,
+            onerror=lambda path, exc: self.broadcast(f'[WARN] Cannot list {path}: {exc}'),
+            stop_event=stop_event,
+        )
+        frontier = walker.frontier
+        shards = None
+        if sharded:
+            shards = ShardRunner(self, key, {
+                'src': str(src),
+                'dest_root': str(dest_root),
+                'filters': file_filter.spec,
+                'videos_only': videos_only,
+                'overwrite': overwrite,
+                'concurrency': self.walk_concurrency,
+                'backup_dir': str(self.backup_dir),
+                'size': self.placeholder_writer.size,
+                'strategy': self.placeholder_writer.strategy,
+                'chunk_size': WALK_CHUNK_ENTRIES,
+            }, self.scan_processes, stop_event, state, seen)
+            frontier = shards.frontier
+        self.placeholder_writer.forget_dirs()
+        last_checkpoint = time.monotonic()
+        if state is not None:
+            state.frontier = frontier
+
+        pruner = None
+        report_path = None
+        report_file = None
+        plan_id = None
+        plan_writer = None
+        if plan:
+            plan_id = state.id if state is not None else time.strftime('%Y%m%d-%H%M%S')
+            plan_writer = PlanWriter(
+                self.plans.manifest_path(plan_id),
+                {'plan': plan_id, 'src': str(src), 'dest_root': str(dest_root),
+                 'videos_only': videos_only, 'filters': file_filter.spec,
+                 'placeholder_size': self.placeholder_writer.size, 'created_at': time.time()},
+                str(dest_root),
+                self.placeholder_writer.size,
+                resume=checkpoint.get('plan') if checkpoint is not None else None,
+            )
+            self.plans.save(plan_id, status='running', src=str(src), dest_root=str(dest_root),
+                            videos_only=videos_only, filters=file_filter.spec)
+        if sync:
+            if dry_run:
+                report_path = self._report_path(state)
+                report_path.parent.mkdir(parents=True, exist_ok=True)
+                report_file = open(report_path, 'a' if checkpoint is not None else 'w', encoding='utf-8')
+
+            def report(action: str, path: str) -> None:
+                if report_file is not None:
+                    report_file.write(f'{action}\t{path}\n')
+                else:
+                    self.broadcast(f'[PRUNE] {action} {path}')
+
+            pruner = Pruner(
+                dest_root,
+                self.placeholder_writer.size,
+                action=task.get('orphans') or SYNC_ORPHANS,
+                dry_run=dry_run,
+                report=report,
+                onerror=self.broadcast,
+                forget_tree=self.placeholder_writer.forget_tree,
+            )
+
+        def save_checkpoint() -> None:
+            started = time.monotonic()
+            try:
+                self.task_store.save_checkpoint(state.id, {
+                    'src': str(src),
+                    'dest_root': str(dest_root),
+                    'mode': mode,
+                    'frontier': frontier(),
+                    'dirs_done': dirs_done,
+                    'files_seen': seen['files'],
+                    'backed': backed,
+                    'skipped': skipped,
+                    'removed': removed,
+                    'plan': plan_writer.checkpoint() if plan_writer is not None else None,
+                    'saved_at': time.time(),
+                })
+            except OSError as exc:
+                self.broadcast(f'[WARN] Cannot save checkpoint for {src}: {exc}')
+            self.m_dest_seconds.observe(time.monotonic() - started, op='checkpoint')
+
+        def outcomes():
+            if shards is not None:
+                yield from self._sharded_outcomes(shards, src, start, list_dir, dest_root, key, file_filter, overwrite)
+                return
+            for listing in walker.walk(str(src), start=start):
+                if state is not None:
+                    state.wait_if_paused()
+                # Later chunks of a large directory are not new directories.
+                new_dir = int(not listing.chunk)
+                if pruner is not None:
+                    yield self._sync_listing(listing, dest_root, key, file_filter, pruner, report) + (new_dir,)
+                elif plan_writer is not None:
+                    yield self._plan_listing(listing, dest_root, file_filter, plan_writer) + (0, new_dir)
+                else:
+                    yield self._process_listing(listing, dest_root, key, file_filter, overwrite) + (0, new_dir)
+
+        try:
+            for created, passed, pruned, new_dir in outcomes():
+                removed += pruned
+                backed += created
+                skipped += passed
+                dirs_done += new_dir
+                if new_dir:
+                    self.m_dirs.inc()
+                if created:
+                    self.m_files.inc(created, outcome='created')
+                if passed:
+                    self.m_files.inc(passed, outcome='skipped')
+                if tracker is not None:
+                    tracker.update(dirs_done, seen['files'], backed, skipped)
+                    if tracker.due(PROGRESS_REPORT_SECONDS):
+                        self.broadcast(f'[ETA] Task {state.id} {src}: {tracker.describe()}')
+                # Only between listings is the frontier exactly "what is left to do".
+                if state is not None and time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                    save_checkpoint()
+                    last_checkpoint = time.monotonic()
+        finally:
+            if counter is not None:
+                counter.stop()
+            if state is not None:
+                state.frontier = None
+        interrupted = stop_event.is_set() and state is not None and not state.cancelled
+        if interrupted:
+            save_checkpoint()
+        if report_file is not None:
+            report_file.close()
+        plan_summary = None
+        if plan_writer is not None:
+            if stop_event.is_set():
+                plan_writer.close()
+                self.plans.save(plan_id, status='interrupted' if interrupted else 'cancelled')
+            else:
+                plan_summary = plan_writer.totals(dirs_done, seen['files'])
+                plan_writer.close(plan_summary)
+                self.plans.save(plan_id, status='done', summary=plan_summary, finished_at=time.time())
+        try:
+            if (dry_run or plan) and not interrupted:
+                # Nothing was created, so the index must not claim this tree is done.
+                self.tree_index.abort_run(key)
+            elif not stop_event.is_set():
+                self.tree_index.commit_run(key, time.time(), seen['files'], file_filter.fingerprint)
+            elif not interrupted:
+                self.tree_index.abort_run(key)
+            # An interrupted run keeps its staged index rows for the resumed run.
+        except Exception as exc:  # noqa: BLE001 - index is an optimisation only
+            self.broadcast(f'[WARN] Could not update tree index for {src}: {exc}')
 
         result = {
+            'id': state.id if state is not None else None,
             'src': str(src),
             'dst': str(dest_root),
             'backed': backed,
             'skipped': skipped,
             'mode': mode,
+            'cancelled': bool(state is not None and state.cancelled),
         }
-        self.broadcast(f'[DONE] {src} -> {dest_root} (backed={backed}, skipped={skipped})')
+        if sync:
+            result.update({'removed': removed, 'dry_run': dry_run, 'report': str(report_path) if report_path else None})
+        if plan:
+            result.update({'plan': plan_id, 'summary': plan_summary})
+        self.events.flush_summary()
+        if interrupted:
+            tag = '[STOP]'
+        elif stop_event.is_set():
+            tag = '[CANCELLED]'
+        else:
+            tag = '[DONE]'
+        summary = f'backed={backed}, skipped={skipped}'
+        if plan_summary is not None:
+            summary = (
+                f'plan {plan_id}: create={plan_summary["create"]}, copy={plan_summary["copy"]}, '
+                f'exists={plan_summary["exists"]}, new_dirs={plan_summary["new_dirs"]}, '
+                f'inodes={plan_summary["inodes"]}, bytes={plan_summary["bytes"]}'
+            )
+        elif plan:
+            summary = f'plan {plan_id}: planned={backed} so far'
+        if sync:
+            summary += f', removed={removed}'
+            if dry_run:
+                summary += f', dry run report: {report_path}'
+        self.broadcast(f'{tag} {src} -> {dest_root} ({summary})')
+        self._finish(result)
+
+    def _start_estimate(self, tracker, key, src, file_filter, stop_event) -> Optional[DirectoryCounter]:
+        """Give the tracker a total from the last run, or start a counting pass for one."""
+        if PROGRESS_ESTIMATE == 'off':
+            return None
+        try:
+            last = self.tree_index.last_run(key)
+        except Exception:  # noqa: BLE001 - index is an optimisation only
+            last = None
+        if last is not None:
+            tracker.set_total(last.dir_count, last.file_count, 'previous_run')
+            return None
+        if PROGRESS_ESTIMATE != 'count':
+            return None
+        tracker.set_basis('counting')
+        counter = DirectoryCounter(self.rate_limiter, str(src), file_filter.wants_dir, stop_event, tracker.set_total)
+        counter.start()
+        return counter
+
+    def _sharded_outcomes(self, shards, src, start, list_dir, dest_root, key, file_filter, overwrite):
+        """Handle the root directory here, then every top-level subtree in a shard process.
+
+        Yields ``(created, skipped, removed, new_dir)`` per listing, like the walker loop.
+        """
+        if start is None:
+            try:
+                dirs, files = list_dir(str(src))
+            except OSError as exc:
+                self.broadcast(f'[WARN] Cannot list {src}: {exc}')
+                return
+            # Planned before the root is reported, so a checkpoint taken right after it
+            # already lists every shard.
+            shards.plan(dirs)
+            yield self._process_listing(DirListing(str(src), '', dirs, files), dest_root, key, file_filter, overwrite) + (0, 1)
+        else:
+            shards.plan(start)
+        self.broadcast(
+            f'[INFO] Scanning {len(shards.frontier())} top-level directories of {src} '
+            f'in {shards.processes} processes'
+        )
+        for created, skipped, new_dir in shards.run():
+            yield created, skipped, 0, new_dir
+
+    def _sync_listing(self, listing, dest_root: Path, key: str, file_filter: FileFilter, pruner: Pruner, report):
+        """Merge one source directory with its destination copy. Returns (created, skipped, removed)."""
+        dirpath, rel, dirnames, filenames, _chunk = listing
+        dest_dir = os.path.join(dest_root, rel) if rel else str(dest_root)
+        placeholders, companions = self._select(dirpath, filenames, file_filter)
+        wanted = sorted(placeholders + companions)
+        skipped = len(filenames) - len(wanted)
+        companion_set = set(companions)
+
+        def owned(name: str) -> bool:
+            return file_filter.classify(name) is not None
+
+        started = time.monotonic()
+        dest_dirs, dest_files = scan_dest(dest_dir)
+        self.m_dest_seconds.observe(time.monotonic() - started, op='listdir')
+        diff = diff_dir(sorted(dirnames), wanted, dest_dirs, dest_files, owned)
+
+        removed = pruner.prune_files(dest_dir, diff.orphan_files)
+        for name in diff.orphan_dirs:
+            removed += pruner.prune_tree(os.path.join(dest_dir, name), owned)
+        skipped += len(diff.existing)
+        if not diff.missing:
+            return 0, skipped, removed
+        if pruner.dry_run:
+            for name in diff.missing:
+                report('copy' if name in companion_set else 'create', os.path.join(dest_dir, name))
+            return len(diff.missing), skipped, removed
+        missing_placeholders = [name for name in diff.missing if name not in companion_set]
+        missing_companions = [name for name in diff.missing if name in companion_set]
+        created, passed = self._write_placeholders(
+            dirpath, rel, dest_dir, key, missing_placeholders, False, diff.existing,
+        )
+        copied, not_copied = self._copy_companions(
+            dirpath, rel, dest_dir, key, missing_companions, False, diff.existing,
+        )
+        return created + copied, skipped + passed + not_copied, removed
+
+    def _plan_listing(self, listing, dest_root: Path, file_filter: FileFilter, plan: PlanWriter):
+        """Record what one source directory (or chunk) needs at the destination.
+
+        The destination directory is listed once (a chunk checks only its own names).
+        Returns (planned, not planned).
+        """
+        dirpath, rel, _dirnames, filenames, chunk = listing
+        placeholders, companions = self._select(dirpath, filenames, file_filter)
+        filtered = len(filenames) - len(placeholders) - len(companions)
+        if not placeholders and not companions:
+            plan.add(rel, [], [], 0, filtered)
+            return 0, filtered
+        dest_dir = os.path.join(dest_root, rel) if rel else str(dest_root)
+        started = time.monotonic()
+        if chunk is not None:
+            existing = self._dest_present(dest_dir, placeholders + companions)
+        else:
+            existing = set(scan_dest(dest_dir)[1])
+        self.m_dest_seconds.observe(time.monotonic() - started, op='listdir')
+        create = [name for name in placeholders if name not in existing]
+        copy = [name for name in companions if name not in existing]
+        exists = len(placeholders) + len(companions) - len(create) - len(copy)
+        plan.add(rel, create, copy, exists, filtered)
+        return len(create) + len(copy), exists + filtered
+
+    def _apply_plan(self, task: Dict, state: Optional[TaskState], stop_event: threading.Event) -> None:
+        """Create what a finished plan recorded, without listing the source again.
+
+        Placeholders are purely local work; companions are still read from the source.
+        Names that exist by now are skipped, so an interrupted apply simply runs again.
+        """
+        plan_id = str(task.get('plan') or '')
+        src = Path(task.get('src', ''))
+        dest_root = Path(task.get('dst', ''))
+        self.broadcast(f'[START] Applying plan {plan_id}: {src} -> {dest_root}')
+        meta = self.plans.get(plan_id)
+        if meta is None or meta.get('status') != 'done':
+            self.broadcast(f'[WARN] Plan {plan_id} is missing or unfinished, nothing applied')
+            self._finish(None)
+            return
+        summary = meta.get('summary') or {}
+
+        def batches():
+            for record in self.plans.records(plan_id):
+                yield str(record.get('dir', '')), list(record.get('create') or ()), list(record.get('copy') or ())
+
+        totals = (summary.get('dirs', 0), summary.get('create', 0) + summary.get('copy', 0), 'plan')
+        result = self._write_batches(f'plan {plan_id}', src, dest_root, batches(), state, stop_event, totals)
+        if result is None:
+            return
+        if not stop_event.is_set():
+            self.plans.save(plan_id, applied_at=time.time(), applied_by=state.id if state is not None else None)
+        result.update(mode='apply', plan=plan_id)
         self._finish(result)
 
+    def _import_manifest(self, task: Dict, state: Optional[TaskState], stop_event: threading.Event) -> None:
+        """Create placeholders for the files an uploaded manifest lists; the source is never read.
+
+        Filters apply to names and path components as in a walk; size rules only to
+        entries that carry a size. Companions are counted as skipped (there is nothing
+        to copy them from).
+        """
+        manifest_id = str(task.get('manifest') or '')
+        src = Path(task.get('src', ''))
+        dest_root = Path(task.get('dst', ''))
+        self.broadcast(f'[START] Importing manifest {manifest_id} -> {dest_root}')
+        meta = self.manifests.get(manifest_id)
+        if meta is None:
+            self.broadcast(f'[WARN] Manifest {manifest_id} not found, nothing imported')
+            self._finish(None)
+            return
+        try:
+            file_filter = FileFilter(task.get('filters'), videos_only=bool(task.get('videos_only', True)))
+        except ValueError as exc:
+            self.broadcast(f'[WARN] Invalid filters for manifest {manifest_id}: {exc}')
+            self._finish(None)
+            return
+        invalid = {'count': 0}
+        ignored = {'count': 0}
+        listed = {'files': 0, 'dirs': set()}
+
+        def batches():
+            entries = read_entries(self.manifests.data_path(manifest_id), meta.get('format', 'ndjson'), invalid)
+            for rel, batch in group_by_dir(entries, max(1, WALK_CHUNK_ENTRIES or 10000)):
+                listed['files'] += len(batch)
+                listed['dirs'].add(rel)
+                if rel and not all(file_filter.wants_dir(part) for part in rel.split('/')):
+                    ignored['count'] += len(batch)
+                    continue
+                create = []
+                for name, size in batch:
+                    if file_filter.classify(name) != PLACEHOLDER:
+                        continue
+                    if size is not None and file_filter.needs_size and not file_filter.wants_size(size):
+                        continue
+                    create.append(name)
+                ignored['count'] += len(batch) - len(create)
+                yield rel, create, []
+
+        totals = None
+        if meta.get('files'):
+            totals = (meta.get('dirs') or 0, meta['files'], 'manifest')
+        result = self._write_batches(f'manifest {manifest_id}', src, dest_root, batches(), state, stop_event, totals)
+        if result is None:
+            return
+        result['skipped'] += ignored['count']
+        if not stop_event.is_set():
+            # Known totals give the next import of this manifest a progress estimate.
+            self.manifests.update(manifest_id, files=listed['files'], dirs=len(listed['dirs']))
+        if invalid['count']:
+            self.broadcast(f'[WARN] Manifest {manifest_id}: skipped {invalid["count"]} invalid or unsafe paths')
+        result.update(mode='import', manifest=manifest_id, invalid=invalid['count'])
+        self._finish(result)
+
+    def _write_batches(self, label, src: Path, dest_root: Path, batches, state, stop_event, totals=None):
+        """Write ``(rel, placeholders, companions)`` batches under ``dest_root`` (apply / import).
+
+        Each batch is one placeholder-writer call, so each destination directory is
+        listed once per batch. Returns the result dict, or ``None`` if nothing could run.
+        """
+        if not self._is_allowed_path(dest_root):
+            self.broadcast(f'[WARN] Destination not allowed: {dest_root}')
+            self._finish(None)
+            return None
+        key = task_key(src, dest_root)
+        tracker = None
+        if state is not None:
+            tracker = ProgressTracker(state.progress, self.placeholder_writer.size)
+            if totals is not None:
+                tracker.set_total(*totals)
+        self.placeholder_writer.forget_dirs()
+        backed = skipped = dirs_done = handled = 0
+        try:
+            for rel, create, copy in batches:
+                if stop_event.is_set():
+                    break
+                if state is not None:
+                    state.wait_if_paused()
+                dirpath = os.path.join(src, rel) if rel else str(src)
+                dest_dir = os.path.join(dest_root, rel) if rel else str(dest_root)
+                created, passed = self._write_placeholders(dirpath, rel, dest_dir, key, create, False)
+                copied, not_copied = self._copy_companions(dirpath, rel, dest_dir, key, copy, False)
+                backed += created + copied
+                skipped += passed + not_copied
+                handled += len(create) + len(copy)
+                dirs_done += 1
+                if created + copied:
+                    self.m_files.inc(created + copied, outcome='created')
+                if passed + not_copied:
+                    self.m_files.inc(passed + not_copied, outcome='skipped')
+                if tracker is not None:
+                    tracker.update(dirs_done, handled, backed, skipped)
+                    if tracker.due(PROGRESS_REPORT_SECONDS):
+                        self.broadcast(f'[ETA] Task {state.id} {label}: {tracker.describe()}')
+        except (OSError, ValueError) as exc:
+            self.broadcast(f'[ERROR] Cannot read {label}: {exc}')
+        self.events.flush_summary()
+        if not stop_event.is_set():
+            tag = '[DONE]'
+        else:
+            tag = '[STOP]' if state is not None and not state.cancelled else '[CANCELLED]'
+        self.broadcast(f'{tag} {label}: {src} -> {dest_root} (backed={backed}, skipped={skipped})')
+        return {
+            'id': state.id if state is not None else None,
+            'src': str(src),
+            'dst': str(dest_root),
+            'backed': backed,
+            'skipped': skipped,
+            'cancelled': bool(state is not None and state.cancelled),
+        }
+
+    def _report_path(self, state: Optional[TaskState]) -> Path:
+        name = state.id if state is not None else time.strftime('%Y%m%d-%H%M%S')
+        return self.backup_dir / 'reports' / f'sync-{name}.tsv'
+
+    def _load_checkpoint(self, state: Optional[TaskState], src: Path, dest_root: Path) -> Optional[Dict]:
+        if state is None:
+            return None
+        checkpoint = self.task_store.load_checkpoint(state.id)
+        if checkpoint is None:
+            return None
+        if (
+            checkpoint.get('src') != str(src)
+            or checkpoint.get('dest_root') != str(dest_root)
+            or not isinstance(checkpoint.get('frontier'), list)
+        ):
+            self.broadcast(f'[WARN] Ignoring stale checkpoint for task {state.id}')
+            return None
+        return checkpoint
+
     def _finish(self, result: Optional[Dict]) -> None:
         with self._stats_lock:
-            self._current_task = None
             if result is not None:
                 self._last_result = result